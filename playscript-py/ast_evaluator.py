@@ -1,4 +1,5 @@
 from frontend import *
+from memo_cache import *
 
 
 
@@ -23,33 +24,22 @@ from frontend import *
 # }
 
 '''
- * 代表Return语句的返回值
+ * 语句执行后的状态，记在 ASTEvaluator.status 里。
+ * break/continue/return 不再用包装对象向上传递，block、循环和函数调用只需要看一下这个状态码。
 '''
-class ReturnObject():
-    def __init__(self, value):
-        self.returnValue = value  # 真正的返回值
-
-    # 在打印时输出ReturnObject
-    def toString() -> str:
-        return "ReturnObject"
-
-'''
- * 用于代表一个Break语句的对象
-'''
-class BreakObject():
-    def __init__(self):
-        pass
-    # 在打印时输出Break
-    def toString(self) -> str:
-        return "Break"
-# 创建唯一实例
-breakObject = BreakObject()
+NORMAL = 0
+BREAK = 1
+CONTINUE = 2
+RETURN = 3
+TAIL_CALL = 4  # return 语句里的尾调用（见 TailCallAnalyzer），要调用的函数和参数记在 ASTEvaluator.tailCall 里
 
 '''
  * PlayScript的对象
  * 本意是用来表示一个对象内部的field-value pairs。也可以用来装栈帧里的变量
 '''
 class PlayObject():    
+    __slots__ = ('fields',)
+
     def __init__(self):
         # 成员变量, Map<Variable, Object>
         self.fields = {}
@@ -71,29 +61,46 @@ class PlayObject():
  * 存放一个函数运行时的本地变量的值，包括参数的值
 '''
 class FunctionObject(PlayObject):
+    __slots__ = ('function', 'env')
+
     def __init__(self, function:Function):  # symbol/type/scope
         super().__init__()
         self.function = function
-        '''
-         * 接收者所在的scope。缺省是function的enclosingScope，也就是词法的Scope。
-         * 当赋值给一个函数型变量的时候，要修改receiverEnclosingScope等于这个变量的enclosingScope（这里不需要吧？）
-        '''
-        self.receiver:Variable = None
+        # 函数定义时所处的环境，也就是上一级帧单元的栈桢。调用时作为新栈桢的parentFrame
+        self.env:StackFrame = None
 
     def setFunction(self, function:Function):
           self.function = function
 
+'''
+ * 对象实例。成员变量不再放在Map里，而是按类的内存布局（Class.getFieldLayout()）放在一个list里，
+ * 用 Variable.offset 直接索引。
+'''
 class ClassObject(PlayObject):
-    def __init__(self):
-        super().__init__()
-        self.type:Class = None
+    __slots__ = ('type', 'env')
+
+    def __init__(self, theClass:Class):
+        self.type:Class = theClass
+        self.fields = [None] * len(theClass.getFieldLayout())
+        # 类定义时所处的环境。调用方法时，类的栈桢以它作为parentFrame
+        self.env:StackFrame = None
+
+    def getValue(self, variable:Variable):
+        return self.fields[variable.offset]
+
+    def setValue(self, variable:Variable, value):
+        self.fields[variable.offset] = value
 
 
+'''
+ * 栈桢。只有帧单元（根作用域、函数、类）才有栈桢，block 和 for 里的变量摊平到所属单元的栈桢里。
+ * 变量的值按 SlotResolver 分配的槽位存放在 slots 数组里。
+'''
 class StackFrame():
     def __init__(self, scope):
         if isinstance(scope, BlockScope):
             self.scope = scope  # 该frame所对应的scope
-            self.object = PlayObject()  # 实际存放变量的地方
+            self.object = PlayObject()
         elif isinstance(scope, FunctionObject):
             # 为函数调用，创建一个StackFrame
             object = scope
@@ -103,20 +110,17 @@ class StackFrame():
             object = scope
             self.scope = object.type
             self.object = object
+        # 实际存放变量的地方
+        self.slots = [None] * self.scope.frameSize
+        if isinstance(scope, ClassObject):
+            self.slots[0] = scope  # this
         '''
-        * 放parent scope所对应的frame的指针，就叫parentFrame吧，便于提高查找效率。
-        * 规则：如果是同一级函数调用，跟上一级的parentFrame相同；
-        * 如果是下一级的函数调用或For、If等block，parentFrame是自己；
-        * 如果是一个闭包（如何判断？），那么要带一个存放在堆里的环境。
+        * 放上一级帧单元所对应的frame的指针，就叫parentFrame吧，便于提高查找效率。
+        * 它在入栈之前由调用者设置：普通函数取定义它的帧单元的栈桢；
+        * 闭包和对象用创建时记下的环境（env）；For、If等block不单独建栈桢。
         '''
         self.parentFrame:StackFrame = None
     
-    # 本栈桢里有没有包含某个变量的数据
-    def contains(self, variable:Variable):
-        if self.object and self.object.fields:
-            return (variable in self.object.fields)
-        return False
-
     def toString(self) -> str:
         rtn = self.scope.toString()
         if self.parentFrame:
@@ -150,9 +154,6 @@ class MyLValue(LValue):
 
     def setValue(self, value):
         self.valueContainer.setValue(self.variable, value)
-        # 如果variable是函数型变量，那改变 functionObject.receiver
-        if isinstance(value, FunctionObject):
-            value.receiver = self.variable
 
     def getVariable(self):
         return self.variable
@@ -163,6 +164,24 @@ class MyLValue(LValue):
     def getValueContainer(self) -> PlayObject:
         return self.valueContainer
 
+# 栈桢里某个槽位的左值
+class SlotLValue(LValue):
+    def __init__(self, frame:StackFrame, variable:Variable):
+        self.frame = frame
+        self.variable = variable
+
+    def getValue(self):
+        return self.frame.slots[self.variable.slot]
+
+    def setValue(self, value):
+        self.frame.slots[self.variable.slot] = value
+
+    def getVariable(self):
+        return self.variable
+
+    def toString(self):
+        return "LValue of " + self.variable.name + " : " + str(self.getValue())
+
 
 
 
@@ -177,60 +196,34 @@ class ASTEvaluator(PlayScriptVisitor):
         self.traceStackFrame = False
         self.traceFunctionCall = False
 
+        # 当前的执行状态：NORMAL、BREAK、CONTINUE、RETURN 或 TAIL_CALL
+        self.status = NORMAL
+        # return语句的返回值，在函数调用返回时取走
+        self.returnValue = None
+        # 尾调用要调用的 (FunctionObject, 参数值)，由 functionCall 在当前函数结束以后调用
+        self.tailCall = None
+
+        # 每个类从父类到子类需要执行的成员变量初始化，Map<Class, List<VariableDeclaratorsContext>>
+        self.objectInits = {}
+        # 每个方法调用点的内联缓存，Map<FunctionCallContext, (Class, Function) 或 Map<Class, Function>>
+        self.inlineCaches = {}
+        # 每个二元运算节点按类型特化好的运算函数，Map<ExpressionContext, function>
+        self.binaryOps = {}
+
+        # 是否缓存纯函数的调用结果（-memoize）
+        self.memoize = False
+        # 每个函数的结果缓存，不能缓存的函数对应None。Map<Function, MemoCache>
+        self.memoCaches = {}
+
     ############################################################
     # 运行时 栈桢的管理
     '''
      * 栈桢入栈
-     * 其中最重要的任务，是要保证栈桢的parentFrame设置正确。否则：
-     * (1) 随着栈的变深，查找变量的性能会降低；
-     * (2) 甚至有可能找错栈桢，比如在递归(直接或间接)的场景下。
+     * 栈桢的parentFrame在入栈之前就已经设置好了，指向上一级帧单元的栈桢：
+     * 普通函数调用，由调用点按静态的层级差找到；闭包和对象，在创建时就记下了它们的环境（env）。
+     * 所以这里不需要再在栈里查找，入栈的时间跟栈的深度无关。
     '''
     def pushStack(self, frame:StackFrame):
-        if len(self.stack) > 0:
-            # 从栈顶到栈底依次查找
-            i:int = len(self.stack) - 1
-            while i > 0:
-                f:StackFrame = self.stack[i]
-                # 如果新加入的栈桢，跟某个已有的栈桢的enclosingScope是一样的，那么这俩的parentFrame也一样。
-                # 因为它们原本就是同一级的。
-                # 比如：
-                # void foo(){};
-                # void bar(foo());
-                # 或者：
-                # void foo();
-                # if (...){
-                #     foo();
-                # }
-                if f.scope.enclosingScope == frame.scope.enclosingScope:
-                    frame.parentFrame = f.parentFrame
-                    break
-                # 如果新加入的栈桢，是某个已有的栈桢的下一级，那么就把把这个父子关系建立起来。比如：
-                # void foo(){
-                #     if (...){  //把这个块往栈桢里加的时候，就符合这个条件。
-                #     }
-                # }
-                # 再比如,下面的例子:
-                # class MyClass{
-                #     void foo();
-                # }
-                # MyClass c = MyClass();  //先加Class的栈桢，里面有类的属性，包括父类的
-                # c.foo();                //再加foo()的栈桢
-                elif f.scope == frame.scope.enclosingScope:
-                    frame.parentFrame = f
-                    break
-                # 这是针对函数可能是一等公民的情况。这个时候，函数运行时的作用域，与声明时的作用域会不一致。
-                # 这里设计了一个“receiver”的机制，意思是这个函数是被哪个变量接收了。要按照这个receiver的作用域来判断。
-                elif isinstance(frame.object, FunctionObject):
-                    functionObject:FunctionObject = frame.object
-                    if functionObject.receiver and functionObject.receiver.enclosingScope == f.scope:
-                        frame.parentFrame = f
-                        break
-                i -= 1
-
-            if frame.parentFrame is None:
-                # 这里不会发生？
-                frame.parentFrame = self.stack[-1]
-
         self.stack.append(frame)
 
         if self.traceStackFrame:
@@ -246,58 +239,31 @@ class ASTEvaluator(PlayScriptVisitor):
         print("-----------------------------\n")
 
 
-    def getLValue(self, variable:Variable) -> LValue:
+    '''
+     * 找到某个帧单元的栈桢。
+     * 帧单元的层级是静态确定的，从当前栈桢沿着 parentFrame 向外走固定的层数就是了。
+    '''
+    def frameOfUnit(self, unit:Scope) -> StackFrame:
         f:StackFrame = self.stack[-1]
-        valueContainer:PlayObject = None
-        while f:
-            if f.scope.containsSymbol(variable):  # 对于对象来说，会查找所有父类的属性
-                valueContainer = f.object
-                break
+        depth = f.scope.unitLevel - unit.unitLevel
+        while depth > 0:
             f = f.parentFrame
+            depth -= 1
+        return f
 
-        # 通过正常的作用域找不到，就从闭包里找
-        # PlayObject中可能有一些变量，其作用域跟 StackFrame.scope 是不同的。
-        if valueContainer is None:
-            f = self.stack[-1]
-            while f:
-                if f.contains(variable):
-                    valueContainer = f.object
-                    break
-                f = f.parentFrame
-
-        lvalue = MyLValue(valueContainer, variable)
-        return lvalue
-
-
-    ############################################################
-    # 为闭包获取环境变量的值
     '''
-     * 为闭包获取环境变量的值
-     * @param function 闭包所关联的函数。这个函数会访问一些环境变量。
-     * @param valueContainer 存放环境变量的值的容器
+     * 变量的位置在语义分析时已经确定：(所在的帧单元, 槽位)。
+     * 类的成员变量存在 this 对象里，this 在方法（或类）栈桢的0号槽位。
     '''
-    def getClosureValues(self, function:Function, valueContainer:PlayObject):
-        if function.closureVariables:
-            for var in function.closureVariables:
-                lValue:LValue = self.getLValue(var)  # 现在还可以从栈里取，退出函数以后就不行了
-                value = lValue.getValue()
-                valueContainer.setValue(var, value)
+    def getLValue(self, variable:Variable) -> LValue:
+        if isinstance(variable, This) or isinstance(variable, Super):
+            thisObject = self.frameOfUnit(SlotResolver.thisUnit(self.stack[-1].scope)).slots[0]
+            return MyLValue(thisObject, variable)
+        elif isinstance(variable.enclosingScope, Class):
+            thisObject = self.frameOfUnit(SlotResolver.thisUnit(self.stack[-1].scope)).slots[0]
+            return MyLValue(thisObject, variable)
+        return SlotLValue(self.frameOfUnit(variable.enclosingScope.unit), variable)
 
-    '''
-     * 为从函数中返回的对象设置闭包值。因为多个函数变量型属性可能共享值，所以要打包到ClassObject中，而不是functionObject中。见：test-closure-mammal.play
-    '''
-    def getClosureValues_2(self, classObject:ClassObject):
-        # 先放在一个临时对象里，避免对classObject即读又写
-        tempObject:PlayObject = PlayObject()
-        for v in classObject.fields:
-            # print(v.toString())
-            if isinstance(v.type, FunctionType):
-                object = classObject.fields.get(v, None)
-                if object:
-                    functionObject:FunctionObject = object
-                    self.getClosureValues(functionObject.function, tempObject)
-
-        classObject.fields.update(tempObject.fields)
 
     # ///////////////////////////////////////////////////////////
     # /// 对象初始化
@@ -305,33 +271,42 @@ class ASTEvaluator(PlayScriptVisitor):
     # 从父类到子类层层执行缺省的初始化方法，即不带参数的初始化方法
     # 返回一个ClassObject，其含有从父类到子类所有的Variable
     def createAndInitClassObject(self, theClass:Class) -> ClassObject:
-        obj:ClassObject = ClassObject()
-        obj.type = theClass
+        # 所有成员变量缺省都是None，不允许有未初始化的
+        obj:ClassObject = ClassObject(theClass)
+        obj.env = self.frameOfUnit(SlotResolver.parentUnit(theClass))
+        inits = self.objectInits.get(theClass)
+        if inits is None:
+            inits = self.defaultObjectInits(theClass)
+            self.objectInits[theClass] = inits
+        # 执行缺省的初始化方法
+        if inits:
+            frame:StackFrame = StackFrame(obj)
+            frame.parentFrame = obj.env
+            self.pushStack(frame)
+            for ctx in inits:
+                self.visitVariableDeclarators(ctx)
+            self.popStack()
+        return obj
+
+    # 类的缺省初始化方法：从父类到子类，所有带初始值的成员变量声明。只计算一次
+    def defaultObjectInits(self, theClass:Class) -> List[PlayScriptParser.VariableDeclaratorsContext]:
         ancestorChain:List[Class] = []
-        # 从上到下执行缺省的初始化方法
-        ancestorChain.append(theClass)
-        while theClass.getParentClass():
-            ancestorChain.append(theClass.getParentClass())
+        while theClass:
+            ancestorChain.append(theClass)
             theClass = theClass.getParentClass()
-        # 执行缺省的初始化方法
-        frame:StackFrame = StackFrame(obj)
-        self.pushStack(frame)
+        inits = []
+        # 从上到下执行缺省的初始化方法
         while len(ancestorChain) > 0:
             c:Class = ancestorChain.pop()
-            self.defaultObjectInit(c, obj)
-        self.popStack()
-        return obj
-
-    # 类的缺省初始化方法
-    def defaultObjectInit(self, theClass:Class, obj:ClassObject):
-        for symbol in theClass.symbols:
-            # 把变量加到obj里，缺省先都初始化成None，不允许有未初始化的
-            if isinstance(symbol, Variable):
-                obj.fields[symbol] = None
-        # 执行缺省初始化
-        ctx:PlayScriptParser.ClassBodyContext = theClass.ctx.classBody()
-        self.visitClassBody(ctx)
+            for child in c.ctx.classBody().classBodyDeclaration():
+                member = child.memberDeclaration()
+                if member and member.fieldDeclaration():
+                    declarators = member.fieldDeclaration().variableDeclarators()
+                    # 没有初始值的成员变量，保持None就行了
+                    if any(d.variableInitializer() for d in declarators.variableDeclarator()):
+                        inits.append(declarators)
         # TODO 其实这里还没干完活。还需要调用显式声明的构造方法
+        return inits
 
     ############################################################
     # 内置函数
@@ -348,109 +323,96 @@ class ASTEvaluator(PlayScriptVisitor):
 
     ############################################################
     # 各种运算
-    def add(self, obj1, obj2, targetType:Type):
-        rtn = None
-        if targetType == String:
-            rtn = str(obj1) + str(obj2)
-        elif targetType == Integer:
-            rtn = obj1 + obj2
-        elif targetType == Float:
-            rtn = obj1 + obj2
-        else:
-            print("unsupported add operation")
-        return rtn
-
-    def minus(self, obj1, obj2, targetType:Type):
-        rtn = None
-        if targetType == Integer:
-            rtn = obj1 - obj2
-        elif targetType == Float:
-            rtn = obj1 - obj2
-        else:
-            print("unsupported minus operation")
-        return rtn
-
-    def mul(self, obj1, obj2, targetType:Type):
-        rtn = None
-        if targetType == Integer:
-            rtn = obj1 * obj2
-        elif targetType == Float:
-            rtn = obj1 * obj2
-        else:
-            print("unsupported mul operation")
-        return rtn
-    
-    def div(self, obj1, obj2, targetType:Type):
-        # TODO 检查 devided by zero 的错误
-        rtn = None
-        if targetType == Integer:
-            rtn = obj1 / obj2
-        elif targetType == Float:
-            rtn = obj1 / obj2
-        else:
-            print("unsupported div operation")
-        return rtn
-
-    def EQ(self, obj1, obj2, targetType:Type):
-        rtn = False
-        if targetType == Integer:
-            rtn = int(obj1) == int(obj2)
-        elif targetType == Float:
-            rtn = float(obj1) == float(obj2)
-        # 对于对象实例、函数，直接比较对象引用
-        else:
-            rtn = obj1 == obj2
-        return rtn
-    
-    def GE(self, obj1, obj2, targetType:Type):
-        rtn = False
-        if targetType == Integer:
-            rtn = int(obj1) >= int(obj2)
-        elif targetType == Float:
-            rtn = float(obj1) >= float(obj2)
-        # 对于函数，不支持比较大小。对于对象，不支持运算符重载
-        return rtn
-    
-    def GT(self, obj1, obj2, targetType:Type):
-        rtn = False
-        if targetType == Integer:
-            rtn = int(obj1) > int(obj2)
-        elif targetType == Float:
-            rtn = float(obj1) > float(obj2)
-        # 对于函数，不支持比较大小。对于对象，不支持运算符重载
-        return rtn
-    
-    def LE(self, obj1, obj2, targetType:Type):
-        rtn = False
-        if targetType == Integer:
-            rtn = int(obj1) <= int(obj2)
-        elif targetType == Float:
-            rtn = float(obj1) <= float(obj2)
-        # 对于函数，不支持比较大小。对于对象，不支持运算符重载
-        return rtn
-
-    def LT(self, obj1, obj2, targetType:Type):
-        rtn = False
-        if targetType == Integer:
-            rtn = int(obj1) < int(obj2)
-        elif targetType == Float:
-            rtn = float(obj1) < float(obj2)
-        # 对于函数，不支持比较大小。对于对象，不支持运算符重载
-        return rtn
+    # 语义分析之后，每个表达式的类型就确定了。所以每个二元运算的节点，第一次执行时就按类型选好一个
+    # 特化的运算函数（整数加法、浮点数比较、字符串连接等），以后直接调用，不需要每次都判断类型。
+
+    # 某个二元运算节点的运算函数，(obj1, obj2) -> 结果。复合赋值（+= 等）用对应的算术运算
+    def binaryOperation(self, ctx:PlayScriptParser.ExpressionContext):
+        op = self.binaryOps.get(ctx)
+        if op is None:
+            op = self.specializeBinary(ctx)
+            self.binaryOps[ctx] = op
+        return op
+
+    def specializeBinary(self, ctx:PlayScriptParser.ExpressionContext):
+        bop_type = ctx.bop.type
+        # 本节点期待的数据类型
+        type:Type = self.at.typeOfNode[ctx]
+        # 左右两个子节点的类型
+        type1 = self.at.typeOfNode[ctx.expression(0)]
+        type2 = self.at.typeOfNode[ctx.expression(1)]
+
+        if bop_type == PlayScriptParser.ADD or bop_type == PlayScriptParser.ADD_ASSIGN:
+            if type == String:
+                return lambda obj1, obj2: str(obj1) + str(obj2)
+            return self.arithmetic(type, "add", lambda obj1, obj2: obj1 + obj2)
+        elif bop_type == PlayScriptParser.SUB or bop_type == PlayScriptParser.SUB_ASSIGN:
+            return self.arithmetic(type, "minus", lambda obj1, obj2: obj1 - obj2)
+        elif bop_type == PlayScriptParser.MUL or bop_type == PlayScriptParser.MUL_ASSIGN:
+            return self.arithmetic(type, "mul", lambda obj1, obj2: obj1 * obj2)
+        elif bop_type == PlayScriptParser.DIV or bop_type == PlayScriptParser.DIV_ASSIGN:
+            # TODO 检查 devided by zero 的错误
+            return self.arithmetic(type, "div", lambda obj1, obj2: obj1 / obj2)
+        elif bop_type == PlayScriptParser.MOD or bop_type == PlayScriptParser.MOD_ASSIGN:
+            return self.arithmetic(type, "mod", lambda obj1, obj2: obj1 % obj2)
+        elif bop_type == PlayScriptParser.EQUAL or bop_type == PlayScriptParser.NOTEQUAL:
+            # a == null，左边是个class，右边是 Null。对于对象实例、函数，直接比较对象引用
+            upperType = None
+            if PrimitiveType.isNumeric(type1) and PrimitiveType.isNumeric(type2):
+                upperType = PrimitiveType.getUpperType(type1, type2)
+            if bop_type == PlayScriptParser.EQUAL:
+                if upperType == Integer:
+                    return lambda obj1, obj2: int(obj1) == int(obj2)
+                elif upperType == Float:
+                    return lambda obj1, obj2: float(obj1) == float(obj2)
+                return lambda obj1, obj2: obj1 == obj2
+            if upperType == Integer:
+                return lambda obj1, obj2: int(obj1) != int(obj2)
+            elif upperType == Float:
+                return lambda obj1, obj2: float(obj1) != float(obj2)
+            return lambda obj1, obj2: obj1 != obj2
+        elif bop_type in (PlayScriptParser.LE, PlayScriptParser.LT, PlayScriptParser.GE, PlayScriptParser.GT):
+            upperType = PrimitiveType.getUpperType(type1, type2)
+            if upperType == Integer:
+                if bop_type == PlayScriptParser.LE:
+                    return lambda obj1, obj2: int(obj1) <= int(obj2)
+                elif bop_type == PlayScriptParser.LT:
+                    return lambda obj1, obj2: int(obj1) < int(obj2)
+                elif bop_type == PlayScriptParser.GE:
+                    return lambda obj1, obj2: int(obj1) >= int(obj2)
+                return lambda obj1, obj2: int(obj1) > int(obj2)
+            elif upperType == Float:
+                if bop_type == PlayScriptParser.LE:
+                    return lambda obj1, obj2: float(obj1) <= float(obj2)
+                elif bop_type == PlayScriptParser.LT:
+                    return lambda obj1, obj2: float(obj1) < float(obj2)
+                elif bop_type == PlayScriptParser.GE:
+                    return lambda obj1, obj2: float(obj1) >= float(obj2)
+                return lambda obj1, obj2: float(obj1) > float(obj2)
+            # 对于函数，不支持比较大小。对于对象，不支持运算符重载
+            return lambda obj1, obj2: False
+        elif bop_type == PlayScriptParser.AND:
+            return lambda obj1, obj2: obj1 and obj2
+        elif bop_type == PlayScriptParser.OR:
+            return lambda obj1, obj2: obj1 or obj2
+        # 其他运算暂不支持
+        return lambda obj1, obj2: None
+
+    # 数值运算只支持整数和浮点数
+    def arithmetic(self, type:Type, name:str, op):
+        if type == Integer or type == Float:
+            return op
+        def unsupported(obj1, obj2):
+            print("unsupported " + name + " operation")
+            return None
+        return unsupported
 
     ############################################################
     # visit每个节点
 
     def visitBlock(self, ctx:PlayScriptParser.BlockContext):
-        scope:BlockScope = self.at.node2Scope.get(ctx, None)
-        if scope:  # 有些block是不对应scope的，比如函数底下的block
-            frame = StackFrame(scope)
-            # frame.parentFrame = stack.peek();
-            self.pushStack(frame)
-        rtn = self.visitBlockStatements(ctx.blockStatements())
-        if scope:
-            self.popStack()
-        return rtn
+        # block 里的变量已经摊平到所属帧单元的栈桢里了，不需要再建立新的栈桢
+        return self.visitBlockStatements(ctx.blockStatements())
 
     def visitBlockStatement(self, ctx:PlayScriptParser.BlockStatementContext):
         rtn = None
@@ -461,9 +423,22 @@ class ASTEvaluator(PlayScriptVisitor):
         return rtn
 
     def visitExpression(self, ctx:PlayScriptParser.ExpressionContext):
+        # 常量折叠过的表达式，直接返回它的值
+        if ctx in self.at.constOfNode:
+            return self.at.constOfNode[ctx]
         rtn = None
-        if ctx.bop and len(ctx.expression()) >= 2:
-            ## TODO 还未支持 ? : 三目运算符
+        if ctx.bop and ctx.bop.type == PlayScriptParser.QUESTION:
+            # 三目运算符：只计算选中的那个分支
+            condition = self.visitExpression(ctx.expression(0))
+            if isinstance(condition, LValue):
+                condition = condition.getValue()
+            rtn = self.visitExpression(ctx.expression(1) if condition else ctx.expression(2))
+            if isinstance(rtn, LValue):
+                rtn = rtn.getValue()
+        elif ctx.bop and ctx.bop.type == PlayScriptParser.INSTANCEOF:
+            # instanceof 的结果是null，不计算左边的表达式，跟原来一样
+            rtn = None
+        elif ctx.bop and len(ctx.expression()) >= 2:
             left = self.visitExpression(ctx.expression(0))
             right = self.visitExpression(ctx.expression(1))
             leftObject = left
@@ -474,46 +449,8 @@ class ASTEvaluator(PlayScriptVisitor):
             if isinstance(right, LValue):
                 rightObject = right.getValue()
 
-            # 本节点期待的数据类型
-            type:Type = self.at.typeOfNode[ctx]
-
-            # 左右两个子节点的类型
-            type1 = self.at.typeOfNode[ctx.expression(0)]
-            type2 = self.at.typeOfNode[ctx.expression(1)]
-
             bop_type = ctx.bop.type
-            if bop_type == PlayScriptParser.ADD:
-                rtn = self.add(leftObject, rightObject, type)
-            elif bop_type == PlayScriptParser.SUB:
-                rtn = self.minus(leftObject, rightObject, type)
-            elif bop_type == PlayScriptParser.MUL:
-                rtn = self.mul(leftObject, rightObject, type)
-            elif bop_type == PlayScriptParser.DIV:
-                rtn = self.div(leftObject, rightObject, type)
-            elif bop_type == PlayScriptParser.EQUAL:
-                # a == null，左边是个class，右边是 Null
-                if PrimitiveType.isNumeric(type1) and PrimitiveType.isNumeric(type2):
-                    rtn = self.EQ(leftObject, rightObject, PrimitiveType.getUpperType(type1, type2))
-                else:
-                    rtn = self.EQ(leftObject, rightObject, None)
-            elif bop_type == PlayScriptParser.NOTEQUAL:
-                if PrimitiveType.isNumeric(type1) and PrimitiveType.isNumeric(type2):
-                    rtn = not self.EQ(leftObject, rightObject, PrimitiveType.getUpperType(type1, type2))
-                else:
-                    rtn = not self.EQ(leftObject, rightObject, None)
-            elif bop_type == PlayScriptParser.LE:
-                rtn = self.LE(leftObject, rightObject, PrimitiveType.getUpperType(type1, type2))
-            elif bop_type == PlayScriptParser.LT:
-                rtn = self.LT(leftObject, rightObject, PrimitiveType.getUpperType(type1, type2))
-            elif bop_type == PlayScriptParser.GE:
-                rtn = self.GE(leftObject, rightObject, PrimitiveType.getUpperType(type1, type2))
-            elif bop_type == PlayScriptParser.GT:
-                rtn = self.GT(leftObject, rightObject, PrimitiveType.getUpperType(type1, type2))
-            elif bop_type == PlayScriptParser.AND:
-                rtn = leftObject and rightObject
-            elif bop_type == PlayScriptParser.OR:
-                rtn = leftObject or rightObject
-            elif bop_type == PlayScriptParser.ASSIGN:
+            if bop_type == PlayScriptParser.ASSIGN:
                 # 注意：这里赋值，不用做类型检查，因为前面语义分析已经做了
                 if isinstance(left, LValue):
                     left.setValue(rightObject)
@@ -524,7 +461,7 @@ class ASTEvaluator(PlayScriptVisitor):
             elif bop_type == PlayScriptParser.ADD_ASSIGN:
                 # 注意：这里赋值，不用做类型检查，因为前面语义分析已经做了
                 if isinstance(left, LValue):
-                    rtn = self.add(leftObject, rightObject, type)
+                    rtn = self.binaryOperation(ctx)(leftObject, rightObject)
                     left.setValue(rtn)
                 else:
                     print("Unsupported feature during add assignment")
@@ -532,7 +469,7 @@ class ASTEvaluator(PlayScriptVisitor):
             elif bop_type == PlayScriptParser.SUB_ASSIGN:
                 # 注意：这里赋值，不用做类型检查，因为前面语义分析已经做了
                 if isinstance(left, LValue):
-                    rtn = self.minus(leftObject, rightObject, type)
+                    rtn = self.binaryOperation(ctx)(leftObject, rightObject)
                     left.setValue(rtn)
                 else:
                     print("Unsupported feature during add assignment")
@@ -540,7 +477,7 @@ class ASTEvaluator(PlayScriptVisitor):
             elif bop_type == PlayScriptParser.MUL_ASSIGN:
                 # 注意：这里赋值，不用做类型检查，因为前面语义分析已经做了
                 if isinstance(left, LValue):
-                    rtn = self.mul(leftObject, rightObject, type)
+                    rtn = self.binaryOperation(ctx)(leftObject, rightObject)
                     left.setValue(rtn)
                 else:
                     print("Unsupported feature during add assignment")
@@ -548,11 +485,22 @@ class ASTEvaluator(PlayScriptVisitor):
             elif bop_type == PlayScriptParser.DIV_ASSIGN:
                 # 注意：这里赋值，不用做类型检查，因为前面语义分析已经做了
                 if isinstance(left, LValue):
-                    rtn = self.div(leftObject, rightObject, type)
+                    rtn = self.binaryOperation(ctx)(leftObject, rightObject)
                     left.setValue(rtn)
                 else:
                     print("Unsupported feature during add assignment")
                     raise Exception("ERROR")
+            elif bop_type == PlayScriptParser.MOD_ASSIGN:
+                # 注意：这里赋值，不用做类型检查，因为前面语义分析已经做了
+                if isinstance(left, LValue):
+                    rtn = self.binaryOperation(ctx)(leftObject, rightObject)
+                    left.setValue(rtn)
+                else:
+                    print("Unsupported feature during mod assignment")
+                    raise Exception("ERROR")
+            else:
+                # 算术、比较和逻辑运算，直接调用按类型特化好的运算函数
+                rtn = self.binaryOperation(ctx)(leftObject, rightObject)
         elif ctx.bop and ctx.bop.type == PlayScriptParser.DOT:
             # 此语法是左递归的，算法体现这一点
             leftObject = self.visitExpression(ctx.expression(0))
@@ -596,36 +544,40 @@ class ASTEvaluator(PlayScriptVisitor):
                 raise Exception("ERROR")
             token_type = ctx.postfix.type
             if token_type == PlayScriptParser.INC:
-                if type == Integer:
+                if PrimitiveType.isNumeric(type):
                     lValue.setValue(value + 1)
                     rtn = value
             elif token_type == PlayScriptParser.DEC:
-                if type == Integer:
+                if PrimitiveType.isNumeric(type):
                     lValue.setValue(value - 1)
                     rtn = value
         elif ctx.prefix:
-            # 前缀操作，例如：++i 或 --i  或 !i
+            # 前缀操作，例如：++i 或 --i  或 !i 或 -i
             value = self.visitExpression(ctx.expression(0))
             lValue:LValue = None
             type = self.at.typeOfNode[ctx.expression(0)]
+            token_type = ctx.prefix.type
             if isinstance(value, LValue):
                 lValue = value
                 value = lValue.getValue()
-            else:
-                # 必须能取左值
+            elif token_type == PlayScriptParser.INC or token_type == PlayScriptParser.DEC:
+                # ++ 和 -- 必须能取左值
                 print("has to be LValue: " + ctx.getText())
                 raise Exception("ERROR")
-            token_type = ctx.prefix.type
             if token_type == PlayScriptParser.INC:
-                if type == Integer:
+                if PrimitiveType.isNumeric(type):
                     lValue.setValue(value + 1)
                     rtn = value + 1
             elif token_type == PlayScriptParser.DEC:
-                if type == Integer:
+                if PrimitiveType.isNumeric(type):
                     lValue.setValue(value - 1)
                     rtn = value - 1
             elif token_type == PlayScriptParser.BANG:
                 rtn = not value
+            elif token_type == PlayScriptParser.SUB:
+                rtn = -value
+            elif token_type == PlayScriptParser.ADD:
+                rtn = value
         elif ctx.functionCall():  # functionCall
             rtn = self.visitFunctionCall(ctx.functionCall())
         return rtn
@@ -646,42 +598,7 @@ class ASTEvaluator(PlayScriptVisitor):
         return rtn
 
     def visitLiteral(self, ctx:PlayScriptParser.LiteralContext):
-        rtn = None
-        # 整数
-        if ctx.integerLiteral():
-            rtn = self.visitIntegerLiteral(ctx.integerLiteral())
-        # 浮点数
-        elif ctx.floatLiteral():
-            rtn = self.visitFloatLiteral(ctx.floatLiteral())
-        # 布尔值
-        elif ctx.BOOL_LITERAL():
-            if ctx.BOOL_LITERAL().getText() == "true":
-                rtn = True
-            else:
-                rtn = False
-        # 字符串
-        elif ctx.STRING_LITERAL():
-            # TODO 考虑转义字符
-            rtn = ctx.STRING_LITERAL().getText()
-            rtn = rtn[1:]
-            rtn = rtn[:-1]
-        # null字面量
-        elif ctx.NULL_LITERAL():
-            # rtn = NullObject.instance()
-            rtn = None
-        return rtn
-
-    def visitIntegerLiteral(self, ctx:PlayScriptParser.IntegerLiteralContext):
-        rtn = None
-        if ctx.DECIMAL_LITERAL():
-            rtn = int(ctx.DECIMAL_LITERAL().getText())
-        else:
-            # TODO 处理 HEX LITERAL
-            pass
-        return rtn
-
-    def visitFloatLiteral(self, ctx:PlayScriptParser.FloatLiteralContext):
-        return float(ctx.getText())
+        return ConstantFolder.literalValue(ctx)
 
     def visitParExpression(self, ctx:PlayScriptParser.ParExpressionContext):
         return self.visitExpression(ctx.expression())
@@ -697,7 +614,9 @@ class ASTEvaluator(PlayScriptVisitor):
             if isinstance(symbol, Variable):
                 rtn = self.getLValue(symbol)
             elif isinstance(symbol, Function):
+                # 函数作为值来使用，带上它定义时所处的环境
                 obj:FunctionObject = FunctionObject(symbol)
+                obj.env = self.frameOfUnit(SlotResolver.parentUnit(symbol))
                 rtn = obj
         # 括号括起来的表达式
         elif ctx.expression():
@@ -748,25 +667,25 @@ class ASTEvaluator(PlayScriptVisitor):
                     if condition:
                         # 执行while后面的语句
                         rtn = self.visitStatement(ctx.statement(0))
-                        # break
-                        if isinstance(rtn, BreakObject):
-                            rtn = None  # 清除BreakObject，也就是只跳出一层循环，否则会继续向外层返回 breakObject，导致一个break就能退出所有循环，不符合预期的语义设计
-                            break
-                        # return
-                        elif isinstance(rtn, ReturnObject):
-                            break
+                        if self.status:
+                            # break
+                            if self.status == BREAK:
+                                self.status = NORMAL  # 只跳出一层循环，否则一个break就能退出所有循环，不符合预期的语义设计
+                                rtn = None
+                                break
+                            # continue，直接进入下一次循环
+                            elif self.status == CONTINUE:
+                                self.status = NORMAL
+                            # return
+                            else:
+                                break
                         # 注意：考虑到在 for/while循环、函数体内出现 break/return 语句的各种情况，似乎这里该有很多异常情况要处理
                         # 但因为前面的语义分析阶段已经检查并排除了所以可能的异常，所以这里不用担心。（语义分析阶段对 break/return 的合法性检查还不够完整！）
                     else:
                         break
         # for循环
         elif ctx.FOR():
-            # 添加 StackFrame
-            scope:BlockScope = self.at.node2Scope[ctx]
-            frame:StackFrame = StackFrame(scope)
-            # frame.parentFrame = stack.peek();
-            self.pushStack(frame)
-
+            # for 里的变量也摊平到了所属帧单元的栈桢里
             forControl:PlayScriptParser.ForControlContext = ctx.forControl()
             if forControl.enhancedForControl():
                 # TODO
@@ -788,56 +707,58 @@ class ASTEvaluator(PlayScriptVisitor):
                     if condition:
                         # 执行for的语句体
                         rtn = self.visitStatement(ctx.statement(0))
-                        # 处理break
-                        if isinstance(rtn, BreakObject):
-                            rtn = None  # 清除BreakObject，也就是只跳出一层循环，否则会继续向外层返回 breakObject，导致一个break就能退出所有循环，不符合预期的语义设计
-                            break
-                        # return
-                        elif isinstance(rtn, ReturnObject):
-                            break
+                        if self.status:
+                            # 处理break
+                            if self.status == BREAK:
+                                self.status = NORMAL  # 只跳出一层循环，否则一个break就能退出所有循环，不符合预期的语义设计
+                                rtn = None
+                                break
+                            # continue，还要执行forUpdate
+                            elif self.status == CONTINUE:
+                                self.status = NORMAL
+                            # return
+                            else:
+                                break
                         # 执行forUpdate，通常是“i++”这样的语句。这个执行顺序不能出错
                         if forControl.forUpdate:
                             self.visitExpressionList(forControl.forUpdate)
                     else:
                         break
-            # 去掉StackFrame
-            self.popStack()
         # block
         elif ctx.blockLabel:
             rtn = self.visitBlock(ctx.blockLabel)
         # break语句
         elif ctx.BREAK():
-            rtn = breakObject
+            self.status = BREAK
+        # continue语句
+        elif ctx.CONTINUE():
+            self.status = CONTINUE
         # return语句
         elif ctx.RETURN():
             rtn = None
+            call = ctx.expression().functionCall() if ctx.expression() else None
+            if call in self.at.tailCalls:
+                # 尾调用：在当前栈桢里找到函数、算好参数，由 functionCall 在当前函数结束以后再调用，Python 的栈不会变深
+                self.tailCall = (self.getFuntionObject(call), self.calcParamValues(call))
+                self.status = TAIL_CALL
+                return None
             if ctx.expression():
                 rtn = self.visitExpression(ctx.expression())
                 # return语句应该不需要左值   //TODO 其它取左值的地方也需要优化，目前都是取左值。统统返回左值，如果上层需要的是右值，再转成右值。左值的表达能力比右值强
                 if isinstance(rtn, LValue):
                     rtn = rtn.getValue()
-                # 把闭包涉及的环境变量都打包带走
-                if isinstance(rtn, FunctionObject):
-                    functionObject:FunctionObject = rtn
-                    self.getClosureValues(functionObject.function, functionObject)
-                    # function所需要的ClosureVariable在语义分析环节已经记录，这里要在当下的作用域取出那些闭包变量对应的值，记录在functionObject（PlayObject）里，作为这个FunctionObject独有的闭包环境变量
-                    # 注意，语义分析在计算闭包变量时，可能算多了，比如把某个全局变量算了进来，这里没关系，因为后续执行这个函数变量对应的函数时，是优先按作用域取值的，作用域里都没有，才从闭包环境里取
-                    # 这只是一种闭包实现方式而已
-                # 如果返回的是一个对象，那么检查它的所有属性里有没有是闭包的。 TODO 如果属性仍然是一个对象，可能就要向下递归查找了。
-                elif isinstance(rtn, ClassObject):
-                    classObject:ClassObject = rtn
-                    # for v in classObject.fields:
-                    #     print(v.toString())
-                    self.getClosureValues_2(classObject)
-
-            # 把真实的返回值封装在一个ReturnObject对象里，告诉visitBlockStatements停止执行下面的语句
-            rtn = ReturnObject(rtn)
-        # 刚开始看，不明白 statement语句为什么需要返回值，实际上这是为了实现 break/return 功能所需的设计
-        # statement 语句共有3种返回值：breakObject、returnObject、other，后续在处理这个返回值时，有4个原则：
-        #（1）blockStatements，若其某个语句返回了 break/return，必须直接返回，不再执行后面的语句，同时向上传递 break/return
-        #（2）for/while 每次执行其statement语句，都要检查返回值，若为break，则退出循环，并内部消化掉（将rtn置为None）；若为return，则退出循环，并且向上传递return
-        #（3）functionCall表达式，函数体执行过程中，若其某个语句返回了 return，必须直接返回，不再执行后面的语句。并且functionCall表达式语句，需要消化掉return（取出returnValue向上返回）
-        #（4）其余语句，返回下级语句的返回值即可，不需要特别处理
+                # 闭包不需要在这里打包环境变量：FunctionObject 在创建时就带上了它定义时的栈桢（env），
+                # 栈桢出栈以后，只要还被闭包引用着，就不会消失
+
+            # 返回值先存起来，并告诉visitBlockStatements停止执行下面的语句
+            self.returnValue = rtn
+            self.status = RETURN
+        # break/continue/return 语句只是设置 self.status，后续在处理这个状态时，有4个原则：
+        #（1）blockStatements，若执行某个语句后状态不是NORMAL，必须直接返回，不再执行后面的语句，状态继续向上传递
+        #（2）for/while 每次执行其statement语句，都要检查状态，若为break，则退出循环；若为continue，则进入下一次循环，这两种状态都在内部消化掉（恢复成NORMAL）；若为return，则退出循环，并且向上传递
+        #（3）functionCall表达式，函数体执行完后，若状态为return，需要消化掉它（恢复成NORMAL），并取出returnValue向上返回；
+        #     若状态为tail call，则接着调用 tailCall 里的函数，把它的结果作为自己的结果
+        #（4）其余语句，不需要特别处理
         # PS：如果没有及时消化掉 break，会出现：嵌套的多层循环深处，一个break就退出了所有循环
         # PS：如果没有及时消化掉 return，会出现：但凡执行了某个函数调用（FunctionCall)，它的一个return，就让程序直接终止并退出了
         # 注意：break/return的功能实现，还依赖于语义分析阶段检查 break/return 的合法性：break必须处在for/while里，return必须处在函数体里
@@ -854,6 +775,9 @@ class ASTEvaluator(PlayScriptVisitor):
             if isinstance(rtn, LValue):
                 rtn = rtn.getValue()
             lValue.setValue(rtn)
+        elif not isinstance(lValue, MyLValue):
+            # 每次进入 block 都是一个新的变量，没有初始化的变量是 None
+            lValue.setValue(None)
         return rtn
 
     def visitVariableDeclaratorId(self, ctx:PlayScriptParser.VariableDeclaratorIdContext):
@@ -879,12 +803,8 @@ class ASTEvaluator(PlayScriptVisitor):
         rtn = None
         for child in ctx.blockStatement():
             rtn = self.visitBlockStatement(child)
-            # 如果返回的是break，那么不执行下面的statement
-            if isinstance(rtn, BreakObject):
-                break
-            # 碰到Return, 退出函数
-            # TODO 要能层层退出一个个block，弹出一个个栈桢
-            elif isinstance(rtn, ReturnObject):
+            # 碰到break、continue或return，不执行下面的statement
+            if self.status:
                 break
             # 注意：按这里的执行逻辑，在全局作用域下，break 和 return 都能让程序中断执行。但这种情况实际上不会出现，因为前面的语义分析阶段已经对 return/break 的合法性进行了检查
         return rtn
@@ -982,33 +902,71 @@ class ASTEvaluator(PlayScriptVisitor):
 
         if functionObject is None:
             functionObject = FunctionObject(function)
+            # 普通的函数调用，上一级帧单元的栈桢一定在当前栈桢的静态链上
+            functionObject.env = self.frameOfUnit(SlotResolver.parentUnit(function))
         return functionObject
 
+    # 某个函数的结果缓存。不是纯函数，或者参数、返回值不是基本类型的，返回None
+    def memoCacheOf(self, function:Function) -> MemoCache:
+        cache = self.memoCaches.get(function, MemoCache.MISSING)
+        if cache is MemoCache.MISSING:
+            cache = MemoCache(function.name) if PurityAnalyzer.isMemoizable(self.at, function) else None
+            self.memoCaches[function] = cache
+        return cache
+
     # 执行一个函数的方法体。需要先设置参数值，然后再执行代码
     def functionCall(self, functionObject:FunctionObject, paramValues):
         rtn = None
-        # 添加函数的栈桢
-        functionFrame:StackFrame = StackFrame(functionObject)
-        self.pushStack(functionFrame)
-
-        # 给参数赋值，这些值进入functionFrame
-        functionCode:PlayScriptParser.FunctionDeclarationContext = functionObject.function.ctx
-        if functionCode.formalParameters().formalParameterList():
-            for i in range(len(functionCode.formalParameters().formalParameterList().formalParameter())):
-                param:PlayScriptParser.FormalParameterContext = functionCode.formalParameters().formalParameterList().formalParameter()[i]
-                lValue:LValue = self.visitVariableDeclaratorId(param.variableDeclaratorId())
-                lValue.setValue(paramValues[i])
-
-        # 调用函数（方法）体
-        rtn = self.visitFunctionDeclaration(functionCode)
-
-        # 弹出函数栈帧
-        self.popStack()
+        # 要存入结果缓存的 (MemoCache, 键)。尾调用链上的各个函数，结果都是最后一个函数的结果
+        memos = []
+        while True:
+            if self.memoize:
+                cache = self.memoCacheOf(functionObject.function)
+                if cache is not None:
+                    key = MemoCache.keyOf(paramValues)
+                    rtn = cache.get(key)
+                    if rtn is not MemoCache.MISSING:
+                        break
+                    rtn = None
+                    memos.append((cache, key))
+
+            # 添加函数的栈桢
+            functionFrame:StackFrame = StackFrame(functionObject)
+            functionFrame.parentFrame = functionObject.env
+            self.pushStack(functionFrame)
+            # 方法的0号槽位是this，也就是上一级（类的）栈桢里的对象
+            if functionObject.function.isMethod():
+                functionFrame.slots[0] = functionFrame.parentFrame.slots[0]
+
+            # 给参数赋值，这些值进入functionFrame
+            functionCode:PlayScriptParser.FunctionDeclarationContext = functionObject.function.ctx
+            if functionCode.formalParameters().formalParameterList():
+                for i in range(len(functionCode.formalParameters().formalParameterList().formalParameter())):
+                    param:PlayScriptParser.FormalParameterContext = functionCode.formalParameters().formalParameterList().formalParameter()[i]
+                    lValue:LValue = self.visitVariableDeclaratorId(param.variableDeclaratorId())
+                    lValue.setValue(paramValues[i])
+
+            # 调用函数（方法）体
+            rtn = self.visitFunctionDeclaration(functionCode)
+
+            # 弹出函数栈帧
+            self.popStack()
 
-        # 这里消化掉函数调用的 returnObject
-        # 如果由一个return语句返回，真实返回值会被封装在一个ReturnObject里。
-        if isinstance(rtn, ReturnObject):
-            rtn = rtn.returnValue
+            # 尾调用：当前函数已经结束，栈桢也已出栈，在这一层循环里接着调用下一个函数，不再嵌套
+            if self.status != TAIL_CALL:
+                break
+            functionObject, paramValues = self.tailCall
+            self.tailCall = None
+            self.status = NORMAL
+
+        # 这里消化掉函数调用的 return
+        # 如果由一个return语句返回，真实返回值存在self.returnValue里。
+        if self.status == RETURN:
+            rtn = self.returnValue
+            self.returnValue = None
+            self.status = NORMAL
+        for cache, key in memos:
+            cache.put(key, rtn)
         return rtn
 
     '''
@@ -1019,25 +977,28 @@ class ASTEvaluator(PlayScriptVisitor):
     def methodCall(self, classObject:ClassObject, ctx:PlayScriptParser.FunctionCallContext, isSuper:bool):
         rtn = None
 
-        # 查找函数，并根据需要创建FunctionObject
-        # 如果查找到的是类的属性，FunctionType型的，需要在对象的栈桢里查。
         classFrame:StackFrame = StackFrame(classObject)
-        self.pushStack(classFrame)
-        funtionObject:FunctionObject = self.getFuntionObject(ctx)
-        self.popStack()
-
-        function:Function = funtionObject.function
-
-        # 对普通的类方法，需要在运行时动态绑定
-        theClass:Class = classObject.type  # 这是从对象获得的类型，是真实类型。可能是变量声明时的类型的子类
-        if (not function.isConstructor()) and (not isSuper):
-            # 从当前类逐级向上查找，找到正确的方法定义
-            overrided:Function = theClass.getFunction(function.name, function.getParamTypes())
-            # 原来这个function，可能指向一个父类的实现。现在从子类中可能找到重载后的方法，这个时候要绑定到子类的方法上
-            # 这里是实现多态的地方
-            if overrided and overrided != function:
-                function = overrided
-                funtionObject.setFunction(function)
+        classFrame.parentFrame = classObject.env
+        symbol:Symbol = self.at.symbolOfNode[ctx]
+        if isinstance(symbol, Function):
+            function:Function = symbol
+            # 对普通的类方法，需要在运行时动态绑定
+            if (not function.isConstructor()) and (not isSuper):
+                # 类层次分析证明所有子类都没有重载的方法，直接绑定（见 ClassHierarchyAnalyzer）
+                bound:Function = self.at.devirtualizedCalls.get(ctx)
+                if bound:
+                    function = bound
+                else:
+                    # 这是从对象获得的类型，是真实类型。可能是变量声明时的类型的子类
+                    # 这里是实现多态的地方
+                    function = self.dispatch(ctx, classObject.type, function)
+            funtionObject:FunctionObject = FunctionObject(function)
+            funtionObject.env = classFrame
+        else:
+            # 如果查找到的是类的属性，FunctionType型的，需要在对象的栈桢里查。
+            self.pushStack(classFrame)
+            funtionObject:FunctionObject = self.getFuntionObject(ctx)
+            self.popStack()
 
         # 计算参数值
         paramValues = self.calcParamValues(ctx)
@@ -1051,6 +1012,29 @@ class ASTEvaluator(PlayScriptVisitor):
         
         return rtn
 
+    '''
+     * 动态绑定：按对象的真实类型，从虚函数表里取出被重载后的方法。
+     * 每个调用点有一个内联缓存，记住见过的类和找到的方法：单态的调用点只需要比较一下类；
+     * 遇到第二个类以后，缓存升级成 Map<Class, Function>。
+    '''
+    def dispatch(self, ctx:PlayScriptParser.FunctionCallContext, theClass:Class, function:Function) -> Function:
+        cache = self.inlineCaches.get(ctx)
+        if isinstance(cache, tuple):
+            if cache[0] is theClass:
+                return cache[1]
+            cache = {cache[0]: cache[1]}
+            self.inlineCaches[ctx] = cache
+        elif cache is not None:
+            overrided = cache.get(theClass)
+            if overrided is not None:
+                return overrided
+        overrided:Function = theClass.getVTable()[function.vtableIndex]
+        if cache is None:
+            self.inlineCaches[ctx] = (theClass, overrided)
+        else:
+            cache[theClass] = overrided
+        return overrided
+
     def thisConstructor(self, ctx:PlayScriptParser.FunctionCallContext):
         symbol:Symbol = self.at.symbolOfNode[ctx]
         if isinstance(symbol, DefaultConstructor):  # 缺省构造函数
@@ -1058,6 +1042,7 @@ class ASTEvaluator(PlayScriptVisitor):
         elif isinstance(symbol, Function):
             function:Function = symbol
             functionObject:FunctionObject = FunctionObject(function)
+            functionObject.env = self.frameOfUnit(SlotResolver.parentUnit(function))
             paramValues = self.calcParamValues(ctx)
             self.functionCall(functionObject, paramValues)
 
@@ -0,0 +1,671 @@
+from frontend import *
+
+
+'''
+ * 字节码的操作码
+ * 每条指令固定占两个整数：操作码 + 操作数。没有操作数的指令，操作数为0。
+ * 跳转指令的操作数是目标指令在 code 列表里的下标，在编译期就已经回填好了。
+'''
+NOP = 0
+POP = 1
+DUP = 2
+ROT3 = 3            # 栈顶三个值 a b c -> c a b
+LOAD_CONST = 4      # 操作数：常量池下标
+LOAD_LOCAL = 5      # 操作数：槽位
+STORE_LOCAL = 6
+LOAD_GLOBAL = 7     # 操作数：根作用域里的槽位
+STORE_GLOBAL = 8
+LOAD_OUTER = 9      # 操作数：(外层单元的层数差 << 16) | 槽位，用于闭包访问外层函数的变量
+STORE_OUTER = 10
+GET_FIELD = 11      # 操作数：字段在对象里的偏移量。用于 this.x、super.x 以及方法里直接访问字段
+SET_FIELD = 12
+GET_FIELD_DYN = 13  # 操作数：常量池里的字段名。obj.x 要按对象的真实类型去查找字段
+SET_FIELD_DYN = 14
+ADD = 15
+ADD_STR = 16
+SUB = 17
+MUL = 18
+DIV = 19
+MOD = 20
+NEG = 21
+NOT = 22
+AND = 23
+OR = 24
+EQ = 25             # 对象、函数、字符串等，直接比较
+NE = 26
+EQ_INT = 27
+NE_INT = 28
+EQ_FLOAT = 29
+NE_FLOAT = 30
+LT_INT = 31
+LE_INT = 32
+GT_INT = 33
+GE_INT = 34
+LT_FLOAT = 35
+LE_FLOAT = 36
+GT_FLOAT = 37
+GE_FLOAT = 38
+JUMP = 39
+JUMP_IF_FALSE = 40
+JUMP_IF_TRUE = 41
+CALL_FUNCTION = 42  # 操作数：常量池里的 (CodeObject, 参数个数, 环境层数, 是否尾调用)，环境层数为-1表示不需要环境
+CALL_METHOD = 43    # 静态绑定的方法调用（构造方法、super.foo()、类内部直接调用方法）。常量：(CodeObject, 参数个数, 是否尾调用)
+CALL_VIRTUAL = 44   # 动态绑定的方法调用。常量：(Function, 参数个数)
+CALL_VALUE = 45     # 调用函数型变量的值（闭包）。操作数：(是否尾调用 << 16) | 参数个数
+MAKE_CLOSURE = 46   # 常量：(CodeObject, 环境层数)
+NEW_OBJECT = 47     # 常量：Class
+PRINTLN = 48        # 操作数：参数个数（0或1）
+RETURN = 49
+STORE_MEMO = 50     # 把栈顶的值（纯函数的返回值）存入结果缓存，不出栈。常量：(MemoCache, 键)。只出现在 BytecodeVM.MEMO_STUB 里
+CALL_FINAL = 51     # 类层次分析证明不需要动态绑定的方法调用，对象可能为null。常量：(CodeObject, 参数个数)
+
+opNames = {}
+for _name, _value in list(globals().items()):
+    if _name.isupper() and isinstance(_value, int):
+        opNames[_value] = _name
+
+
+'''
+ * 一个帧单元（整个程序、函数、类的字段初始化代码）编译出来的字节码
+'''
+class CodeObject():
+    def __init__(self, name:str, unit:Scope):
+        self.name = name
+        self.unit = unit
+        # 线性的指令序列，每条指令两个整数
+        self.code:List[int] = []
+        # 常量池
+        self.consts = []
+        self.constIndex = {}
+        # 帧的大小。最后再多放一个位置，存放外层函数的帧（闭包的环境）
+        self.frameSize = unit.frameSize
+
+    def emit(self, op:int, arg:int=0) -> int:
+        self.code.append(op)
+        self.code.append(arg)
+        return len(self.code) - 2
+
+    # 当前位置，也就是下一条指令的下标
+    def here(self) -> int:
+        return len(self.code)
+
+    # 回填跳转指令的目标地址
+    def patch(self, pos:int, target:int):
+        self.code[pos + 1] = target
+
+    def addConst(self, value) -> int:
+        # 基础类型按值去重（注意 1、1.0、True 在 dict 里是同一个键，所以要带上类型）；其它对象按引用去重
+        key = self.constKey(value)
+        index = self.constIndex.get(key)
+        if index is None:
+            index = len(self.consts)
+            self.consts.append(value)
+            self.constIndex[key] = index
+        return index
+
+    def constKey(self, value):
+        if value is None or isinstance(value, (int, float, str, bool)):
+            return (type(value), value)
+        elif isinstance(value, tuple):
+            return tuple([self.constKey(v) for v in value])
+        else:
+            return ('obj', id(value))
+
+    # 反汇编，调试用
+    def toString(self) -> str:
+        lines = ['code ' + self.name + ' (frame size ' + str(self.frameSize) + ')']
+        for pc in range(0, len(self.code), 2):
+            op = self.code[pc]
+            arg = self.code[pc + 1]
+            line = '  ' + str(pc).rjust(4) + ' ' + opNames[op].ljust(14) + str(arg)
+            if op in (LOAD_CONST, GET_FIELD_DYN, SET_FIELD_DYN, CALL_FUNCTION,
+                      CALL_METHOD, CALL_VIRTUAL, MAKE_CLOSURE, NEW_OBJECT, STORE_MEMO, CALL_FINAL):
+                line += '  (' + self.constToString(self.consts[arg]) + ')'
+            elif op in (LOAD_OUTER, STORE_OUTER):
+                line += '  (depth ' + str(arg >> 16) + ', slot ' + str(arg & 0xffff) + ')'
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def constToString(self, value) -> str:
+        if isinstance(value, tuple):
+            return ', '.join([self.constToString(v) for v in value])
+        if isinstance(value, CodeObject):
+            return 'code ' + value.name
+        if isinstance(value, Symbol):
+            return value.name
+        return repr(value)
+
+
+'''
+ * 编译的结果：主程序的代码，以及所有函数、类的代码
+'''
+class Program():
+    def __init__(self, at:AnnotatedTree):
+        self.at = at
+        self.main:CodeObject = None
+        # Map<Function, CodeObject>
+        self.functions = {}
+        # 类的字段初始化代码，Map<Class, CodeObject>
+        self.classInits = {}
+
+    def toString(self) -> str:
+        codes = [self.main] + list(self.classInits.values()) + list(self.functions.values())
+        return '\n\n'.join([code.toString() for code in codes])
+
+
+'''
+ * 字节码编译器：把 AnnotatedTree 翻译成线性的字节码，交给 BytecodeVM 去执行。
+ * 语义分析已经把每个节点的类型、引用的符号都确定了，所以这里把它们都“烘焙”进指令里：
+ * 变量变成槽位，运算按类型选择具体的指令，函数调用直接指向被调用函数的代码。
+'''
+class BytecodeCompiler(PlayScriptVisitor):
+    def __init__(self, at:AnnotatedTree):
+        self.at = at
+        self.program = Program(at)
+        # 当前正在生成的代码
+        self.code:CodeObject = None
+        # 循环的嵌套栈，每一层记录 break 和 continue 需要回填的跳转指令
+        self.loops = []
+        # 编译完以后是否把小函数内联到调用的地方（见 Inliner），以及内联了多少个调用
+        self.inline = True
+        self.inlined = 0
+
+    def compile(self) -> Program:
+        # 先为所有函数和类建好 CodeObject，这样在编译调用语句时可以直接引用
+        for type in self.at.types:
+            if isinstance(type, Function):
+                self.program.functions[type] = CodeObject(type.name, type)
+            elif isinstance(type, Class):
+                self.program.classInits[type] = CodeObject(type.name + '.<init>', type)
+
+        root:Scope = self.at.node2Scope[self.at.ast]
+        self.program.main = CodeObject('<main>', root)
+        self.code = self.program.main
+        self.visitProg(self.at.ast)
+
+        for function, code in self.program.functions.items():
+            self.code = code
+            self.visitFunctionDeclaration(function.ctx)
+
+        for theClass, code in self.program.classInits.items():
+            self.code = code
+            self.visitClassBody(theClass.ctx.classBody())
+
+        if self.inline:
+            from inliner import Inliner
+            inliner = Inliner(self.program)
+            inliner.inlineAll()
+            self.inlined = inliner.count
+
+        return self.program
+
+    def emit(self, op:int, arg:int=0) -> int:
+        return self.code.emit(op, arg)
+
+    def const(self, value) -> int:
+        return self.code.addConst(value)
+
+    ############################################################
+    # 变量的读写
+
+    # 在当前单元里，访问某个单元的帧需要向外走几层
+    def depthOf(self, unit:Scope) -> int:
+        return self.code.unit.unitLevel - unit.unitLevel
+
+    def emitLoadThis(self):
+        unit = SlotResolver.thisUnit(self.code.unit)
+        if unit is None:
+            raise Exception("keyword \"this\" can only be used inside a class")
+        depth = self.depthOf(unit)
+        if depth == 0:
+            self.emit(LOAD_LOCAL, 0)
+        else:
+            self.emit(LOAD_OUTER, (depth << 16) | 0)
+
+    # 类的成员变量，要通过this去访问
+    def isField(self, variable:Variable) -> bool:
+        return isinstance(variable.enclosingScope, Class) and not isinstance(variable, (This, Super))
+
+    def emitLoadVariable(self, variable:Variable):
+        if isinstance(variable, This) or isinstance(variable, Super):
+            self.emitLoadThis()
+        elif self.isField(variable):
+            self.emitLoadThis()
+            self.emit(GET_FIELD, variable.offset)
+        else:
+            unit = variable.enclosingScope.unit
+            if unit is self.code.unit:
+                self.emit(LOAD_LOCAL, variable.slot)
+            elif unit.unitLevel == 0:
+                self.emit(LOAD_GLOBAL, variable.slot)
+            else:
+                self.emit(LOAD_OUTER, (self.depthOf(unit) << 16) | variable.slot)
+
+    # 把栈顶的值存入变量（字段不走这里）
+    def emitStoreVariable(self, variable:Variable):
+        unit = variable.enclosingScope.unit
+        if unit is self.code.unit:
+            self.emit(STORE_LOCAL, variable.slot)
+        elif unit.unitLevel == 0:
+            self.emit(STORE_GLOBAL, variable.slot)
+        else:
+            self.emit(STORE_OUTER, (self.depthOf(unit) << 16) | variable.slot)
+
+    '''
+     * 编译赋值语句、++/--的左边，返回一个描述左值的元组：
+     * ('var', variable)：普通变量
+     * ('field', getOp, setOp, constIndex)：对象的字段，对象已经被压入栈中
+    '''
+    def visitLValue(self, ctx:PlayScriptParser.ExpressionContext):
+        if ctx.primary():
+            primary:PlayScriptParser.PrimaryContext = ctx.primary()
+            if primary.expression():
+                return self.visitLValue(primary.expression())
+            symbol = self.at.symbolOfNode.get(primary)
+            if primary.IDENTIFIER() and isinstance(symbol, Variable):
+                if self.isField(symbol):
+                    self.emitLoadThis()
+                    return ('field', GET_FIELD, SET_FIELD, symbol.offset)
+                return ('var', symbol)
+        elif ctx.bop and ctx.bop.type == PlayScriptParser.DOT and ctx.IDENTIFIER():
+            self.visitExpression(ctx.expression(0))
+            leftVar = self.at.symbolOfNode.get(ctx.expression(0))
+            # 对于this和super引用的属性，不用考虑重载，因为它们的解析是准确的
+            if isinstance(leftVar, This) or isinstance(leftVar, Super):
+                return ('field', GET_FIELD, SET_FIELD, self.at.symbolOfNode[ctx].offset)
+            return ('field', GET_FIELD_DYN, SET_FIELD_DYN, self.const(ctx.IDENTIFIER().getText()))
+        raise Exception("has to be LValue: " + ctx.getText())
+
+    # 读取左值的当前值。字段的话，要先复制一份对象引用，留给后面的存储用
+    def emitLoadLValue(self, lvalue):
+        if lvalue[0] == 'var':
+            self.emitLoadVariable(lvalue[1])
+        else:
+            self.emit(DUP)
+            self.emit(lvalue[1], lvalue[3])
+
+    # 把栈顶的值存入左值。keep 为 True 时，存完后栈顶保留这个值，作为表达式的值
+    def emitStoreLValue(self, lvalue, keep:bool):
+        if lvalue[0] == 'var':
+            if keep:
+                self.emit(DUP)
+            self.emitStoreVariable(lvalue[1])
+        else:
+            if keep:
+                self.emit(DUP)
+                self.emit(ROT3)
+            self.emit(lvalue[2], lvalue[3])
+
+    ############################################################
+    # 表达式
+
+    # 二元运算的指令，按照语义分析得到的类型来选择。类型不适用的，返回None
+    def binaryOp(self, bop_type:int, type:Type, type1:Type, type2:Type) -> int:
+        if bop_type in (PlayScriptParser.ADD, PlayScriptParser.ADD_ASSIGN):
+            return ADD_STR if type == String else ADD
+        elif bop_type in (PlayScriptParser.SUB, PlayScriptParser.SUB_ASSIGN):
+            return SUB
+        elif bop_type in (PlayScriptParser.MUL, PlayScriptParser.MUL_ASSIGN):
+            return MUL
+        elif bop_type in (PlayScriptParser.DIV, PlayScriptParser.DIV_ASSIGN):
+            return DIV
+        elif bop_type in (PlayScriptParser.MOD, PlayScriptParser.MOD_ASSIGN):
+            return MOD
+        elif bop_type == PlayScriptParser.AND:
+            return AND
+        elif bop_type == PlayScriptParser.OR:
+            return OR
+        elif bop_type in (PlayScriptParser.EQUAL, PlayScriptParser.NOTEQUAL):
+            # a == null，左边是个class，右边是 Null，直接比较引用
+            upperType = None
+            if PrimitiveType.isNumeric(type1) and PrimitiveType.isNumeric(type2):
+                upperType = PrimitiveType.getUpperType(type1, type2)
+            if bop_type == PlayScriptParser.EQUAL:
+                return {Integer: EQ_INT, Float: EQ_FLOAT}.get(upperType, EQ)
+            return {Integer: NE_INT, Float: NE_FLOAT}.get(upperType, NE)
+        else:
+            # 比较大小只支持数值。对于函数，不支持比较大小。对于对象，不支持运算符重载
+            upperType = PrimitiveType.getUpperType(type1, type2)
+            if upperType == Integer:
+                ops = {PlayScriptParser.LT: LT_INT, PlayScriptParser.LE: LE_INT, PlayScriptParser.GT: GT_INT, PlayScriptParser.GE: GE_INT}
+            elif upperType == Float:
+                ops = {PlayScriptParser.LT: LT_FLOAT, PlayScriptParser.LE: LE_FLOAT, PlayScriptParser.GT: GT_FLOAT, PlayScriptParser.GE: GE_FLOAT}
+            else:
+                return None
+            return ops.get(bop_type)
+
+    def visitExpression(self, ctx:PlayScriptParser.ExpressionContext, discard:bool=False):
+        if ctx in self.at.constOfNode:
+            # 常量折叠过的表达式，只需要一条 LOAD_CONST
+            if not discard:
+                self.emit(LOAD_CONST, self.const(self.at.constOfNode[ctx]))
+            return
+        if ctx.bop and ctx.bop.type in (PlayScriptParser.ASSIGN, PlayScriptParser.ADD_ASSIGN, PlayScriptParser.SUB_ASSIGN,
+                                        PlayScriptParser.MUL_ASSIGN, PlayScriptParser.DIV_ASSIGN, PlayScriptParser.MOD_ASSIGN):
+            lvalue = self.visitLValue(ctx.expression(0))
+            if ctx.bop.type == PlayScriptParser.ASSIGN:
+                self.visitExpression(ctx.expression(1))
+            else:
+                self.emitLoadLValue(lvalue)
+                self.visitExpression(ctx.expression(1))
+                self.emit(self.binaryOp(ctx.bop.type, self.at.typeOfNode[ctx], None, None))
+            self.emitStoreLValue(lvalue, not discard)
+            return
+        elif ctx.postfix or (ctx.prefix and ctx.prefix.type in (PlayScriptParser.INC, PlayScriptParser.DEC)):
+            # ++、--
+            op = ctx.postfix if ctx.postfix else ctx.prefix
+            lvalue = self.visitLValue(ctx.expression(0))
+            self.emitLoadLValue(lvalue)
+            if ctx.postfix and not discard:
+                # 后缀运算的值是运算之前的值，先复制一份留在栈里
+                self.emit(DUP)
+                if lvalue[0] == 'field':
+                    self.emit(ROT3)
+            self.emit(LOAD_CONST, self.const(1))
+            self.emit(ADD if op.type == PlayScriptParser.INC else SUB)
+            self.emitStoreLValue(lvalue, ctx.prefix is not None and not discard)
+            return
+
+        if ctx.bop and ctx.bop.type == PlayScriptParser.DOT:
+            self.visitExpression(ctx.expression(0))
+            leftVar = self.at.symbolOfNode.get(ctx.expression(0))
+            if ctx.IDENTIFIER():
+                # 对于this和super引用的属性，不用考虑重载，因为它们的解析是准确的
+                if isinstance(leftVar, This) or isinstance(leftVar, Super):
+                    self.emit(GET_FIELD, self.at.symbolOfNode[ctx].offset)
+                else:
+                    # 类的成员可能需要重载，按对象的真实类型查找
+                    self.emit(GET_FIELD_DYN, self.const(ctx.IDENTIFIER().getText()))
+            elif ctx.functionCall():
+                self.visitMethodCall(ctx.functionCall(), isinstance(leftVar, Super))
+        elif ctx.bop and ctx.bop.type == PlayScriptParser.INSTANCEOF:
+            # instanceof 的结果是null，跟 ASTEvaluator 一样，不计算左边的表达式
+            self.emit(LOAD_CONST, self.const(None))
+        elif ctx.bop and ctx.bop.type == PlayScriptParser.QUESTION:
+            self.visitExpression(ctx.expression(0))
+            elseJump = self.emit(JUMP_IF_FALSE)
+            self.visitExpression(ctx.expression(1))
+            endJump = self.emit(JUMP)
+            self.code.patch(elseJump, self.code.here())
+            self.visitExpression(ctx.expression(2))
+            self.code.patch(endJump, self.code.here())
+        elif ctx.bop and len(ctx.expression()) == 2:
+            type1 = self.at.typeOfNode[ctx.expression(0)]
+            type2 = self.at.typeOfNode[ctx.expression(1)]
+            op = self.binaryOp(ctx.bop.type, self.at.typeOfNode[ctx], type1, type2)
+            self.visitExpression(ctx.expression(0))
+            self.visitExpression(ctx.expression(1))
+            if op is None:
+                # 比如字符串比较大小，结果总是false
+                self.emit(POP)
+                self.emit(POP)
+                self.emit(LOAD_CONST, self.const(False))
+            else:
+                self.emit(op)
+        elif ctx.primary():
+            self.visitPrimary(ctx.primary())
+        elif ctx.prefix:
+            # 前缀操作：+、-、!
+            self.visitExpression(ctx.expression(0))
+            if ctx.prefix.type == PlayScriptParser.SUB:
+                self.emit(NEG)
+            elif ctx.prefix.type == PlayScriptParser.BANG:
+                self.emit(NOT)
+        elif ctx.functionCall():
+            if self.visitFunctionCall(ctx.functionCall(), discard):
+                return
+        else:
+            raise Exception("Unsupported expression: " + ctx.getText())
+
+        if discard:
+            self.emit(POP)
+
+    def visitPrimary(self, ctx:PlayScriptParser.PrimaryContext):
+        if ctx.literal():
+            self.emit(LOAD_CONST, self.const(self.visitLiteral(ctx.literal())))
+        elif ctx.IDENTIFIER():
+            symbol:Symbol = self.at.symbolOfNode[ctx]
+            if isinstance(symbol, Variable):
+                self.emitLoadVariable(symbol)
+            elif isinstance(symbol, Function):
+                # 函数作为值来使用，生成一个闭包，带上它定义时所处的环境
+                self.emit(MAKE_CLOSURE, self.const((self.program.functions[symbol], self.envDepthOf(symbol))))
+        elif ctx.expression():
+            self.visitExpression(ctx.expression())
+        elif ctx.THIS() or ctx.SUPER():
+            self.emitLoadThis()
+
+    def visitLiteral(self, ctx:PlayScriptParser.LiteralContext):
+        return ConstantFolder.literalValue(ctx)
+
+    ############################################################
+    # 函数调用
+
+    # 调用某个函数（或生成它的闭包）时，它的环境是当前帧向外第几层的帧。-1表示不需要环境
+    def envDepthOf(self, function:Function) -> int:
+        parent:Scope = SlotResolver.parentUnit(function)
+        if parent.unitLevel == 0 or isinstance(parent, Class):
+            return -1
+        return self.depthOf(parent)
+
+    # 计算实参，依次压栈，返回参数个数
+    def visitArguments(self, ctx:PlayScriptParser.FunctionCallContext) -> int:
+        argc = 0
+        if ctx.expressionList():
+            for exp in ctx.expressionList().expression():
+                self.visitExpression(exp)
+                argc += 1
+        return argc
+
+    # 返回True，表示没有往栈里压入值（println用作语句的时候）
+    def visitFunctionCall(self, ctx:PlayScriptParser.FunctionCallContext, discard:bool=False) -> bool:
+        symbol:Symbol = self.at.symbolOfNode.get(ctx)
+
+        # this() 和 super()：在构造方法里调用另一个构造方法
+        if ctx.THIS() or ctx.SUPER():
+            if isinstance(symbol, DefaultConstructor) or symbol is None:
+                # 缺省构造函数一定在之前已经被调用了
+                self.emit(LOAD_CONST, self.const(None))
+            else:
+                self.emitLoadThis()
+                argc = self.visitArguments(ctx)
+                self.emit(CALL_METHOD, self.const((self.program.functions[symbol], argc, False)))
+            return False
+
+        # 硬编码的println
+        if ctx.IDENTIFIER().getText() == "println":
+            argc = 0
+            if ctx.expressionList():
+                expressions = ctx.expressionList().expression()
+                for exp in expressions[:-1]:
+                    self.visitExpression(exp, True)
+                self.visitExpression(expressions[-1])
+                argc = 1
+            self.emit(PRINTLN, argc)
+            if discard:
+                return True
+            # println 没有返回值
+            self.emit(LOAD_CONST, self.const(None))
+            return False
+
+        # 处在尾部位置的调用，虚拟机不保存调用者的状态，被调用者直接返回到调用者的调用者（见 TailCallAnalyzer）
+        tail = ctx in self.at.tailCalls
+        if isinstance(symbol, DefaultConstructor):
+            # 类的缺省构造函数，直接创建对象
+            self.emit(NEW_OBJECT, self.const(symbol.Class()))
+        elif isinstance(symbol, Function) and symbol.isConstructor():
+            # 先创建对象、做缺省的初始化，再计算参数、调用构造方法，最后留下对象本身
+            self.emit(NEW_OBJECT, self.const(symbol.enclosingScope))
+            self.emit(DUP)
+            argc = self.visitArguments(ctx)
+            self.emit(CALL_METHOD, self.const((self.program.functions[symbol], argc, False)))
+            self.emit(POP)
+        elif isinstance(symbol, Function):
+            if symbol.isMethod():
+                # 在类的内部直接调用方法，对象就是当前的this
+                self.emitLoadThis()
+                argc = self.visitArguments(ctx)
+                self.emit(CALL_METHOD, self.const((self.program.functions[symbol], argc, tail)))
+            else:
+                argc = self.visitArguments(ctx)
+                self.emit(CALL_FUNCTION, self.const((self.program.functions[symbol], argc, self.envDepthOf(symbol), tail)))
+        elif isinstance(symbol, Variable):
+            # 函数类型的变量
+            self.emitLoadVariable(symbol)
+            argc = self.visitArguments(ctx)
+            self.emit(CALL_VALUE, (tail << 16) | argc)
+        else:
+            raise Exception("unable to find function or function variable " + ctx.IDENTIFIER().getText())
+        return False
+
+    # 对象方法调用，对象已经在栈顶
+    def visitMethodCall(self, ctx:PlayScriptParser.FunctionCallContext, isSuper:bool):
+        symbol:Symbol = self.at.symbolOfNode.get(ctx)
+        if isinstance(symbol, Function):
+            argc = self.visitArguments(ctx)
+            if isSuper or symbol.isConstructor():
+                self.emit(CALL_METHOD, self.const((self.program.functions[symbol], argc, False)))
+            elif ctx in self.at.devirtualizedCalls:
+                # 所有子类都没有重载这个方法，直接绑定（见 ClassHierarchyAnalyzer）
+                self.emit(CALL_FINAL, self.const((self.program.functions[self.at.devirtualizedCalls[ctx]], argc)))
+            else:
+                # 对普通的类方法，需要在运行时动态绑定
+                self.emit(CALL_VIRTUAL, self.const((symbol, argc)))
+        elif isinstance(symbol, Variable):
+            # 函数类型的属性
+            self.emit(GET_FIELD, symbol.offset)
+            argc = self.visitArguments(ctx)
+            self.emit(CALL_VALUE, argc)
+        else:
+            raise Exception("unable to find method " + ctx.getText())
+
+    ############################################################
+    # 语句
+
+    def visitProg(self, ctx:PlayScriptParser.ProgContext):
+        self.visitBlockStatements(ctx.blockStatements())
+        self.emit(LOAD_CONST, self.const(None))
+        self.emit(RETURN)
+
+    def visitFunctionDeclaration(self, ctx:PlayScriptParser.FunctionDeclarationContext):
+        if ctx.functionBody().block():
+            self.visitBlock(ctx.functionBody().block())
+        self.emit(LOAD_CONST, self.const(None))
+        self.emit(RETURN)
+
+    # 类的缺省初始化：执行字段声明里的初始化表达式
+    def visitClassBody(self, ctx:PlayScriptParser.ClassBodyContext):
+        for child in ctx.classBodyDeclaration():
+            member = child.memberDeclaration()
+            if member and member.fieldDeclaration():
+                declarators = member.fieldDeclaration().variableDeclarators()
+                for declarator in declarators.variableDeclarator():
+                    if declarator.variableInitializer():
+                        self.emitLoadThis()
+                        self.visitVariableInitializer(declarator.variableInitializer())
+                        self.emit(SET_FIELD, self.at.symbolOfNode[declarator.variableDeclaratorId()].offset)
+        self.emit(LOAD_CONST, self.const(None))
+        self.emit(RETURN)
+
+    def visitBlock(self, ctx:PlayScriptParser.BlockContext):
+        # block 里的变量已经摊平到函数的帧里了，不需要再建立新的栈桢
+        self.visitBlockStatements(ctx.blockStatements())
+
+    def visitBlockStatements(self, ctx:PlayScriptParser.BlockStatementsContext):
+        for child in ctx.blockStatement():
+            self.visitBlockStatement(child)
+
+    def visitBlockStatement(self, ctx:PlayScriptParser.BlockStatementContext):
+        # 函数和类的声明单独编译
+        if ctx.variableDeclarators():
+            self.visitVariableDeclarators(ctx.variableDeclarators())
+        elif ctx.statement():
+            self.visitStatement(ctx.statement())
+
+    def visitVariableDeclarators(self, ctx:PlayScriptParser.VariableDeclaratorsContext):
+        for child in ctx.variableDeclarator():
+            variable:Variable = self.at.symbolOfNode[child.variableDeclaratorId()]
+            if child.variableInitializer():
+                self.visitVariableInitializer(child.variableInitializer())
+            else:
+                # 每次进入 block 都是一个新的变量，没有初始化的变量是 None
+                self.emit(LOAD_CONST, self.const(None))
+            self.emitStoreVariable(variable)
+
+    def visitVariableInitializer(self, ctx:PlayScriptParser.VariableInitializerContext):
+        if ctx.expression():
+            self.visitExpression(ctx.expression())
+        else:
+            raise Exception("Unsupported feature: array initializer")
+
+    def visitStatement(self, ctx:PlayScriptParser.StatementContext):
+        if ctx.statementExpression:
+            self.visitExpression(ctx.statementExpression, True)
+        elif ctx.IF():
+            self.visitExpression(ctx.parExpression().expression())
+            elseJump = self.emit(JUMP_IF_FALSE)
+            self.visitStatement(ctx.statement(0))
+            if ctx.ELSE():
+                endJump = self.emit(JUMP)
+                self.code.patch(elseJump, self.code.here())
+                self.visitStatement(ctx.statement(1))
+                self.code.patch(endJump, self.code.here())
+            else:
+                self.code.patch(elseJump, self.code.here())
+        elif ctx.WHILE():
+            start = self.code.here()
+            self.visitExpression(ctx.parExpression().expression())
+            exitJump = self.emit(JUMP_IF_FALSE)
+            self.loops.append(([], []))
+            self.visitStatement(ctx.statement(0))
+            self.emit(JUMP, start)
+            self.code.patch(exitJump, self.code.here())
+            self.closeLoop(start, self.code.here())
+        elif ctx.FOR():
+            forControl:PlayScriptParser.ForControlContext = ctx.forControl()
+            if forControl.enhancedForControl():
+                # 跟 ASTEvaluator 一样，还不支持 enhanced for，不生成任何指令
+                return
+            if forControl.forInit():
+                forInit:PlayScriptParser.ForInitContext = forControl.forInit()
+                if forInit.variableDeclarators():
+                    self.visitVariableDeclarators(forInit.variableDeclarators())
+                else:
+                    for exp in forInit.expressionList().expression():
+                        self.visitExpression(exp, True)
+            start = self.code.here()
+            exitJump = None
+            # 如果没有条件判断部分，意味着一直循环
+            if forControl.expression():
+                self.visitExpression(forControl.expression())
+                exitJump = self.emit(JUMP_IF_FALSE)
+            self.loops.append(([], []))
+            self.visitStatement(ctx.statement(0))
+            update = self.code.here()
+            if forControl.forUpdate:
+                for exp in forControl.forUpdate.expression():
+                    self.visitExpression(exp, True)
+            self.emit(JUMP, start)
+            if exitJump is not None:
+                self.code.patch(exitJump, self.code.here())
+            self.closeLoop(update, self.code.here())
+        elif ctx.blockLabel:
+            self.visitBlock(ctx.blockLabel)
+        elif ctx.BREAK():
+            self.loops[-1][0].append(self.emit(JUMP))
+        elif ctx.CONTINUE():
+            self.loops[-1][1].append(self.emit(JUMP))
+        elif ctx.RETURN():
+            if ctx.expression():
+                self.visitExpression(ctx.expression())
+            else:
+                self.emit(LOAD_CONST, self.const(None))
+            self.emit(RETURN)
+
+    # 回填当前这层循环里的 break 和 continue
+    def closeLoop(self, continueTarget:int, breakTarget:int):
+        breaks, continues = self.loops.pop()
+        for pos in breaks:
+            self.code.patch(pos, breakTarget)
+        for pos in continues:
+            self.code.patch(pos, continueTarget)
@@ -0,0 +1,358 @@
+from bytecode_compiler import *
+from memo_cache import *
+
+
+'''
+ * 对象实例。fields 按类的内存布局（Class.getFieldLayout()）存放从父类到子类所有的成员变量，用 Variable.offset 索引
+'''
+class PlayInstance():
+    __slots__ = ('type', 'fields')
+
+    def __init__(self, theClass:Class, fields):
+        self.type = theClass
+        self.fields = fields
+
+'''
+ * 函数型的值：函数的代码，加上它定义时所处的环境（外层函数的帧）
+'''
+class PlayClosure():
+    __slots__ = ('code', 'env')
+
+    def __init__(self, code:CodeObject, env):
+        self.code = code
+        self.env = env
+
+
+'''
+ * 基于栈的字节码虚拟机，执行 BytecodeCompiler 编译出来的 Program。
+ * 帧是一个list：前面是各个槽位（参数、本地变量），最后一个元素是外层函数的帧，闭包通过它访问环境变量。
+ * 全局变量就是主程序的帧。
+ * 函数调用不占用 Python 的栈：调用时把调用者的状态（代码、常量、帧、pc）压到 run() 里的调用栈 calls 上，
+ * 返回时再弹出来，所以 PlayScript 的递归深度不受 Python 递归深度的限制，只受内存的限制。
+ * 尾调用（见 TailCallAnalyzer）不保存调用者的状态，尾递归的调用栈不会变深。
+'''
+class BytecodeVM():
+    # 调用要缓存结果的纯函数时，被调用的函数先返回到这一小段代码，把返回值存入缓存，再返回到调用者
+    MEMO_STUB = [STORE_MEMO, 0, RETURN, 0]
+
+    def __init__(self, program:Program):
+        self.program = program
+        self.globals = [None] * (program.main.frameSize + 1)
+        # 是否缓存纯函数的调用结果（-memoize）
+        self.memoize = False
+        # 每个函数的结果缓存，不能缓存的函数对应None。Map<CodeObject, MemoCache>
+        self.memoCaches = {}
+        # 按对象的真实类型查找字段的缓存
+        self.fieldCache = {}   # Map<(Class, str), int>，字段的偏移量
+        # 每个类的字段个数，以及从父类到子类的初始化代码
+        self.classInfo = {}    # Map<Class, (int, List<CodeObject>)>
+
+    def execute(self):
+        return self.run(self.program.main, self.globals)
+
+    ############################################################
+    # 对象和方法
+
+    # 从父类到子类层层执行缺省的初始化，返回一个含有从父类到子类所有字段的对象
+    def createObject(self, theClass:Class) -> PlayInstance:
+        info = self.classInfo.get(theClass)
+        if info is None:
+            ancestorChain:List[Class] = []
+            c = theClass
+            while c:
+                ancestorChain.append(c)
+                c = c.getParentClass()
+            ancestorChain.reverse()
+            inits = [self.program.classInits[c] for c in ancestorChain]
+            info = (len(theClass.getFieldLayout()), inits)
+            self.classInfo[theClass] = info
+        obj = PlayInstance(theClass, [None] * info[0])
+        for init in info[1]:
+            self.run(init, [obj, None])
+        return obj
+
+    # 按对象的真实类型查找字段，返回它的偏移量。obj.x 里的 x 可能被子类的同名字段覆盖
+    def lookupField(self, theClass:Class, name:str) -> int:
+        key = (theClass, name)
+        offset = self.fieldCache.get(key)
+        if offset is None:
+            offset = self.program.at.lookupVariable(theClass, name).offset
+            self.fieldCache[key] = offset
+        return offset
+
+    # 动态绑定：从对象的真实类型的虚函数表里，找到被重载后的方法
+    def lookupMethod(self, theClass:Class, function:Function) -> CodeObject:
+        return self.program.functions[theClass.getVTable()[function.vtableIndex]]
+
+    # 某个函数的结果缓存。不是纯函数，或者参数、返回值不是基本类型的，返回None
+    def memoCacheOf(self, codeObject:CodeObject) -> MemoCache:
+        cache = self.memoCaches.get(codeObject, MemoCache.MISSING)
+        if cache is MemoCache.MISSING:
+            cache = MemoCache(codeObject.unit.name) if PurityAnalyzer.isMemoizable(self.program.at, codeObject.unit) else None
+            self.memoCaches[codeObject] = cache
+        return cache
+
+    ############################################################
+    # 执行
+
+    def run(self, codeObject:CodeObject, frame:list):
+        code = codeObject.code
+        consts = codeObject.consts
+        globals_ = self.globals
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        # 调用者的状态：(code, consts, frame, pc, 操作数栈的高度)。所有的调用共用一个操作数栈，被调用者从调用者的栈顶往上用
+        calls = []
+        callsPush = calls.append
+        memoize = self.memoize
+        while True:
+            op = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+            # 按执行频率排列
+            if op == LOAD_LOCAL:
+                push(frame[arg])
+            elif op == LOAD_CONST:
+                push(consts[arg])
+            elif op == STORE_LOCAL:
+                frame[arg] = pop()
+            elif op == LOAD_GLOBAL:
+                push(globals_[arg])
+            elif op == STORE_GLOBAL:
+                globals_[arg] = pop()
+            elif op == JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == ADD:
+                b = pop()
+                stack[-1] = stack[-1] + b
+            elif op == ADD_STR:
+                b = pop()
+                stack[-1] = str(stack[-1]) + str(b)
+            elif op == SUB:
+                b = pop()
+                stack[-1] = stack[-1] - b
+            elif op == MUL:
+                b = pop()
+                stack[-1] = stack[-1] * b
+            elif op == LT_INT:
+                b = pop()
+                stack[-1] = int(stack[-1]) < int(b)
+            elif op == LE_INT:
+                b = pop()
+                stack[-1] = int(stack[-1]) <= int(b)
+            elif op == GT_INT:
+                b = pop()
+                stack[-1] = int(stack[-1]) > int(b)
+            elif op == GE_INT:
+                b = pop()
+                stack[-1] = int(stack[-1]) >= int(b)
+            elif op == GET_FIELD:
+                obj = stack[-1]
+                stack[-1] = obj.fields[arg] if obj is not None else None
+            elif op == SET_FIELD:
+                value = pop()
+                pop().fields[arg] = value
+            elif op == GET_FIELD_DYN:
+                obj = stack[-1]
+                if obj is not None:
+                    stack[-1] = obj.fields[self.lookupField(obj.type, consts[arg])]
+            elif op == SET_FIELD_DYN:
+                value = pop()
+                obj = pop()
+                obj.fields[self.lookupField(obj.type, consts[arg])] = value
+            elif op == CALL_FUNCTION:
+                callee, argc, depth, tail = consts[arg]
+                if argc:
+                    args = stack[-argc:]
+                    del stack[-argc:]
+                else:
+                    args = []
+                if memoize:
+                    cache = self.memoCacheOf(callee)
+                    if cache is not None:
+                        key = MemoCache.keyOf(args)
+                        value = cache.get(key)
+                        if value is not MemoCache.MISSING:
+                            push(value)
+                            continue
+                        # 被调用的函数返回到 MEMO_STUB，由它存好结果再返回到调用者
+                        if not tail:
+                            callsPush((code, consts, frame, pc, len(stack)))
+                        callsPush((BytecodeVM.MEMO_STUB, ((cache, key),), None, 0, len(stack)))
+                        tail = True
+                env = None
+                if depth >= 0:
+                    env = frame
+                    while depth > 0:
+                        env = env[-1]
+                        depth -= 1
+                args.extend([None] * (callee.frameSize - argc))
+                args.append(env)
+                # 尾调用不保存调用者的状态，被调用者直接返回到调用者的调用者
+                if not tail:
+                    callsPush((code, consts, frame, pc, len(stack)))
+                code = callee.code
+                consts = callee.consts
+                frame = args
+                pc = 0
+            elif op == CALL_VIRTUAL:
+                function, argc = consts[arg]
+                obj = stack[-argc - 1]
+                args = stack[-argc - 1:]
+                del stack[-argc - 1:]
+                if obj is None:
+                    # 对象为null，和ASTEvaluator一样，不调用
+                    push(None)
+                    continue
+                callee = self.lookupMethod(obj.type, function)
+                args.extend([None] * (callee.frameSize - argc - 1))
+                args.append(None)
+                callsPush((code, consts, frame, pc, len(stack)))
+                code = callee.code
+                consts = callee.consts
+                frame = args
+                pc = 0
+            elif op == CALL_FINAL:
+                callee, argc = consts[arg]
+                args = stack[-argc - 1:]
+                del stack[-argc - 1:]
+                if args[0] is None:
+                    push(None)
+                    continue
+                args.extend([None] * (callee.frameSize - argc - 1))
+                args.append(None)
+                callsPush((code, consts, frame, pc, len(stack)))
+                code = callee.code
+                consts = callee.consts
+                frame = args
+                pc = 0
+            elif op == CALL_METHOD:
+                callee, argc, tail = consts[arg]
+                args = stack[-argc - 1:]
+                del stack[-argc - 1:]
+                args.extend([None] * (callee.frameSize - argc - 1))
+                args.append(None)
+                if not tail:
+                    callsPush((code, consts, frame, pc, len(stack)))
+                code = callee.code
+                consts = callee.consts
+                frame = args
+                pc = 0
+            elif op == CALL_VALUE:
+                argc = arg & 0xffff
+                closure:PlayClosure = stack[-argc - 1]
+                args = stack[-argc:] if argc else []
+                del stack[-argc - 1:]
+                callee = closure.code
+                args.extend([None] * (callee.frameSize - argc))
+                args.append(closure.env)
+                if not arg >> 16:
+                    callsPush((code, consts, frame, pc, len(stack)))
+                code = callee.code
+                consts = callee.consts
+                frame = args
+                pc = 0
+            elif op == RETURN:
+                value = pop()
+                if not calls:
+                    return value
+                code, consts, frame, pc, base = calls.pop()
+                del stack[base:]
+                push(value)
+            elif op == POP:
+                pop()
+            elif op == DUP:
+                push(stack[-1])
+            elif op == ROT3:
+                stack.insert(-2, pop())
+            elif op == DIV:
+                b = pop()
+                stack[-1] = stack[-1] / b
+            elif op == MOD:
+                b = pop()
+                stack[-1] = stack[-1] % b
+            elif op == EQ:
+                b = pop()
+                stack[-1] = stack[-1] == b
+            elif op == NE:
+                b = pop()
+                stack[-1] = stack[-1] != b
+            elif op == EQ_INT:
+                b = pop()
+                stack[-1] = int(stack[-1]) == int(b)
+            elif op == NE_INT:
+                b = pop()
+                stack[-1] = int(stack[-1]) != int(b)
+            elif op == EQ_FLOAT:
+                b = pop()
+                stack[-1] = float(stack[-1]) == float(b)
+            elif op == NE_FLOAT:
+                b = pop()
+                stack[-1] = float(stack[-1]) != float(b)
+            elif op == LT_FLOAT:
+                b = pop()
+                stack[-1] = float(stack[-1]) < float(b)
+            elif op == LE_FLOAT:
+                b = pop()
+                stack[-1] = float(stack[-1]) <= float(b)
+            elif op == GT_FLOAT:
+                b = pop()
+                stack[-1] = float(stack[-1]) > float(b)
+            elif op == GE_FLOAT:
+                b = pop()
+                stack[-1] = float(stack[-1]) >= float(b)
+            elif op == AND:
+                b = pop()
+                stack[-1] = stack[-1] and b
+            elif op == OR:
+                b = pop()
+                stack[-1] = stack[-1] or b
+            elif op == NOT:
+                stack[-1] = not stack[-1]
+            elif op == NEG:
+                stack[-1] = -stack[-1]
+            elif op == JUMP_IF_TRUE:
+                if pop():
+                    pc = arg
+            elif op == LOAD_OUTER:
+                env = frame
+                depth = arg >> 16
+                while depth > 0:
+                    env = env[-1]
+                    depth -= 1
+                push(env[arg & 0xffff])
+            elif op == STORE_OUTER:
+                env = frame
+                depth = arg >> 16
+                while depth > 0:
+                    env = env[-1]
+                    depth -= 1
+                env[arg & 0xffff] = pop()
+            elif op == MAKE_CLOSURE:
+                callee, depth = consts[arg]
+                env = None
+                if depth >= 0:
+                    env = frame
+                    while depth > 0:
+                        env = env[-1]
+                        depth -= 1
+                push(PlayClosure(callee, env))
+            elif op == NEW_OBJECT:
+                push(self.createObject(consts[arg]))
+            elif op == PRINTLN:
+                if arg:
+                    print(pop())
+                else:
+                    print()
+            elif op == STORE_MEMO:
+                cache, key = consts[arg]
+                cache.put(key, stack[-1])
+            elif op == NOP:
+                pass
+            else:
+                raise Exception("unknown opcode " + str(op))
@@ -0,0 +1,756 @@
+from bytecode_vm import *
+
+
+# 语句执行后的状态。正常执行完返回None
+BREAK = 1
+CONTINUE = 2
+RETURN = 3
+
+
+'''
+ * 编译好的函数（或类的字段初始化代码）。
+ * 帧是一个list：前面是各个槽位（参数、本地变量），倒数第二个位置存放返回值，最后一个位置是外层函数的帧（闭包的环境）。
+'''
+class CompiledFunction():
+    __slots__ = ('name', 'frameSize', 'body')
+
+    def __init__(self, name:str, frameSize:int):
+        self.name = name
+        self.frameSize = frameSize
+        # 函数体，执行时传入帧
+        self.body = None
+
+
+'''
+ * 闭包编译器：只遍历一遍 AnnotatedTree，把每个节点都变成一个 Python 闭包。
+ * 节点的类型、引用的符号、变量的槽位，在生成闭包的时候就都确定下来了，
+ * 运行时不再需要访问者模式的分派，也不用再按运算符、类型去做判断。
+ * 表达式的闭包返回表达式的值；语句的闭包返回执行状态（BREAK、CONTINUE、RETURN，正常为None）。
+'''
+class ClosureCompiler(PlayScriptVisitor):
+    def __init__(self, at:AnnotatedTree):
+        self.at = at
+        # 当前正在编译的帧单元
+        self.unit:Scope = None
+        # Map<Function, CompiledFunction>
+        self.functions = {}
+        # 类的字段初始化代码，Map<Class, CompiledFunction>
+        self.classInits = {}
+        self.globals = None
+        # 按对象的真实类型查找字段偏移量的缓存，Map<(Class, str), int>
+        self.fieldCache = {}
+        # 每个类的字段个数，以及从父类到子类的初始化代码
+        self.classInfo = {}
+
+    # 编译整个程序，返回一个无参数的函数，调用它就执行程序
+    def compile(self):
+        # 先为所有函数和类建好 CompiledFunction，这样在编译调用语句时可以直接引用
+        for type in self.at.types:
+            if isinstance(type, Function):
+                self.functions[type] = CompiledFunction(type.name, type.frameSize)
+            elif isinstance(type, Class):
+                self.classInits[type] = CompiledFunction(type.name + '.<init>', type.frameSize)
+
+        root:Scope = self.at.node2Scope[self.at.ast]
+        self.globals = [None] * (root.frameSize + 2)
+        self.unit = root
+        main = self.visitBlockStatements(self.at.ast.blockStatements())
+
+        for function, compiled in self.functions.items():
+            self.unit = function
+            compiled.body = self.visitFunctionDeclaration(function.ctx)
+
+        for theClass, compiled in self.classInits.items():
+            self.unit = theClass
+            compiled.body = self.visitClassBody(theClass.ctx.classBody())
+
+        g = self.globals
+        def run():
+            main(g)
+        return run
+
+    ############################################################
+    # 对象
+
+    # 从父类到子类层层执行缺省的初始化，返回一个含有从父类到子类所有字段的对象
+    def createObject(self, theClass:Class) -> PlayInstance:
+        info = self.classInfo.get(theClass)
+        if info is None:
+            ancestorChain:List[Class] = []
+            c = theClass
+            while c:
+                ancestorChain.append(c)
+                c = c.getParentClass()
+            ancestorChain.reverse()
+            inits = [self.classInits[c].body for c in ancestorChain]
+            info = (len(theClass.getFieldLayout()), inits)
+            self.classInfo[theClass] = info
+        obj = PlayInstance(theClass, [None] * info[0])
+        for init in info[1]:
+            init([obj, None, None])
+        return obj
+
+    # 按对象的真实类型查找字段，返回它的偏移量。obj.x 里的 x 可能被子类的同名字段覆盖
+    def lookupField(self, theClass:Class, name:str) -> int:
+        key = (theClass, name)
+        offset = self.fieldCache.get(key)
+        if offset is None:
+            offset = self.at.lookupVariable(theClass, name).offset
+            self.fieldCache[key] = offset
+        return offset
+
+    # 动态绑定：从对象的真实类型的虚函数表里，找到被重载后的方法
+    def lookupMethod(self, theClass:Class, function:Function) -> CompiledFunction:
+        return self.functions[theClass.getVTable()[function.vtableIndex]]
+
+    ############################################################
+    # 变量的读写
+
+    # 返回一个闭包，从当前帧出发，找到某个单元的帧
+    def frameOf(self, unit:Scope):
+        depth = self.unit.unitLevel - unit.unitLevel
+        if depth == 0:
+            return lambda f: f
+        elif unit.unitLevel == 0:
+            g = self.globals
+            return lambda f: g
+        elif depth == 1:
+            return lambda f: f[-1]
+        elif depth == 2:
+            return lambda f: f[-1][-1]
+        else:
+            def frame(f):
+                for i in range(depth):
+                    f = f[-1]
+                return f
+            return frame
+
+    def compileThis(self):
+        unit = SlotResolver.thisUnit(self.unit)
+        if unit is None:
+            raise Exception("keyword \"this\" can only be used inside a class")
+        if unit is self.unit:
+            return lambda f: f[0]
+        frame = self.frameOf(unit)
+        return lambda f: frame(f)[0]
+
+    # 类的成员变量，要通过this去访问
+    def isField(self, variable:Variable) -> bool:
+        return isinstance(variable.enclosingScope, Class) and not isinstance(variable, (This, Super))
+
+    def compileLoadVariable(self, variable:Variable):
+        if isinstance(variable, This) or isinstance(variable, Super):
+            return self.compileThis()
+        elif self.isField(variable):
+            this = self.compileThis()
+            offset = variable.offset
+            return lambda f: this(f).fields[offset]
+        unit = variable.enclosingScope.unit
+        slot = variable.slot
+        if unit is self.unit:
+            return lambda f: f[slot]
+        elif unit.unitLevel == 0:
+            g = self.globals
+            return lambda f: g[slot]
+        elif unit.unitLevel == self.unit.unitLevel - 1:
+            return lambda f: f[-1][slot]
+        frame = self.frameOf(unit)
+        return lambda f: frame(f)[slot]
+
+    '''
+     * 编译赋值语句、++/--的左边，返回一个描述左值的元组：
+     * ('var', variable)：普通变量
+     * ('field', obj, key)：对象的字段。obj(f)计算出对象，key(obj)得到字段的偏移量
+    '''
+    def visitLValue(self, ctx:PlayScriptParser.ExpressionContext):
+        if ctx.primary():
+            primary:PlayScriptParser.PrimaryContext = ctx.primary()
+            if primary.expression():
+                return self.visitLValue(primary.expression())
+            symbol = self.at.symbolOfNode.get(primary)
+            if primary.IDENTIFIER() and isinstance(symbol, Variable):
+                if self.isField(symbol):
+                    offset = symbol.offset
+                    return ('field', self.compileThis(), lambda obj: offset)
+                return ('var', symbol)
+        elif ctx.bop and ctx.bop.type == PlayScriptParser.DOT and ctx.IDENTIFIER():
+            obj = self.visitExpression(ctx.expression(0))
+            leftVar = self.at.symbolOfNode.get(ctx.expression(0))
+            # 对于this和super引用的属性，不用考虑重载，因为它们的解析是准确的
+            if isinstance(leftVar, This) or isinstance(leftVar, Super):
+                offset = self.at.symbolOfNode[ctx].offset
+                return ('field', obj, lambda o: offset)
+            name = ctx.IDENTIFIER().getText()
+            lookupField = self.lookupField
+            return ('field', obj, lambda o: lookupField(o.type, name))
+        raise Exception("has to be LValue: " + ctx.getText())
+
+    # 把变量的读写都编译成闭包，返回 (load(f), store(f, value))
+    def compileVariableAccess(self, variable:Variable):
+        load = self.compileLoadVariable(variable)
+        slot = variable.slot
+        frame = self.frameOf(variable.enclosingScope.unit)
+        def store(f, value):
+            frame(f)[slot] = value
+        return load, store
+
+    '''
+     * 编译一次读-改-写：赋值、复合赋值、++/--。
+     * update(old, f) 根据旧值计算新值；返回值取新值还是旧值由 returnOld 决定。
+    '''
+    def compileUpdate(self, lvalue, update, returnOld:bool):
+        if lvalue[0] == 'var':
+            load, store = self.compileVariableAccess(lvalue[1])
+            def updateVar(f):
+                old = load(f)
+                value = update(old, f)
+                store(f, value)
+                return old if returnOld else value
+            return updateVar
+        else:
+            obj, key = lvalue[1], lvalue[2]
+            def updateField(f):
+                o = obj(f)
+                offset = key(o)
+                old = o.fields[offset]
+                value = update(old, f)
+                o.fields[offset] = value
+                return old if returnOld else value
+            return updateField
+
+    def compileAssign(self, lvalue, exp):
+        if lvalue[0] == 'var':
+            variable:Variable = lvalue[1]
+            unit = variable.enclosingScope.unit
+            slot = variable.slot
+            if unit is self.unit:
+                def assignLocal(f):
+                    f[slot] = value = exp(f)
+                    return value
+                return assignLocal
+            elif unit.unitLevel == 0:
+                g = self.globals
+                def assignGlobal(f):
+                    g[slot] = value = exp(f)
+                    return value
+                return assignGlobal
+            frame = self.frameOf(unit)
+            def assignOuter(f):
+                frame(f)[slot] = value = exp(f)
+                return value
+            return assignOuter
+        else:
+            obj, key = lvalue[1], lvalue[2]
+            def assignField(f):
+                o = obj(f)
+                o.fields[key(o)] = value = exp(f)
+                return value
+            return assignField
+
+    ############################################################
+    # 表达式
+
+    # 二元运算对应的Python函数，按照语义分析得到的类型来选择
+    def binaryFunction(self, bop_type:int, type:Type, type1:Type, type2:Type):
+        if bop_type in (PlayScriptParser.ADD, PlayScriptParser.ADD_ASSIGN):
+            if type == String:
+                return lambda a, b: str(a) + str(b)
+            return lambda a, b: a + b
+        elif bop_type in (PlayScriptParser.SUB, PlayScriptParser.SUB_ASSIGN):
+            return lambda a, b: a - b
+        elif bop_type in (PlayScriptParser.MUL, PlayScriptParser.MUL_ASSIGN):
+            return lambda a, b: a * b
+        elif bop_type in (PlayScriptParser.DIV, PlayScriptParser.DIV_ASSIGN):
+            return lambda a, b: a / b
+        elif bop_type in (PlayScriptParser.MOD, PlayScriptParser.MOD_ASSIGN):
+            return lambda a, b: a % b
+        elif bop_type == PlayScriptParser.AND:
+            return lambda a, b: a and b
+        elif bop_type == PlayScriptParser.OR:
+            return lambda a, b: a or b
+        elif bop_type in (PlayScriptParser.EQUAL, PlayScriptParser.NOTEQUAL):
+            # a == null，左边是个class，右边是 Null，直接比较引用
+            upperType = None
+            if PrimitiveType.isNumeric(type1) and PrimitiveType.isNumeric(type2):
+                upperType = PrimitiveType.getUpperType(type1, type2)
+            equal = bop_type == PlayScriptParser.EQUAL
+            if upperType == Integer:
+                return (lambda a, b: int(a) == int(b)) if equal else (lambda a, b: int(a) != int(b))
+            elif upperType == Float:
+                return (lambda a, b: float(a) == float(b)) if equal else (lambda a, b: float(a) != float(b))
+            return (lambda a, b: a == b) if equal else (lambda a, b: a != b)
+        else:
+            # 比较大小只支持数值。对于函数，不支持比较大小。对于对象，不支持运算符重载
+            upperType = PrimitiveType.getUpperType(type1, type2)
+            if upperType == Integer:
+                convert = int
+            elif upperType == Float:
+                convert = float
+            else:
+                # 比如字符串比较大小，结果总是false
+                return lambda a, b: False
+            if bop_type == PlayScriptParser.LT:
+                return lambda a, b: convert(a) < convert(b)
+            elif bop_type == PlayScriptParser.LE:
+                return lambda a, b: convert(a) <= convert(b)
+            elif bop_type == PlayScriptParser.GT:
+                return lambda a, b: convert(a) > convert(b)
+            elif bop_type == PlayScriptParser.GE:
+                return lambda a, b: convert(a) >= convert(b)
+        return None
+
+    '''
+     * 最常用的几种二元运算，直接生成运算的闭包，省掉一次函数调用。
+     * 返回None表示没有特化的版本，改用 binaryFunction。
+    '''
+    def specializeBinary(self, bop_type:int, type:Type, type1:Type, type2:Type, left, right):
+        if type == String and bop_type != PlayScriptParser.ADD:
+            return None
+        upperType = None
+        if PrimitiveType.isNumeric(type1) and PrimitiveType.isNumeric(type2):
+            upperType = PrimitiveType.getUpperType(type1, type2)
+        if bop_type == PlayScriptParser.ADD:
+            if type == String:
+                return lambda f: str(left(f)) + str(right(f))
+            return lambda f: left(f) + right(f)
+        elif bop_type == PlayScriptParser.SUB:
+            return lambda f: left(f) - right(f)
+        elif bop_type == PlayScriptParser.MUL:
+            return lambda f: left(f) * right(f)
+        elif upperType == Integer:
+            if bop_type == PlayScriptParser.LT:
+                return lambda f: int(left(f)) < int(right(f))
+            elif bop_type == PlayScriptParser.LE:
+                return lambda f: int(left(f)) <= int(right(f))
+            elif bop_type == PlayScriptParser.GT:
+                return lambda f: int(left(f)) > int(right(f))
+            elif bop_type == PlayScriptParser.GE:
+                return lambda f: int(left(f)) >= int(right(f))
+            elif bop_type == PlayScriptParser.EQUAL:
+                return lambda f: int(left(f)) == int(right(f))
+        return None
+
+    def visitExpression(self, ctx:PlayScriptParser.ExpressionContext):
+        if ctx in self.at.constOfNode:
+            # 常量折叠过的表达式
+            value = self.at.constOfNode[ctx]
+            return lambda f: value
+        bop = ctx.bop.type if ctx.bop else None
+        if bop == PlayScriptParser.ASSIGN:
+            lvalue = self.visitLValue(ctx.expression(0))
+            return self.compileAssign(lvalue, self.visitExpression(ctx.expression(1)))
+        elif bop in (PlayScriptParser.ADD_ASSIGN, PlayScriptParser.SUB_ASSIGN, PlayScriptParser.MUL_ASSIGN,
+                     PlayScriptParser.DIV_ASSIGN, PlayScriptParser.MOD_ASSIGN):
+            lvalue = self.visitLValue(ctx.expression(0))
+            exp = self.visitExpression(ctx.expression(1))
+            function = self.binaryFunction(bop, self.at.typeOfNode[ctx], None, None)
+            return self.compileUpdate(lvalue, lambda old, f: function(old, exp(f)), False)
+        elif ctx.postfix or (ctx.prefix and ctx.prefix.type in (PlayScriptParser.INC, PlayScriptParser.DEC)):
+            # ++、--
+            op = ctx.postfix if ctx.postfix else ctx.prefix
+            lvalue = self.visitLValue(ctx.expression(0))
+            if op.type == PlayScriptParser.INC:
+                update = lambda old, f: old + 1
+            else:
+                update = lambda old, f: old - 1
+            return self.compileUpdate(lvalue, update, ctx.postfix is not None)
+
+        if bop == PlayScriptParser.DOT:
+            obj = self.visitExpression(ctx.expression(0))
+            leftVar = self.at.symbolOfNode.get(ctx.expression(0))
+            if ctx.IDENTIFIER():
+                # 对于this和super引用的属性，不用考虑重载，因为它们的解析是准确的
+                if isinstance(leftVar, This) or isinstance(leftVar, Super):
+                    offset = self.at.symbolOfNode[ctx].offset
+                    return lambda f: obj(f).fields[offset]
+                # 类的成员可能需要重载，按对象的真实类型查找
+                name = ctx.IDENTIFIER().getText()
+                lookupField = self.lookupField
+                def getField(f):
+                    o = obj(f)
+                    if o is None:
+                        return None
+                    return o.fields[lookupField(o.type, name)]
+                return getField
+            elif ctx.functionCall():
+                return self.visitMethodCall(ctx.functionCall(), obj, isinstance(leftVar, Super))
+        elif bop == PlayScriptParser.QUESTION:
+            condition = self.visitExpression(ctx.expression(0))
+            then = self.visitExpression(ctx.expression(1))
+            other = self.visitExpression(ctx.expression(2))
+            return lambda f: then(f) if condition(f) else other(f)
+        elif bop == PlayScriptParser.INSTANCEOF:
+            # instanceof 的结果是null，跟 ASTEvaluator 一样，不计算左边的表达式
+            return lambda f: None
+        elif bop and len(ctx.expression()) == 2:
+            type = self.at.typeOfNode[ctx]
+            type1 = self.at.typeOfNode[ctx.expression(0)]
+            type2 = self.at.typeOfNode[ctx.expression(1)]
+            left = self.visitExpression(ctx.expression(0))
+            right = self.visitExpression(ctx.expression(1))
+            rtn = self.specializeBinary(bop, type, type1, type2, left, right)
+            if rtn is None:
+                # 两边都要计算（&&、|| 也不短路，和 ASTEvaluator 保持一致）
+                function = self.binaryFunction(bop, type, type1, type2)
+                def binary(f):
+                    a = left(f)
+                    return function(a, right(f))
+                rtn = binary
+            return rtn
+        elif ctx.primary():
+            return self.visitPrimary(ctx.primary())
+        elif ctx.prefix:
+            # 前缀操作：+、-、!
+            exp = self.visitExpression(ctx.expression(0))
+            if ctx.prefix.type == PlayScriptParser.SUB:
+                return lambda f: -exp(f)
+            elif ctx.prefix.type == PlayScriptParser.BANG:
+                return lambda f: not exp(f)
+            return exp
+        elif ctx.functionCall():
+            return self.visitFunctionCall(ctx.functionCall())
+        raise Exception("Unsupported expression: " + ctx.getText())
+
+    def visitPrimary(self, ctx:PlayScriptParser.PrimaryContext):
+        if ctx.literal():
+            value = self.visitLiteral(ctx.literal())
+            return lambda f: value
+        elif ctx.IDENTIFIER():
+            symbol:Symbol = self.at.symbolOfNode[ctx]
+            if isinstance(symbol, Variable):
+                return self.compileLoadVariable(symbol)
+            elif isinstance(symbol, Function):
+                # 函数作为值来使用，生成一个闭包，带上它定义时所处的环境
+                compiled = self.functions[symbol]
+                env = self.compileEnv(symbol)
+                return lambda f: PlayClosure(compiled, env(f))
+        elif ctx.expression():
+            return self.visitExpression(ctx.expression())
+        elif ctx.THIS() or ctx.SUPER():
+            return self.compileThis()
+        return lambda f: None
+
+    def visitLiteral(self, ctx:PlayScriptParser.LiteralContext):
+        return ConstantFolder.literalValue(ctx)
+
+    ############################################################
+    # 函数调用
+
+    # 调用某个函数（或生成它的闭包）时，它的环境是哪一个帧
+    def compileEnv(self, function:Function):
+        parent:Scope = SlotResolver.parentUnit(function)
+        if parent.unitLevel == 0 or isinstance(parent, Class):
+            return lambda f: None
+        return self.frameOf(parent)
+
+    def visitArguments(self, ctx:PlayScriptParser.FunctionCallContext):
+        if ctx.expressionList():
+            return [self.visitExpression(exp) for exp in ctx.expressionList().expression()]
+        return []
+
+    '''
+     * 生成调用某个编译好的函数的闭包。
+     * receiver 是计算this的闭包（普通函数为None），env 是计算闭包环境的闭包。
+    '''
+    def compileCall(self, compiled:CompiledFunction, receiver, args:list, env):
+        if receiver is not None:
+            args = [receiver] + args
+        padding = [None] * (compiled.frameSize - len(args) + 1)
+        if len(args) == 0:
+            def call0(f):
+                frame = padding + [env(f)]
+                compiled.body(frame)
+                return frame[-2]
+            return call0
+        elif len(args) == 1:
+            arg0 = args[0]
+            def call1(f):
+                frame = [arg0(f)]
+                frame += padding
+                frame.append(env(f))
+                compiled.body(frame)
+                return frame[-2]
+            return call1
+        def call(f):
+            frame = [arg(f) for arg in args]
+            frame += padding
+            frame.append(env(f))
+            compiled.body(frame)
+            return frame[-2]
+        return call
+
+    # 调用函数型的值（闭包）
+    def compileCallValue(self, value, args:list):
+        argc = len(args)
+        def callValue(f):
+            closure:PlayClosure = value(f)
+            frame = [arg(f) for arg in args]
+            compiled:CompiledFunction = closure.code
+            frame += [None] * (compiled.frameSize - argc + 1)
+            frame.append(closure.env)
+            compiled.body(frame)
+            return frame[-2]
+        return callValue
+
+    def visitFunctionCall(self, ctx:PlayScriptParser.FunctionCallContext):
+        symbol:Symbol = self.at.symbolOfNode.get(ctx)
+        noEnv = lambda f: None
+
+        # this() 和 super()：在构造方法里调用另一个构造方法
+        if ctx.THIS() or ctx.SUPER():
+            if isinstance(symbol, DefaultConstructor) or symbol is None:
+                # 缺省构造函数一定在之前已经被调用了
+                return lambda f: None
+            return self.compileCall(self.functions[symbol], self.compileThis(), self.visitArguments(ctx), noEnv)
+
+        # 硬编码的println
+        if ctx.IDENTIFIER().getText() == "println":
+            if ctx.expressionList():
+                expressions = [self.visitExpression(exp) for exp in ctx.expressionList().expression()]
+                last = expressions.pop()
+                if expressions:
+                    def println(f):
+                        for exp in expressions:
+                            exp(f)
+                        print(last(f))
+                    return println
+                def println1(f):
+                    print(last(f))
+                return println1
+            def println0(f):
+                print()
+            return println0
+
+        if isinstance(symbol, DefaultConstructor):
+            # 类的缺省构造函数，直接创建对象
+            theClass = symbol.Class()
+            createObject = self.createObject
+            return lambda f: createObject(theClass)
+        elif isinstance(symbol, Function) and symbol.isConstructor():
+            # 先创建对象、做缺省的初始化，再计算参数、调用构造方法，最后返回对象本身
+            theClass = symbol.enclosingScope
+            createObject = self.createObject
+            compiled = self.functions[symbol]
+            args = self.visitArguments(ctx)
+            padding = [None] * (compiled.frameSize - len(args))
+            def construct(f):
+                obj = createObject(theClass)
+                frame = [obj]
+                frame += [arg(f) for arg in args]
+                frame += padding
+                frame.append(None)
+                compiled.body(frame)
+                return obj
+            return construct
+        elif isinstance(symbol, Function):
+            if symbol.isMethod():
+                # 在类的内部直接调用方法，对象就是当前的this
+                return self.compileCall(self.functions[symbol], self.compileThis(), self.visitArguments(ctx), noEnv)
+            return self.compileCall(self.functions[symbol], None, self.visitArguments(ctx), self.compileEnv(symbol))
+        elif isinstance(symbol, Variable):
+            # 函数类型的变量
+            return self.compileCallValue(self.compileLoadVariable(symbol), self.visitArguments(ctx))
+        raise Exception("unable to find function or function variable " + ctx.IDENTIFIER().getText())
+
+    # 对象方法调用，obj 是计算对象的闭包
+    def visitMethodCall(self, ctx:PlayScriptParser.FunctionCallContext, obj, isSuper:bool):
+        symbol:Symbol = self.at.symbolOfNode.get(ctx)
+        if isinstance(symbol, Function):
+            args = self.visitArguments(ctx)
+            if isSuper or symbol.isConstructor():
+                return self.compileCall(self.functions[symbol], obj, args, lambda f: None)
+            if ctx in self.at.devirtualizedCalls:
+                # 所有子类都没有重载这个方法，直接绑定（见 ClassHierarchyAnalyzer）
+                compiled:CompiledFunction = self.functions[self.at.devirtualizedCalls[ctx]]
+                padding = [None] * (compiled.frameSize - len(args) + 1)
+                def finalCall(f):
+                    o = obj(f)
+                    frame = [o]
+                    frame += [arg(f) for arg in args]
+                    if o is None:
+                        return None
+                    frame += padding
+                    compiled.body(frame)
+                    return frame[-2]
+                return finalCall
+            # 对普通的类方法，需要在运行时动态绑定。每个调用点缓存上一次的类型和方法
+            lookupMethod = self.lookupMethod
+            cache = [None, None]
+            def virtualCall(f):
+                o = obj(f)
+                frame = [o]
+                frame += [arg(f) for arg in args]
+                if o is None:
+                    # 对象为null，和ASTEvaluator一样，不调用
+                    return None
+                if cache[0] is not o.type:
+                    cache[0] = o.type
+                    cache[1] = lookupMethod(o.type, symbol)
+                compiled:CompiledFunction = cache[1]
+                frame += [None] * (compiled.frameSize - len(frame) + 2)
+                compiled.body(frame)
+                return frame[-2]
+            return virtualCall
+        elif isinstance(symbol, Variable):
+            # 函数类型的属性
+            offset = symbol.offset
+            return self.compileCallValue(lambda f: obj(f).fields[offset], self.visitArguments(ctx))
+        raise Exception("unable to find method " + ctx.getText())
+
+    ############################################################
+    # 语句
+
+    def visitFunctionDeclaration(self, ctx:PlayScriptParser.FunctionDeclarationContext):
+        if ctx.functionBody().block():
+            return self.visitBlock(ctx.functionBody().block())
+        return lambda f: None
+
+    # 类的缺省初始化：执行字段声明里的初始化表达式
+    def visitClassBody(self, ctx:PlayScriptParser.ClassBodyContext):
+        inits = []
+        for child in ctx.classBodyDeclaration():
+            member = child.memberDeclaration()
+            if member and member.fieldDeclaration():
+                declarators = member.fieldDeclaration().variableDeclarators()
+                for declarator in declarators.variableDeclarator():
+                    if declarator.variableInitializer():
+                        variable = self.at.symbolOfNode[declarator.variableDeclaratorId()]
+                        lvalue = ('field', self.compileThis(), lambda obj, offset=variable.offset: offset)
+                        inits.append(self.compileAssign(lvalue, self.visitVariableInitializer(declarator.variableInitializer())))
+        def init(f):
+            for exp in inits:
+                exp(f)
+        return init
+
+    def visitBlock(self, ctx:PlayScriptParser.BlockContext):
+        # block 里的变量已经摊平到函数的帧里了，不需要再建立新的栈桢
+        return self.visitBlockStatements(ctx.blockStatements())
+
+    def visitBlockStatements(self, ctx:PlayScriptParser.BlockStatementsContext):
+        statements = []
+        for child in ctx.blockStatement():
+            statement = self.visitBlockStatement(child)
+            if statement is not None:
+                statements.append(statement)
+        if len(statements) == 1:
+            return statements[0]
+        def block(f):
+            for statement in statements:
+                status = statement(f)
+                if status:
+                    return status
+        return block
+
+    def visitBlockStatement(self, ctx:PlayScriptParser.BlockStatementContext):
+        # 函数和类的声明单独编译
+        if ctx.variableDeclarators():
+            return self.visitVariableDeclarators(ctx.variableDeclarators())
+        elif ctx.statement():
+            return self.visitStatement(ctx.statement())
+        return None
+
+    def visitVariableDeclarators(self, ctx:PlayScriptParser.VariableDeclaratorsContext):
+        assigns = []
+        for child in ctx.variableDeclarator():
+            variable:Variable = self.at.symbolOfNode[child.variableDeclaratorId()]
+            if child.variableInitializer():
+                exp = self.visitVariableInitializer(child.variableInitializer())
+            else:
+                # 每次进入 block 都是一个新的变量，没有初始化的变量是 None
+                exp = lambda f: None
+            assigns.append(self.compileAssign(('var', variable), exp))
+        return self.asStatement(assigns)
+
+    def visitVariableInitializer(self, ctx:PlayScriptParser.VariableInitializerContext):
+        if ctx.expression():
+            return self.visitExpression(ctx.expression())
+        raise Exception("Unsupported feature: array initializer")
+
+    # 把一组表达式包装成语句：依次计算，丢掉值，状态为正常
+    def asStatement(self, expressions:list):
+        if len(expressions) == 1:
+            exp = expressions[0]
+            def statement(f):
+                exp(f)
+            return statement
+        def statements(f):
+            for exp in expressions:
+                exp(f)
+        return statements
+
+    def visitStatement(self, ctx:PlayScriptParser.StatementContext):
+        if ctx.statementExpression:
+            return self.asStatement([self.visitExpression(ctx.statementExpression)])
+        elif ctx.IF():
+            condition = self.visitExpression(ctx.parExpression().expression())
+            then = self.visitStatement(ctx.statement(0))
+            if ctx.ELSE():
+                other = self.visitStatement(ctx.statement(1))
+                def ifElse(f):
+                    if condition(f):
+                        return then(f)
+                    return other(f)
+                return ifElse
+            def ifThen(f):
+                if condition(f):
+                    return then(f)
+            return ifThen
+        elif ctx.WHILE():
+            condition = self.visitExpression(ctx.parExpression().expression())
+            body = self.visitStatement(ctx.statement(0))
+            def whileLoop(f):
+                while condition(f):
+                    status = body(f)
+                    if status:
+                        if status == BREAK:
+                            break
+                        elif status == RETURN:
+                            return status
+            return whileLoop
+        elif ctx.FOR():
+            forControl:PlayScriptParser.ForControlContext = ctx.forControl()
+            if forControl.enhancedForControl():
+                # 跟 ASTEvaluator 一样，还不支持 enhanced for，执行时什么都不做
+                return lambda f: None
+            init = None
+            if forControl.forInit():
+                forInit:PlayScriptParser.ForInitContext = forControl.forInit()
+                if forInit.variableDeclarators():
+                    init = self.visitVariableDeclarators(forInit.variableDeclarators())
+                else:
+                    init = self.asStatement([self.visitExpression(exp) for exp in forInit.expressionList().expression()])
+            # 如果没有条件判断部分，意味着一直循环
+            condition = lambda f: True
+            if forControl.expression():
+                condition = self.visitExpression(forControl.expression())
+            update = lambda f: None
+            if forControl.forUpdate:
+                update = self.asStatement([self.visitExpression(exp) for exp in forControl.forUpdate.expression()])
+            body = self.visitStatement(ctx.statement(0))
+            def forLoop(f):
+                if init is not None:
+                    init(f)
+                while condition(f):
+                    status = body(f)
+                    if status:
+                        if status == BREAK:
+                            break
+                        elif status == RETURN:
+                            return status
+                    update(f)
+            return forLoop
+        elif ctx.blockLabel:
+            return self.visitBlock(ctx.blockLabel)
+        elif ctx.BREAK():
+            return lambda f: BREAK
+        elif ctx.CONTINUE():
+            return lambda f: CONTINUE
+        elif ctx.RETURN():
+            if ctx.expression():
+                exp = self.visitExpression(ctx.expression())
+                def returnValue(f):
+                    f[-2] = exp(f)
+                    return RETURN
+                return returnValue
+            return lambda f: RETURN
+        return lambda f: None
@@ -0,0 +1,118 @@
+import os
+import sys
+import hashlib
+import marshal
+
+
+# 编译器自身的源文件。任何一个改了，以前缓存的编译结果就都作废
+COMPILER_FILES = ['PlayScriptLexer.py', 'PlayScriptParser.py', 'regex_lexer.py', 'rd_parser.py', 'frontend.py', 'python_transpiler.py', 'compile_cache.py']
+
+# 缓存项的格式版本，缓存项的内容结构变了就加1
+CACHE_FORMAT = 1
+
+_compilerVersion = None
+
+
+'''
+ * 编译器的版本：编译器各个源文件的内容，加上 Python 的版本（marshal 的格式跟 Python 版本有关）
+'''
+def compilerVersion() -> str:
+    global _compilerVersion
+    if _compilerVersion is None:
+        h = hashlib.sha256()
+        h.update(('%d %s\0' % (CACHE_FORMAT, sys.implementation.cache_tag)).encode('utf-8'))
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in COMPILER_FILES:
+            with open(os.path.join(directory, name), 'rb') as fin:
+                h.update(fin.read())
+            h.update(b'\0')
+        _compilerVersion = h.hexdigest()
+    return _compilerVersion
+
+
+'''
+ * 执行翻译成 Python 的程序（compile() 得到的 code object）：先定义所有的函数和类，再调用 _main()。
+ * 放在这里而不是 python_transpiler 里，是为了命中缓存时不用导入前端和翻译器
+'''
+def runProgram(code):
+    namespace = {}
+    exec(code, namespace)
+    namespace['_main']()
+
+
+'''
+ * 编译结果的磁盘缓存，类似 Python 的 __pycache__：放在脚本所在目录下的 __playcache__ 目录里。
+ * 缓存的是翻译成的 Python 代码，以及编译好的 Python code object。命中缓存时，
+ * 词法分析、语法分析、语义分析（translate()）和翻译都不用做了，直接执行 code object。
+ * 键是脚本源码和编译器版本的hash，所以脚本或编译器改了都不会命中旧的缓存项。
+ * 目录的总大小有上限，超过时按LRU淘汰：每次命中都更新缓存文件的修改时间，淘汰时先删最久没用过的。
+ * 缓存只是为了加速，读写失败都当做没有缓存。
+'''
+class CompileCache():
+    DIRNAME = '__playcache__'
+    SUFFIX = '.playc'
+    # 缺省的大小上限：64M
+    MAX_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, directory:str, maxSize:int=MAX_SIZE):
+        self.directory = directory
+        self.maxSize = maxSize
+
+    # 某个脚本所用的缓存
+    def forScript(scriptPath:str, maxSize:int=MAX_SIZE):
+        directory = os.path.join(os.path.dirname(os.path.abspath(scriptPath)), CompileCache.DIRNAME)
+        return CompileCache(directory, maxSize)
+
+    def keyOf(self, source:str) -> str:
+        h = hashlib.sha256()
+        h.update(compilerVersion().encode('utf-8'))
+        h.update(b'\0')
+        h.update(source.encode('utf-8'))
+        return h.hexdigest()
+
+    def pathOf(self, source:str) -> str:
+        return os.path.join(self.directory, self.keyOf(source) + CompileCache.SUFFIX)
+
+    # 查找缓存，返回 (Python源代码, code object)，没有就返回None
+    def load(self, source:str):
+        path = self.pathOf(source)
+        try:
+            with open(path, 'rb') as fin:
+                pySource, code = marshal.load(fin)
+            # 更新修改时间，淘汰时按它排序
+            os.utime(path)
+            return (pySource, code)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def store(self, source:str, pySource:str, code):
+        path = self.pathOf(source)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # 先写到临时文件，再改名，避免别的进程读到写了一半的文件
+            tmpPath = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmpPath, 'wb') as fout:
+                marshal.dump((pySource, code), fout)
+            os.replace(tmpPath, path)
+            self.evict()
+        except OSError:
+            pass
+
+    # 总大小超过上限时，从最久没用过的缓存项开始删
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(CompileCache.SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.maxSize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
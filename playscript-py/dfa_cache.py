@@ -0,0 +1,426 @@
+import os
+import sys
+import time
+import marshal
+import hashlib
+from typing import List
+
+from antlr4 import *
+from antlr4.PredictionContext import PredictionContext, SingletonPredictionContext, ArrayPredictionContext, PredictionContextCache
+from antlr4.atn.ATNConfig import ATNConfig, LexerATNConfig
+from antlr4.atn.ATNConfigSet import ATNConfigSet
+from antlr4.atn.LexerAction import LexerIndexedCustomAction
+from antlr4.atn.LexerActionExecutor import LexerActionExecutor
+from antlr4.dfa.DFAState import DFAState, PredPrediction
+import antlr4.atn.SemanticContext as semanticContexts
+
+
+'''
+ * ANTLR 的 DFA 缓存的持久化。
+ * ANTLR 的自适应预测（adaptivePredict）边分析边构造 DFA，存在识别器类的 decisionsToDFA 上，同一个进程里的所有解析共享。
+ * 但每个新进程都从空的 DFA 开始，第一次解析要在 ATN 上做大量的闭包计算，比以后慢得多。
+ * 这里把 PlayScriptLexer、PlayScriptParser 在一批训练用的脚本上构造出来的 DFA 存到文件里，下一个进程启动时载入，第一次解析就是热的。
+ *
+ * DFA 状态里的 ATNConfig、PredictionContext 等对象缓存了 hash 值，其中用到了字符串的 hash，每个进程都不一样，
+ * 所以不能直接用 pickle：这里把它们转换成只含数字和元组的表格，载入时再用构造函数重建，hash 值在新进程里重新计算。
+ * 文件里记录了 ATN 的 hash，语法改了以后旧的文件自动作废。
+'''
+class DFACache():
+    FORMAT = 1
+    # 缺省的文件：放在编译器目录下的 __playcache__ 里
+    DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__playcache__', 'PlayScript.dfa')
+
+    def __init__(self, path:str=DEFAULT_PATH):
+        self.path = path
+        self.data = None
+
+    # 把这些识别器类当前的 DFA 存到文件里
+    def save(self, recognizers:list):
+        data = {'format': DFACache.FORMAT}
+        for recognizer in recognizers:
+            data[recognizer.__name__] = (DFACache.atnSignature(recognizer), DFAWriter(recognizer).write())
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # 先写到临时文件，再改名，避免别的进程读到写了一半的文件
+        tmpPath = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmpPath, 'wb') as fout:
+            marshal.dump(data, fout)
+        os.replace(tmpPath, self.path)
+
+    # 读文件，只读一次。文件不存在或者格式不对都返回None
+    def load(self):
+        if self.data is None:
+            try:
+                with open(self.path, 'rb') as fin:
+                    data = marshal.load(fin)
+                self.data = data if isinstance(data, dict) and data.get('format') == DFACache.FORMAT else {}
+            except (OSError, EOFError, ValueError, TypeError):
+                self.data = {}
+        return self.data or None
+
+    '''
+     * 用文件里的 DFA 替换识别器类上还是空的 DFA。返回是否载入了。
+     * 识别器已经开始构造自己的 DFA 以后就不再载入，免得丢掉已有的状态。
+    '''
+    def warm(self, recognizer) -> bool:
+        if any(dfa.states for dfa in recognizer.decisionsToDFA):
+            return False
+        data = self.load()
+        entry = data.get(recognizer.__name__) if data else None
+        if entry is None or entry[0] != DFACache.atnSignature(recognizer):
+            return False
+        DFAReader(recognizer).read(entry[1])
+        return True
+
+    # ATN 的 hash，用来检查文件是不是用现在的语法生成的
+    def atnSignature(recognizer) -> str:
+        serializedATN = sys.modules[recognizer.__module__].serializedATN()
+        return hashlib.sha256(serializedATN.encode('utf-8')).hexdigest()
+
+    # 把识别器类的 DFA 清空，回到刚启动时的状态
+    def reset(recognizer):
+        for i, ds in enumerate(recognizer.atn.decisionToState):
+            recognizer.decisionsToDFA[i] = DFA(ds, i)
+        if hasattr(recognizer, 'sharedContextCache'):
+            recognizer.sharedContextCache = PredictionContextCache()
+
+
+_defaultCache = None
+
+
+'''
+ * 用缺省的文件预热识别器类的 DFA。在第一次创建 PlayScriptLexer、PlayScriptParser 之前调用，没有文件时什么都不做
+'''
+def warmDFA(recognizer) -> bool:
+    global _defaultCache
+    if _defaultCache is None:
+        _defaultCache = DFACache()
+    return _defaultCache.warm(recognizer)
+
+
+'''
+ * 把一个识别器类的所有 DFA 转换成只含数字、字符串和元组的表格，可以直接用 marshal 保存。
+ * PredictionContext、SemanticContext、LexerActionExecutor 在 DFA 状态之间是共享的，各自放在一张表里，用下标引用；
+ * ATN 状态和 lexer action 用它们在 ATN 里的编号引用。
+'''
+class DFAWriter():
+    ERROR = -2  # 引用 ATNSimulator.ERROR 这个特殊的状态
+
+    def __init__(self, recognizer):
+        self.atn = recognizer.atn
+        self.recognizer = recognizer
+        self.contexts = []
+        self.contextIndex = {}
+        self.semantics = []
+        self.semanticIndex = {}
+        self.executors = []
+        self.executorIndex = {}
+
+    def write(self):
+        dfas = []
+        for dfa in self.recognizer.decisionsToDFA:
+            if dfa.s0 is not None:
+                dfas.append(self.writeDFA(dfa))
+        return (tuple(self.contexts), tuple(self.semantics), tuple(self.executors), tuple(dfas))
+
+    def writeDFA(self, dfa):
+        states = sorted(dfa.states, key=lambda state: state.stateNumber)
+        stateIndex = {id(state): i for i, state in enumerate(states)}
+
+        def ref(state):
+            if state is None:
+                return -1
+            if state.stateNumber == ParserATNSimulator.ERROR.stateNumber:
+                return DFAWriter.ERROR
+            i = stateIndex.get(id(state))
+            if i is None:
+                # 不在 dfa.states 里的状态，也一并保存
+                i = stateIndex[id(state)] = len(states)
+                states.append(state)
+            return i
+
+        if dfa.precedenceDfa:
+            s0 = tuple(ref(state) for state in dfa.s0.edges)
+        else:
+            s0 = ref(dfa.s0)
+        rtn = []
+        i = 0
+        while i < len(states):
+            state = states[i]
+            edges = tuple(ref(target) for target in state.edges) if state.edges is not None else None
+            predicates = tuple((self.semanticRef(p.pred), p.alt) for p in state.predicates) if state.predicates is not None else None
+            rtn.append((self.writeConfigSet(state.configs), edges, state.isAcceptState, state.prediction,
+                        self.executorRef(state.lexerActionExecutor), state.requiresFullContext, predicates))
+            i += 1
+        return (dfa.decision, dfa.precedenceDfa, s0, tuple(rtn))
+
+    def writeConfigSet(self, configs:ATNConfigSet):
+        items = []
+        for config in configs.configs:
+            item = (config.state.stateNumber, config.alt, self.contextRef(config.context), self.semanticRef(config.semanticContext),
+                    config.reachesIntoOuterContext, config.precedenceFilterSuppressed)
+            if isinstance(config, LexerATNConfig):
+                item += (self.executorRef(config.lexerActionExecutor), config.passedThroughNonGreedyDecision)
+            items.append(item)
+        conflictingAlts = tuple(sorted(configs.conflictingAlts)) if configs.conflictingAlts is not None else None
+        return (configs.fullCtx, configs.uniqueAlt, conflictingAlts, configs.hasSemanticContext, configs.dipsIntoOuterContext, tuple(items))
+
+    def contextRef(self, context:PredictionContext) -> int:
+        if context is None:
+            return -1
+        i = self.contextIndex.get(id(context))
+        if i is None:
+            # 先写父节点，载入时按顺序重建就行了
+            if context is PredictionContext.EMPTY:
+                entry = ('E',)
+            elif isinstance(context, SingletonPredictionContext):
+                entry = ('S', self.contextRef(context.parentCtx), context.returnState)
+            else:
+                entry = ('A', tuple(self.contextRef(parent) for parent in context.parents), tuple(context.returnStates))
+            i = self.contextIndex[id(context)] = len(self.contexts)
+            self.contexts.append(entry)
+        return i
+
+    def semanticRef(self, semantic) -> int:
+        i = self.semanticIndex.get(id(semantic))
+        if i is None:
+            if semantic is semanticContexts.SemanticContext.NONE:
+                entry = ('N',)
+            elif isinstance(semantic, semanticContexts.PrecedencePredicate):
+                entry = ('R', semantic.precedence)
+            elif isinstance(semantic, semanticContexts.Predicate):
+                entry = ('P', semantic.ruleIndex, semantic.predIndex, semantic.isCtxDependent)
+            elif isinstance(semantic, semanticContexts.AND):
+                entry = ('&', tuple(self.semanticRef(operand) for operand in semantic.opnds))
+            else:
+                entry = ('|', tuple(self.semanticRef(operand) for operand in semantic.opnds))
+            i = self.semanticIndex[id(semantic)] = len(self.semantics)
+            self.semantics.append(entry)
+        return i
+
+    def executorRef(self, executor:LexerActionExecutor) -> int:
+        if executor is None:
+            return -1
+        i = self.executorIndex.get(id(executor))
+        if i is None:
+            actions = []
+            for action in executor.lexerActions:
+                if isinstance(action, LexerIndexedCustomAction):
+                    actions.append((action.offset, self.atn.lexerActions.index(action.action)))
+                else:
+                    actions.append((-1, self.atn.lexerActions.index(action)))
+            i = self.executorIndex[id(executor)] = len(self.executors)
+            self.executors.append(tuple(actions))
+        return i
+
+
+'''
+ * 从 DFAWriter 生成的表格重建 DFA，放到识别器类的 decisionsToDFA 上
+'''
+class DFAReader():
+    def __init__(self, recognizer):
+        self.atn = recognizer.atn
+        self.recognizer = recognizer
+        # lexer 和 parser 各自有一个表示出错的特殊状态，DFA 里的边要指向同一个对象
+        self.error = LexerATNSimulator.ERROR if issubclass(recognizer, Lexer) else ParserATNSimulator.ERROR
+        self.contexts = []
+        self.semantics = []
+        self.executors = []
+
+    def read(self, table):
+        contexts, semantics, executors, dfas = table
+        for entry in contexts:
+            if entry[0] == 'E':
+                context = PredictionContext.EMPTY
+            elif entry[0] == 'S':
+                context = SingletonPredictionContext(self.context(entry[1]), entry[2])
+            else:
+                context = ArrayPredictionContext([self.context(i) for i in entry[1]], list(entry[2]))
+            self.contexts.append(context)
+        for entry in semantics:
+            if entry[0] == 'N':
+                semantic = semanticContexts.SemanticContext.NONE
+            elif entry[0] == 'R':
+                semantic = semanticContexts.PrecedencePredicate(entry[1])
+            elif entry[0] == 'P':
+                semantic = semanticContexts.Predicate(entry[1], entry[2], entry[3])
+            else:
+                # AND、OR 的构造函数会再做化简，这里直接恢复原来的操作数
+                semantic = semanticContexts.AND.__new__(semanticContexts.AND if entry[0] == '&' else semanticContexts.OR)
+                semantic.opnds = [self.semantics[i] for i in entry[1]]
+            self.semantics.append(semantic)
+        for entry in executors:
+            actions = []
+            for offset, index in entry:
+                action = self.atn.lexerActions[index]
+                actions.append(LexerIndexedCustomAction(offset, action) if offset >= 0 else action)
+            self.executors.append(LexerActionExecutor(actions))
+        for entry in dfas:
+            dfa = self.readDFA(entry)
+            self.recognizer.decisionsToDFA[dfa.decision] = dfa
+
+    def context(self, i:int):
+        return self.contexts[i] if i >= 0 else None
+
+    def executor(self, i:int):
+        return self.executors[i] if i >= 0 else None
+
+    def readDFA(self, entry):
+        decision, precedenceDfa, s0, items = entry
+        dfa = DFA(self.atn.decisionToState[decision], decision)
+        # 先创建所有的状态，边才能指向后面的状态
+        states = [DFAState() for _ in items]
+
+        def state(i):
+            if i == DFAWriter.ERROR:
+                return self.error
+            return states[i] if i >= 0 else None
+
+        for i, (configs, edges, isAcceptState, prediction, executor, requiresFullContext, predicates) in enumerate(items):
+            s = states[i]
+            s.stateNumber = i
+            s.configs = self.readConfigSet(configs)
+            s.edges = [state(target) for target in edges] if edges is not None else None
+            s.isAcceptState = isAcceptState
+            s.prediction = prediction
+            s.lexerActionExecutor = self.executor(executor)
+            s.requiresFullContext = requiresFullContext
+            s.predicates = [PredPrediction(self.semantics[pred], alt) for pred, alt in predicates] if predicates is not None else None
+            dfa.states[s] = s
+        if precedenceDfa:
+            dfa.s0.edges = [state(i) for i in s0]
+        else:
+            dfa.s0 = state(s0)
+        return dfa
+
+    def readConfigSet(self, entry) -> ATNConfigSet:
+        fullCtx, uniqueAlt, conflictingAlts, hasSemanticContext, dipsIntoOuterContext, items = entry
+        configs = ATNConfigSet(fullCtx)
+        for item in items:
+            state = self.atn.states[item[0]]
+            if len(item) > 6:
+                config = LexerATNConfig(state, item[1], self.context(item[2]), self.semantics[item[3]], self.executor(item[6]))
+                config.passedThroughNonGreedyDecision = item[7]
+            else:
+                config = ATNConfig(state, item[1], self.context(item[2]), self.semantics[item[3]])
+            config.reachesIntoOuterContext = item[4]
+            config.precedenceFilterSuppressed = item[5]
+            configs.configs.append(config)
+        configs.uniqueAlt = uniqueAlt
+        configs.conflictingAlts = set(conflictingAlts) if conflictingAlts is not None else None
+        configs.hasSemanticContext = hasSemanticContext
+        configs.dipsIntoOuterContext = dipsIntoOuterContext
+        configs.setReadonly(True)
+        return configs
+
+
+'''
+ * 用 ANTLR 生成的 PlayScriptLexer 和 PlayScriptParser 解析，跟 frontend 在遇到错误时走的路径一样，用来训练和测试
+'''
+def antlrLexAndParse(text:str):
+    from PlayScriptLexer import PlayScriptLexer
+    from frontend import parseWithANTLR
+    lexer = PlayScriptLexer(InputStream(text))
+    lexer.removeErrorListeners()
+    token_stream = CommonTokenStream(lexer)
+    token_stream.fill()
+    return parseWithANTLR(token_stream, reportErrors=False)
+
+
+def readScripts(paths:List[str]) -> List[str]:
+    from regex_lexer import scriptsUnder
+    rtn = []
+    for path in scriptsUnder(paths):
+        with open(path, 'r', encoding='utf-8') as fin:
+            rtn.append((path, fin.read()))
+    return rtn
+
+
+# 解析训练用的脚本，把得到的 DFA 存起来
+def train(paths:List[str], cache:DFACache):
+    from PlayScriptLexer import PlayScriptLexer
+    from PlayScriptParser import PlayScriptParser
+    for _, text in readScripts(paths):
+        antlrLexAndParse(text)
+    cache.save([PlayScriptLexer, PlayScriptParser])
+    for recognizer in (PlayScriptLexer, PlayScriptParser):
+        print('%-16s %6d DFA states' % (recognizer.__name__, sum(len(dfa.states) for dfa in recognizer.decisionsToDFA)))
+    print('saved to %s (%d bytes)' % (cache.path, os.path.getsize(cache.path)))
+
+
+'''
+ * 差分检查：对每个文件，用冷的 DFA 和载入的 DFA 解析出来的树要完全一样
+'''
+def check(paths:List[str], cache:DFACache) -> bool:
+    from PlayScriptLexer import PlayScriptLexer
+    from PlayScriptParser import PlayScriptParser
+    from rd_parser import compareTrees
+    scripts = readScripts(paths)
+    ok = True
+    for recognizer in (PlayScriptLexer, PlayScriptParser):
+        DFACache.reset(recognizer)
+    expected = [antlrLexAndParse(text) for _, text in scripts]
+    for recognizer in (PlayScriptLexer, PlayScriptParser):
+        DFACache.reset(recognizer)
+        if not cache.warm(recognizer):
+            print('FAIL: no DFA for %s in %s' % (recognizer.__name__, cache.path))
+            return False
+    for (path, text), tree in zip(scripts, expected):
+        diff = compareTrees(antlrLexAndParse(text), tree)
+        if diff:
+            print('FAIL %s: %s' % (path, diff))
+            ok = False
+    print('%d files, %s' % (len(scripts), 'all the same' if ok else 'FAILED'))
+    return ok
+
+
+'''
+ * 性能测试：每个文件都在一个刚启动的状态下解析一次，比较 DFA 是空的和载入了 DFA 时第一次解析的时间
+'''
+def benchmark(paths:List[str], cache:DFACache):
+    from PlayScriptLexer import PlayScriptLexer
+    from PlayScriptParser import PlayScriptParser
+    recognizers = (PlayScriptLexer, PlayScriptParser)
+    start = time.perf_counter()
+    cache.load()
+    print('load %s: %.3f ms' % (cache.path, (time.perf_counter() - start) * 1000))
+    totals = [0.0, 0.0]
+    print('%-48s %12s %12s' % ('file', 'cold (ms)', 'warm (ms)'))
+    for path, text in readScripts(paths):
+        seconds = []
+        for warm in (False, True):
+            for recognizer in recognizers:
+                DFACache.reset(recognizer)
+            if warm:
+                start = time.perf_counter()
+                for recognizer in recognizers:
+                    cache.warm(recognizer)
+                warmSeconds = time.perf_counter() - start
+            start = time.perf_counter()
+            antlrLexAndParse(text)
+            seconds.append(time.perf_counter() - start)
+        totals[0] += seconds[0]
+        totals[1] += seconds[1]
+        print('%-48s %12.3f %12.3f' % (os.path.basename(path), seconds[0] * 1000, seconds[1] * 1000))
+    print('%-48s %12.3f %12.3f' % ('total', totals[0] * 1000, totals[1] * 1000))
+    print('rebuilding the DFA from the loaded file: %.3f ms' % (warmSeconds * 1000))
+
+
+# 用法：
+# python dfa_cache.py -train <文件或目录...> [-o 文件]
+# python dfa_cache.py -check <文件或目录...> [-o 文件]
+# python dfa_cache.py -bench <文件或目录...> [-o 文件]
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    cache = DFACache()
+    if '-o' in args:
+        i = args.index('-o')
+        cache = DFACache(args[i + 1])
+        del args[i:i + 2]
+    if args and args[0] == '-train':
+        train(args[1:], cache)
+    elif args and args[0] == '-check':
+        sys.exit(0 if check(args[1:], cache) else 1)
+    elif args and args[0] == '-bench':
+        benchmark(args[1:], cache)
+    else:
+        print('usage: dfa_cache.py -train|-check|-bench <files or directories> [-o file]')
@@ -1,16 +1,20 @@
 import sys
 import os
+import time
 from typing import List, Set
 # from types import FunctionType
 
 from antlr4 import *
+from antlr4.error.Errors import ParseCancellationException
 # from antlr4.tree.Tree import *
 # from antlr4.atn.ATNState import BlockEndState
 
-from PlayScriptLexer import *
 from PlayScriptParser import *
 from PlayScriptListener import *
 from PlayScriptVisitor import *
+from regex_lexer import *
+from rd_parser import *
+from dfa_cache import warmDFA
 
 import enum
 
@@ -42,16 +46,36 @@ class Scope(Symbol):
 
     def __init__(self):
         super().__init__()
-        # List<Symbol>
+        # List<Symbol>，保持声明的顺序
         self.symbols = []
+        # 按名称建立的索引，由 addSymbol 维护，查找时不用再扫描 symbols
+        self.symbolSet = set()    # Set<Symbol>
+        self.variableIndex = {}   # Map<str, List<Variable>>
+        self.functionIndex = {}   # Map<str, List<Function>>，同名的重载函数放在一起
+        self.classIndex = {}      # Map<str, Class>
+        # 以下属性由 SlotResolver 计算，供执行引擎使用
+        # 本作用域所属的帧单元（根作用域、Function 或 Class）
+        self.unit = None
+        # 帧单元的嵌套层级，根作用域为0
+        self.unitLevel = 0
+        # 帧单元的槽位数量
+        self.frameSize = 0
     def addSymbol(self, symbol):
         self.symbols.append(symbol)
+        self.symbolSet.add(symbol)
         symbol.enclosingScope = self
+        # 重名的时候，跟按顺序扫描一样，先声明的排在前面
+        if isinstance(symbol, Variable):
+            self.variableIndex.setdefault(symbol.name, []).append(symbol)
+        elif isinstance(symbol, Function):
+            self.functionIndex.setdefault(symbol.name, []).append(symbol)
+        elif isinstance(symbol, Class):
+            self.classIndex.setdefault(symbol.name, symbol)
     
     def getVariable(self, name):
-        for s in self.symbols:
-            if isinstance(s, Variable) and s.name == name:
-                return s
+        variables = self.variableIndex.get(name)
+        if variables:
+            return variables[0]
         return None
     
     '''
@@ -62,11 +86,11 @@ class Scope(Symbol):
     '''
     def getFunction(self, name:str, paramTypes):
         rtn = None
-        for s in self.symbols:
-            if isinstance(s, Function) and s.name == name:
-                if s.matchParameterTypes(paramTypes):
-                    rtn = s
-                    break
+        # 只需要在同名的重载函数里按参数类型匹配
+        for s in self.functionIndex.get(name, ()):
+            if s.matchParameterTypes(paramTypes):
+                rtn = s
+                break
         return rtn
 
     '''
@@ -74,8 +98,9 @@ class Scope(Symbol):
     '''
     def getFunctionVariable(self, name, paramTypes):
         rtn:Variable = None
-        for s in self.symbols:
-            if isinstance(s, Variable) and isinstance(s.type, FunctionType) and (s.name == name):
+        # 变量的类型是在加入符号表之后才解析的，所以这里还要检查一下类型
+        for s in self.variableIndex.get(name, ()):
+            if isinstance(s.type, FunctionType):
                 functionType:FunctionType = s.type
                 if functionType.matchParameterTypes(paramTypes):
                     rtn = s
@@ -86,16 +111,11 @@ class Scope(Symbol):
      * 是否包含某个Class
     '''
     def getClass(self, name:str) -> Class:
-        rtn = None
-        for s in self.symbols:
-            if isinstance(s, Class) and s.name == name:
-                rtn = s
-                break
-        return rtn
+        return self.classIndex.get(name)
     
     # 是否包含某个Symbol
     def containsSymbol(self, symbol:Symbol):
-        return symbol in self.symbols
+        return symbol in self.symbolSet
 
 
 class Variable(Symbol):
@@ -111,6 +131,12 @@ class Variable(Symbol):
         self.defaultValue = None
         # 是否允许多次重复，这是一个创新的参数机制
         self.multiplicity = 1
+        # 在所属帧单元里的槽位，由 SlotResolver 计算。类的成员变量没有槽位
+        self.slot = -1
+        # 类的成员变量在对象里的偏移量，由 Class.getFieldLayout() 计算
+        self.offset = -1
+        # 是否用 const 修饰。const 变量不能被赋值
+        self.isConst = False
 
     # /**
     #  * 是不是类的属性
@@ -315,6 +341,8 @@ class Function(Scope, FunctionType):
         self.closureVariables = set()  # Set<Variable>
         
         self.paramTypes = []  # List<Type>
+        # 类的方法在虚函数表里的位置，由 Class.getVTable() 计算
+        self.vtableIndex = -1
 
         self.name = name
         self.enclosingScope = enclosingScope
@@ -418,6 +446,10 @@ class Class(Scope, Type):
         self.thisRef:This = This(self, ctx)
         self.thisRef.type = self
         self.defaultConstructor:DefaultConstructor = None
+        # 对象的内存布局：从父类到子类所有的成员变量，List<Variable>。第一次用到时计算
+        self.fieldLayout:List[Variable] = None
+        # 虚函数表，List<Function>。第一次用到时计算
+        self.vtable:List[Function] = None
     
     def getParentClass(self) -> Class:
         return self.parentClass
@@ -485,7 +517,7 @@ class Class(Scope, Type):
         if symbol == self.thisRef or symbol == self.superRef:
             return True
         rtn = False
-        rtn = symbol in self.symbols
+        rtn = symbol in self.symbolSet
         if not rtn and self.parentClass:
             rtn = self.parentClass.containsSymbol(symbol)
         return rtn
@@ -508,6 +540,45 @@ class Class(Scope, Type):
                 return self.isAncestor(theClass.getParentClass())
         return False
 
+    '''
+     * 对象的内存布局。父类的成员变量在前，自己的在后，每个成员变量的偏移量记在 Variable.offset 里。
+     * 子类对象的前半部分跟父类对象的布局一样，所以同一个成员变量在所有子类里的偏移量都相同。
+    '''
+    def getFieldLayout(self) -> List[Variable]:
+        if self.fieldLayout is None:
+            layout:List[Variable] = []
+            if self.parentClass:
+                layout.extend(self.parentClass.getFieldLayout())
+            for symbol in self.symbols:
+                if isinstance(symbol, Variable):
+                    symbol.offset = len(layout)
+                    layout.append(symbol)
+            self.fieldLayout = layout
+        return self.fieldLayout
+
+    '''
+     * 虚函数表。先复制父类的表，再把自己的方法填进去：重载了父类方法的，占用被重载方法的位置；
+     * 新的方法追加到表的后面。这样 vtable[function.vtableIndex] 就是对象的真实类型里被重载后的方法。
+    '''
+    def getVTable(self) -> List[Function]:
+        if self.vtable is None:
+            vtable:List[Function] = []
+            if self.parentClass:
+                vtable.extend(self.parentClass.getVTable())
+            for symbol in self.symbols:
+                if isinstance(symbol, Function) and not symbol.isConstructor():
+                    overrided:Function = None
+                    if self.parentClass:
+                        overrided = self.parentClass.getFunction(symbol.name, symbol.getParamTypes())
+                    if overrided and overrided.vtableIndex >= 0:
+                        symbol.vtableIndex = overrided.vtableIndex
+                        vtable[symbol.vtableIndex] = symbol
+                    else:
+                        symbol.vtableIndex = len(vtable)
+                        vtable.append(symbol)
+            self.vtable = vtable
+        return self.vtable
+
     def getDefaultConstructor(self) -> DefaultConstructor:
         if self.defaultConstructor is None:
             self.defaultConstructor = DefaultConstructor(self.name, self)
@@ -561,11 +632,33 @@ class AnnotatedTree():
         # 在构造函数里,引用的super()。第二个函数是被调用的构造函数
         self.superConstructorRef = {}  # Map<Function, Function>
 
+        # 常量折叠的结果：在编译期就能算出值的表达式，执行引擎直接使用这个值
+        self.constOfNode = {}  # Map<ExpressionContext, Object>
+
+        # 处在尾部位置的函数调用：return 语句的表达式就是这个函数调用。执行引擎可以复用当前的栈桢，不再嵌套调用
+        self.tailCalls = set()  # Set<FunctionCallContext>
+
+        # 纯函数：不读写外部的可变变量、不输出、只调用纯函数。用同样的参数调用，结果一定一样
+        self.pureFunctions = set()  # Set<Function>
+
+        # 类层次分析证明不需要动态绑定的方法调用（obj.foo()），以及直接绑定的方法
+        self.devirtualizedCalls = {}  # Map<FunctionCallContext, Function>
+
+        # 每个节点所在的 Scope、函数和类，在第一遍扫描（TypeAndScopeScanner）时记下来，
+        # 以后查找时就不用再沿着 parentCtx 逐级向上找了
+        self.enclosingOfNode = {}  # Map<ParserRuleContext, (Scope, Function, Class)>
+
+        # 词法分析、语法分析和语义分析每个pass花的时间
+        self.passTimings = []  # List<(str, float)>，单位是秒
+
     '''
      * 查找某节点所在的Scope
      * 算法：逐级查找父节点，找到一个对应着Scope的节点，返回其Scope
     '''
     def enclosingScopeOfNode(self, node:ParserRuleContext):
+        enclosing = self.enclosingOfNode.get(node)
+        if enclosing is not None:
+            return enclosing[0]
         rtn:Scope = None
         parent = node.parentCtx
         if parent:
@@ -578,6 +671,9 @@ class AnnotatedTree():
      * 包含某节点的函数
     '''
     def enclosingFunctionOfNode(self, ctx:RuleContext):
+        enclosing = self.enclosingOfNode.get(ctx)
+        if enclosing is not None:
+            return enclosing[1]
         if isinstance(ctx.parentCtx, PlayScriptParser.FunctionDeclarationContext):
             return self.node2Scope[ctx.parentCtx]
         elif ctx.parentCtx is None:
@@ -589,6 +685,9 @@ class AnnotatedTree():
      * 包含某节点的类
     '''
     def enclosingClassOfNode(self, ctx:RuleContext):
+        enclosing = self.enclosingOfNode.get(ctx)
+        if enclosing is not None:
+            return enclosing[2]
         if isinstance(ctx.parentCtx, PlayScriptParser.ClassDeclarationContext):
             return self.node2Scope[ctx.parentCtx]
         elif ctx.parentCtx is None:
@@ -662,9 +761,9 @@ class AnnotatedTree():
         return rtn
 
     def getFunctionOnlyByName(self, scope, name):
-        for s in scope.symbols:
-            if isinstance(s, Function) and s.name == name:
-                return s
+        functions = scope.functionIndex.get(name)
+        if functions:
+            return functions[0]
         return None
 
     def log(self, message:str, type:CompilationLog.Type, ctx:ParserRuleContext):
@@ -718,12 +817,25 @@ class TypeAndScopeScanner(PlayScriptListener):
         super().__init__()
         self.at:AnnotatedTree = at
         self.scopeStack = []
+        # 跟 scopeStack 对应：每个 Scope 所在的（或者它本身就是的）函数和类
+        self.enclosingStack = [(None, None, None)]
 
     def pushScope(self, scope:Scope):
         self.scopeStack.append(scope)
+        _, function, theClass = self.enclosingStack[-1]
+        if isinstance(scope, Function):
+            function = scope
+        elif isinstance(scope, Class):
+            theClass = scope
+        self.enclosingStack.append((scope, function, theClass))
 
     def popScope(self):
         self.scopeStack.pop()
+        self.enclosingStack.pop()
+
+    # 进入每个节点时，栈顶就是包含它的 Scope、函数和类。节点自己的 Scope 要在后面的 enterXXX 里才入栈
+    def enterEveryRule(self, ctx:ParserRuleContext):
+        self.at.enclosingOfNode[ctx] = self.enclosingStack[-1]
 
     # 在遍历树的过程中，获取当前的Scope
     def currentScope(self):
@@ -845,6 +957,14 @@ class TypeResolver(PlayScriptListener):
                 # class作为scope去getVariable是可以找到父类的定义的变量的，如果遇到同名变量，是否报错？
             scope.addSymbol(variable)
             self.at.symbolOfNode[ctx] = variable
+            # const 修饰符，写在变量声明语句或形参的前面
+            declaration = ctx.parentCtx
+            if isinstance(declaration, PlayScriptParser.VariableDeclaratorContext):
+                declaration = declaration.parentCtx
+            if isinstance(declaration, (PlayScriptParser.VariableDeclaratorsContext, PlayScriptParser.FormalParameterContext)):
+                for modifier in declaration.variableModifier():
+                    if modifier.CONST():
+                        variable.isConst = True
     
     # 设置函数形参的类型，这些参数已经在 enterVariableDeclaratorId中Symbol化了，现在设置它们的类型
     def exitFormalParameter(self, ctx:PlayScriptParser.FormalParameterContext):
@@ -968,8 +1088,8 @@ class RefResolver(PlayScriptListener):
         super().__init__()
         self.at = at
         # 用于把本地变量（剩下的未被Variable化的变量）添加到符号表，并计算类型
-        self.typeResolverWalker = ParseTreeWalker()
         self.localVariableEnter = TypeResolver(at, True)
+        self.typeResolverWalker = PassWalker([self.localVariableEnter])
         # this()和super()构造函数留到最后去消解，因为它可能引用别的构造函数，必须等这些构造函数都消解完。
         self.thisConstructorList:List[PlayScriptParser.FunctionCallContext]  = []
         self.superConstructorList:List[PlayScriptParser.FunctionCallContext] = []
@@ -986,7 +1106,7 @@ class RefResolver(PlayScriptListener):
     def enterVariableDeclarators(self, ctx:PlayScriptParser.VariableDeclaratorsContext):
         scope = self.at.enclosingScopeOfNode(ctx)
         if isinstance(scope, BlockScope) or isinstance(scope, Function):
-            self.typeResolverWalker.walk(self.localVariableEnter, ctx)
+            self.typeResolverWalker.walk(ctx)
 
     def exitPrimary(self, ctx:PlayScriptParser.PrimaryContext):
         scope = self.at.enclosingScopeOfNode(ctx)
@@ -1428,9 +1548,7 @@ class TypeChecker(PlayScriptListener):
  *
  * 05.super()和this()，只能是构造函数中的第一句。  这个在RefResolver中实现了。
  *
- * 06.
- * TODO:
- * continue 语句，必须在 for/while 循环中（暂不支持 continue 语句）
+ * 06.continue 语句，必须在 for/while 循环中
 '''
 class SematicValidator(PlayScriptListener):
     def __init__(self, at):
@@ -1444,7 +1562,13 @@ class SematicValidator(PlayScriptListener):
         pass
 
     def exitExpression(self, ctx:PlayScriptParser.ExpressionContext):
-        pass
+        # 05 const 变量不能被赋值，也不能做 ++、-- 运算
+        if (ctx.bop and ctx.bop.type in (PlayScriptParser.ASSIGN, PlayScriptParser.ADD_ASSIGN, PlayScriptParser.SUB_ASSIGN,
+                                         PlayScriptParser.MUL_ASSIGN, PlayScriptParser.DIV_ASSIGN, PlayScriptParser.MOD_ASSIGN)) \
+                or ctx.postfix or (ctx.prefix and ctx.prefix.type in (PlayScriptParser.INC, PlayScriptParser.DEC)):
+            symbol:Symbol = self.at.symbolOfNode.get(ctx.expression(0))
+            if isinstance(symbol, Variable) and symbol.isConst:
+                self.at.log_error("can not assign to const variable " + symbol.name, ctx)
 
     def exitClassDeclaration(self, ctx:PlayScriptParser.ClassDeclarationContext):
         # 04 类的声明不能在函数里
@@ -1475,7 +1599,10 @@ class SematicValidator(PlayScriptListener):
         elif ctx.BREAK():
             if not self.checkBreak(ctx):
                 self.at.log_error("break statement not in loop or switch statements", ctx)
-        # 这里还漏了 continue 语句
+        # 06 continue语句
+        elif ctx.CONTINUE():
+            if not self.checkBreak(ctx):
+                self.at.log_error("continue statement not in loop statements", ctx)
 
     # 检查一个函数里有没有return语句
     def hasReturnStatement(self, ctx:RuleContext):
@@ -1491,7 +1618,7 @@ class SematicValidator(PlayScriptListener):
                     break
         return rtn
 
-    # break 只能出现在循环语句或switch-case语句里
+    # break 只能出现在循环语句或switch-case语句里，continue 只能出现在循环语句里
     def checkBreak(self, ctx:RuleContext):
         if isinstance(ctx.parentCtx, PlayScriptParser.StatementContext) and (ctx.parentCtx.FOR() or ctx.parentCtx.WHILE()):
         # or ctx.parentCtx is SwitchBlockStatementGroupContext:
@@ -1501,104 +1628,537 @@ class SematicValidator(PlayScriptListener):
         else:
             return self.checkBreak(ctx.parentCtx)
 
+'''
+ * 常量折叠。
+ * 自底向上计算那些在编译期就能确定值的表达式：字面量、const 变量，以及由它们组成的算术运算、
+ * 字符串连接、比较运算和逻辑运算。结果记在 AnnotatedTree.constOfNode 里，执行引擎遇到这样的
+ * 表达式就直接使用它的值，不再去访问下面的节点。
+ * 运算的规则要跟执行引擎完全一样（比如比较运算前先按类型做 int()/float() 转换）。
+'''
+class ConstantFolder(PlayScriptListener):
+    def __init__(self, at:AnnotatedTree):
+        super().__init__()
+        self.at = at
+
+    def exitExpression(self, ctx:PlayScriptParser.ExpressionContext):
+        constOfNode = self.at.constOfNode
+        if ctx.primary():
+            primary:PlayScriptParser.PrimaryContext = ctx.primary()
+            if primary.literal():
+                value = ConstantFolder.literalValue(primary.literal())
+                if value is not None:
+                    constOfNode[ctx] = value
+            elif primary.expression():
+                if primary.expression() in constOfNode:
+                    constOfNode[ctx] = constOfNode[primary.expression()]
+            elif primary.IDENTIFIER():
+                # const 变量，只要它的初始值是常量，也就是常量
+                symbol:Symbol = self.at.symbolOfNode.get(primary)
+                if isinstance(symbol, Variable) and symbol.isConst and isinstance(symbol.ctx.parentCtx, PlayScriptParser.VariableDeclaratorContext):
+                    initializer = symbol.ctx.parentCtx.variableInitializer()
+                    if initializer and initializer.expression() in constOfNode:
+                        constOfNode[ctx] = constOfNode[initializer.expression()]
+        elif ctx.prefix and ctx.prefix.type == PlayScriptParser.BANG:
+            if ctx.expression(0) in constOfNode:
+                constOfNode[ctx] = not constOfNode[ctx.expression(0)]
+        elif ctx.bop and len(ctx.expression()) == 2:
+            left = ctx.expression(0)
+            right = ctx.expression(1)
+            if left in constOfNode and right in constOfNode:
+                value = self.binary(ctx, constOfNode[left], constOfNode[right])
+                if value is not None:
+                    constOfNode[ctx] = value
+
+    # 二元运算。算不出来（或者不该在编译期算，比如除以0）的时候返回None
+    def binary(self, ctx:PlayScriptParser.ExpressionContext, obj1, obj2):
+        bop_type = ctx.bop.type
+        type:Type = self.at.typeOfNode.get(ctx)
+        type1:Type = self.at.typeOfNode.get(ctx.expression(0))
+        type2:Type = self.at.typeOfNode.get(ctx.expression(1))
+        rtn = None
+        if bop_type == PlayScriptParser.ADD:
+            if type == String:
+                rtn = str(obj1) + str(obj2)
+            elif type == Integer or type == Float:
+                rtn = obj1 + obj2
+        elif bop_type == PlayScriptParser.SUB:
+            if type == Integer or type == Float:
+                rtn = obj1 - obj2
+        elif bop_type == PlayScriptParser.MUL:
+            if type == Integer or type == Float:
+                rtn = obj1 * obj2
+        elif bop_type == PlayScriptParser.DIV:
+            # 除以0的错误留到运行时
+            if (type == Integer or type == Float) and obj2 != 0:
+                rtn = obj1 / obj2
+        elif bop_type in (PlayScriptParser.EQUAL, PlayScriptParser.NOTEQUAL):
+            if PrimitiveType.isNumeric(type1) and PrimitiveType.isNumeric(type2):
+                upperType:Type = PrimitiveType.getUpperType(type1, type2)
+                convert = int if upperType == Integer else float
+                rtn = convert(obj1) == convert(obj2)
+            else:
+                rtn = obj1 == obj2
+            if bop_type == PlayScriptParser.NOTEQUAL:
+                rtn = not rtn
+        elif bop_type in (PlayScriptParser.LT, PlayScriptParser.LE, PlayScriptParser.GT, PlayScriptParser.GE):
+            upperType:Type = PrimitiveType.getUpperType(type1, type2)
+            if upperType == Integer:
+                obj1, obj2 = int(obj1), int(obj2)
+            elif upperType == Float:
+                obj1, obj2 = float(obj1), float(obj2)
+            else:
+                return False  # 对于非数值类型，不支持比较大小，结果总是false
+            if bop_type == PlayScriptParser.LT:
+                rtn = obj1 < obj2
+            elif bop_type == PlayScriptParser.LE:
+                rtn = obj1 <= obj2
+            elif bop_type == PlayScriptParser.GT:
+                rtn = obj1 > obj2
+            else:
+                rtn = obj1 >= obj2
+        elif bop_type == PlayScriptParser.AND:
+            rtn = obj1 and obj2
+        elif bop_type == PlayScriptParser.OR:
+            rtn = obj1 or obj2
+        return rtn
+
+    # 字面量的值，null字面量就是None（所以不做折叠）。各个执行引擎也都用它来取字面量的值
+    def literalValue(ctx:PlayScriptParser.LiteralContext):
+        rtn = None
+        if ctx.integerLiteral():
+            if ctx.integerLiteral().DECIMAL_LITERAL():
+                rtn = int(ctx.integerLiteral().getText())
+            else:
+                rtn = int(ctx.integerLiteral().getText(), 16)
+        elif ctx.floatLiteral():
+            rtn = float(ctx.floatLiteral().getText())
+        elif ctx.BOOL_LITERAL():
+            rtn = ctx.BOOL_LITERAL().getText() == "true"
+        elif ctx.STRING_LITERAL():
+            # 转义字符原样保留
+            rtn = ctx.STRING_LITERAL().getText()[1:-1]
+        return rtn
+
+
+'''
+ * 尾调用分析。
+ * return 语句的表达式直接就是一个函数调用（不是 obj.foo() 这样的方法调用，也不是更大的表达式的一部分），
+ * 这个调用就处在尾部位置：它返回以后，调用者只是把它的返回值原样返回。
+ * 执行引擎遇到这样的调用，可以先结束当前的函数，再调用被调用的函数，调用栈不会随着尾递归变深。
+ * 只标记普通的函数、类内部直接调用的方法和函数型变量；println、构造方法、this()、super() 都不算。
+'''
+class TailCallAnalyzer(PlayScriptListener):
+    def __init__(self, at:AnnotatedTree):
+        super().__init__()
+        self.at = at
+
+    def exitStatement(self, ctx:PlayScriptParser.StatementContext):
+        if not ctx.RETURN() or not ctx.expression():
+            return
+        expression:PlayScriptParser.ExpressionContext = ctx.expression()
+        call:PlayScriptParser.FunctionCallContext = expression.functionCall()
+        if call is None or expression.bop is not None or call.IDENTIFIER() is None:
+            return
+        symbol:Symbol = self.at.symbolOfNode.get(call)
+        if isinstance(symbol, DefaultConstructor) or (isinstance(symbol, Function) and symbol.isConstructor()):
+            return
+        if isinstance(symbol, Function) or isinstance(symbol, Variable):
+            if self.at.enclosingFunctionOfNode(ctx) is not None:
+                self.at.tailCalls.add(call)
+
+
 '''
 函数闭包变量 分析
 '''
-class ClosureAnalyzer():
+class ClosureAnalyzer(PlayScriptListener):
     def __init__(self, at:AnnotatedTree):
         super().__init__()
         self.at = at
+        # 正在遍历的函数，List<(Function, refered:Set<Variable>, declared:Set<Variable>)>
+        self.functions = []
 
     '''
      * 对所有的函数做闭包分析。
      * 只做标准函数的分析，不做类的方法的分析。
+     * 算法：一个函数的闭包变量，就是它所引用的变量，去掉它内部声明的变量，剩下的外部变量。
+     * 只需要对AST做一次遍历：每个函数在遍历自己的子树时，收集引用到的变量和内部声明的变量；
+     * 函数结束时算出它的闭包变量，再交给外层函数，作为外层函数所引用的变量。
+     * 在内层函数里声明的变量，一定也是在外层函数里声明的，所以只需要把闭包变量交上去。
+     * 它是一个Listener，可以跟别的只读的检查放在同一遍遍历里（见 PassManager）。
     '''
     def analyzeClosures(self):
-        for type in self.at.types:
-            if isinstance(type, Function) and not type.isMethod():  # 这里意思是：类的方法不支持闭包。面向对象和函数式编程是两种不同的编程范式，没必要兼容，当做互斥
-                set = self.calcClosureVariables(type)  # set()
-                if len(set) > 0:
-                    type.closureVariables = set
+        PassWalker([self]).walk(self.at.ast)
+
+    def enterEveryRule(self, ctx:ParserRuleContext):
+        scope:Scope = self.at.node2Scope.get(ctx)
+        if isinstance(scope, Function):
+            self.functions.append((scope, set(), set()))
+        if self.functions:
+            _, refered, declared = self.functions[-1]
+            # 在这个作用域里声明的变量。下级作用域会在遍历到它们的节点时再加进来
+            if scope is not None:
+                for symbol in scope.symbols:
+                    if isinstance(symbol, Variable):
+                        declared.add(symbol)
+            # 注意：由于 VariableDeclator 的ctx 也会跟symbol绑定，所以这里会连同 int a=2; 里的a 都算到引用集合里，
+            # 虽然并非定义了就一定会引用，但即便没引用而把它当做引用了，也没什么关系。反正在函数里定义的变量都会被去掉
+            # 这里只考虑了Variable的引用，没有考虑Function的引用。函数不存在生存期的问题，所以永远可以找到，不需要记录到闭包环境里
+            symbol:Symbol = self.at.symbolOfNode.get(ctx)
+            if isinstance(symbol, Variable):
+                refered.add(symbol)
 
-    '''
-     * 为某个函数计算闭包变量，也就是它所引用的外部环境变量。
-     * 算法：计算所有的变量引用，去掉内部声明的变量，剩下的就是外部的。
-    '''
-    def calcClosureVariables(self, function:Function):  # Set<Variable>
-        refered = self.variablesReferedByScope(function)  # Set<Variable>
-        declared = self.variablesDeclaredUnderScope(function)  # Set<Variable> 
-        rtn = refered.difference(declared)
-        # # 观察每个函数的闭包变量是否正确
-        # print('-----------------')
-        # print(function.toString())
-        # print('refered:')
-        # for i in refered:
-        #     print(i.toString(), end=', ')
-        # print()
-        # print('declared:')
-        # for i in declared:
-        #     print(i.toString(), end=', ')
-        # print()
-        # print('closure:')
-        # for i in rtn:
-        #     print(i.toString(), end=', ')
-        # print()
-        # print('-----------------')
-        return rtn
+    def exitEveryRule(self, ctx:ParserRuleContext):
+        if not isinstance(self.at.node2Scope.get(ctx), Function):
+            return
+        function, refered, declared = self.functions.pop()
+        closureVariables = refered.difference(declared)  # Set<Variable>
+        # 这里意思是：类的方法不支持闭包。面向对象和函数式编程是两种不同的编程范式，没必要兼容，当做互斥
+        if len(closureVariables) > 0 and not function.isMethod():
+            function.closureVariables = closureVariables
+        if self.functions:
+            self.functions[-1][1].update(closureVariables)
 
-    '''
-     * 被一个Scope（包括下级Scope）内部的代码所引用的所有变量的集合
-     * TODO 这里应该将函数内部定义的 Function/Class 排除掉，需要考虑嵌套闭包的情况
-    '''
-    def variablesReferedByScope(self, scope):  # Set<Variable>
-        rtn = set()
-        scopeNode:ParserRuleContext = scope.ctx
-        # 扫描所有的符号引用。这对于大的程序性能不够优化，因为符号表太大。
-        # 其实只要遍历scope对应的node的子树，找出所有带引用的结点所引用的 variable 即可
-        for node in self.at.symbolOfNode:
-            # 注意：由于 VariableDeclator 的ctx 也会跟symbol绑定，所以这里会连同 int a=2; 里的a 都算到引用集合里，
-            # 虽然并非定义了就一定会引用，但即便没引用而把它当做引用了，也没什么关系。而且后面还会去掉所有在函数里定义的变量
-            symbol:Symbol = self.at.symbolOfNode[node]
-            if isinstance(symbol, Variable) and self.isAncestor(scopeNode, node):
-                rtn.add(symbol)
-                # 注意：这里只考虑了Variable的应用，没有考虑Function的引用
-                # 函数不存在生存期的问题，所以永远可以找到，不需要记录到闭包环境里
-        return rtn
 
-    '''
-     * 看看node1是不是node2的祖先
-    '''
-    def isAncestor(self, node1:RuleContext, node2:RuleContext):
-        if node2.parentCtx is None:
-            return False
-        elif node2.parentCtx == node1:
-            return True
+'''
+ * 纯函数分析。
+ * 一个函数是纯函数，要满足：
+ * 1.不是类的方法或构造方法（方法会读写对象的字段）；
+ * 2.不引用外部的可变变量，也就是闭包变量（ClosureAnalyzer 算出的 closureVariables，包括全局变量）里只有全局的、
+ *   被 ConstantFolder 算出了值的常量。外层函数的 const 局部变量和 const 参数每次调用外层函数时都可能取不同的值，
+ *   而结果缓存的键里只有内层函数自己的参数，所以引用了它们的函数不算纯函数；
+ * 3.不调用 println；
+ * 4.只调用纯函数：不调用方法、构造方法和函数型变量，直接调用的函数也都是纯函数。
+ * 遍历AST时（跟 ClosureAnalyzer 在同一遍里）记下每个函数直接调用的函数，以及它有没有违反1、3、4；
+ * 遍历完、闭包变量都算出来以后，analyzePurity() 先排除违反1、2、3的函数，再沿着调用关系反复排除调用了非纯函数的函数，直到不再变化。
+ * 结果记在 AnnotatedTree.pureFunctions 里。
+'''
+class PurityAnalyzer(PlayScriptListener):
+    def __init__(self, at:AnnotatedTree):
+        super().__init__()
+        self.at = at
+        # 正在遍历的函数
+        self.functions:List[Function] = []
+        # 每个函数直接调用的函数，Map<Function, Set<Function>>
+        self.callees = {}
+        # 肯定不纯的函数
+        self.impure = set()  # Set<Function>
+
+    def enterFunctionDeclaration(self, ctx:PlayScriptParser.FunctionDeclarationContext):
+        function:Function = self.at.node2Scope[ctx]
+        self.functions.append(function)
+        self.callees[function] = set()
+        if function.isMethod():
+            self.impure.add(function)
+
+    def exitFunctionDeclaration(self, ctx:PlayScriptParser.FunctionDeclarationContext):
+        self.functions.pop()
+
+    def exitFunctionCall(self, ctx:PlayScriptParser.FunctionCallContext):
+        if not self.functions:
+            return
+        function = self.functions[-1]
+        symbol:Symbol = self.at.symbolOfNode.get(ctx)
+        expression = ctx.parentCtx
+        isMethodCall = isinstance(expression, PlayScriptParser.ExpressionContext) and expression.bop is not None
+        if ctx.IDENTIFIER() is None or ctx.IDENTIFIER().getText() == "println" or isMethodCall:
+            self.impure.add(function)
+        elif isinstance(symbol, Function) and not symbol.isMethod() and not isinstance(symbol, DefaultConstructor):
+            self.callees[function].add(symbol)
         else:
-            return self.isAncestor(node1, node2.parentCtx)
+            self.impure.add(function)
+
+    def analyzePurity(self):
+        pure = set()
+        for function in self.callees:
+            if function in self.impure:
+                continue
+            if any(not self.isFoldedGlobalConst(variable) for variable in function.closureVariables):
+                continue
+            pure.add(function)
+        changed = True
+        while changed:
+            changed = False
+            for function in list(pure):
+                if not self.callees[function] <= pure:
+                    pure.discard(function)
+                    changed = True
+        self.at.pureFunctions = pure
+
+    # 全局的 const 变量，而且初始值是常量折叠算出来的，整个程序里它的值都不变
+    def isFoldedGlobalConst(self, variable:Variable) -> bool:
+        if not variable.isConst or not isinstance(variable.ctx.parentCtx, PlayScriptParser.VariableDeclaratorContext):
+            return False
+        if isinstance(variable.enclosingScope, Class) or self.at.enclosingFunctionOfNode(variable.ctx) is not None:
+            return False
+        initializer = variable.ctx.parentCtx.variableInitializer()
+        return initializer is not None and initializer.expression() in self.at.constOfNode
 
     '''
-     * 在一个Scope（及）下级Scope中声明的所有变量的集合
+     * 纯函数里，参数和返回值都是基本类型（整数、浮点数、布尔值、字符串）的，可以按参数值缓存结果（见 -memoize）。
+     * 返回对象或函数的，每次调用得到的是不同的实例，不能缓存。
     '''
-    def variablesDeclaredUnderScope(self, scope:Scope):  # Set<Variable>
-        rtn = set()
-        for symbol in scope.symbols:
-            if isinstance(symbol, Variable):
-                rtn.add(symbol)
-            elif isinstance(symbol, Scope):  # TODO 这里应该排除掉 Function/Class
-                rtn = rtn.union(self.variablesDeclaredUnderScope(symbol))
-                # 观察下面代码是否会出现问题：
-                # func(int a) {
-                #   // 计算inner的闭包
-                #   inner() {
-                #     println(a);  // 由于下级作用域存在a的定义，按照这里的做法，a不会加入闭包，到时候执行的时候会出错？不会，两个a是不同的Symbol！前面的RefResolve很关键 
-                #     for (int a=0; a<3; a++) {
-                #     ...
-                #     }
-                #   }
-                #   return inner
-                # }
+    def isMemoizable(at:AnnotatedTree, function:Function) -> bool:
+        if function not in at.pureFunctions:
+            return False
+        memoizable = (Integer, Float, Boolean, String)
+        return function.returnType in memoizable and all(param.type in memoizable for param in function.parameters)
+
+
+'''
+ * 类层次分析（CHA）。
+ * TypeResolver 设置好每个类的 parentClass 以后，整个类层次在编译期就都知道了。
+ * obj.foo() 里 obj 的声明类型是C，对象的真实类型只能是C或者C的子类。如果C的所有子类（包括间接的子类）都没有重载 foo()，
+ * 也就是它们的虚函数表在 foo() 的位置上都是同一个方法，那么动态绑定的结果一定就是这个方法，执行时不用再按对象的真实类型去查找。
+ * 结果记在 AnnotatedTree.devirtualizedCalls 里。super.foo() 和构造方法本来就是静态绑定的，不用分析。
+'''
+class ClassHierarchyAnalyzer(PlayScriptListener):
+    def __init__(self, at:AnnotatedTree):
+        super().__init__()
+        self.at = at
+        # 每个类的所有子类，第一次用到时计算。Map<Class, List<Class>>
+        self.subClasses = None
+        # 每个 (声明类型, 方法) 直接绑定的结果，不能直接绑定的是None。Map<(Class, Function), Function>
+        self.bindings = {}
+
+    def exitExpression(self, ctx:PlayScriptParser.ExpressionContext):
+        if not ctx.bop or ctx.bop.type != PlayScriptParser.DOT or not ctx.functionCall():
+            return
+        call:PlayScriptParser.FunctionCallContext = ctx.functionCall()
+        function:Symbol = self.at.symbolOfNode.get(call)
+        receiver:Symbol = self.at.symbolOfNode.get(ctx.expression(0))
+        if not isinstance(function, Function) or isinstance(function, DefaultConstructor) or function.isConstructor():
+            return
+        if isinstance(receiver, Super) or not isinstance(receiver, Variable) or not isinstance(receiver.type, Class):
+            return
+        key = (receiver.type, function)
+        if key not in self.bindings:
+            self.bindings[key] = self.bind(receiver.type, function)
+        if self.bindings[key]:
+            self.at.devirtualizedCalls[call] = self.bindings[key]
+
+    # 声明类型为 theClass 的对象调用 function，所有可能的真实类型都绑定到同一个方法时，返回这个方法
+    def bind(self, theClass:Class, function:Function) -> Function:
+        vtable:List[Function] = theClass.getVTable()
+        index = function.vtableIndex
+        if index < 0 or index >= len(vtable) or vtable[index] is not function:
+            return None
+        for subClass in self.subClassesOf(theClass):
+            if subClass.getVTable()[index] is not function:
+                return None
+        return function
+
+    def subClassesOf(self, theClass:Class) -> List[Class]:
+        if self.subClasses is None:
+            self.subClasses = {}
+            for type in self.at.types:
+                if isinstance(type, Class):
+                    parent:Class = type.getParentClass()
+                    while parent:
+                        self.subClasses.setdefault(parent, []).append(type)
+                        parent = parent.getParentClass()
+        return self.subClasses.get(theClass, [])
+
+
+'''
+ * 遍历AST，把事件同时分发给多个Listener。
+ * 效果跟对每个Listener分别调用一次 ParseTreeWalker.walk() 一样：对每个节点，按Listener的顺序依次触发
+ * enterEveryRule、enterXXX，退出时依次触发 exitXXX、exitEveryRule。
+ * 跟 ParseTreeWalker 相比：
+ * 1.多个Listener只遍历一遍树；
+ * 2.按节点的类型缓存每个Listener真正实现了的方法，PlayScriptListener 里的空方法不再调用；
+ * 3.用显式的栈来遍历，避免很深的AST导致递归太深。
+'''
+class PassWalker():
+    def __init__(self, listeners:List[ParseTreeListener]):
+        self.listeners = listeners
+        # Map<type, (List<enter方法>, List<exit方法>)>
+        self.handlers = {}
+
+    # 某个Listener实现了的方法。没有覆盖基类里的空方法，就返回None
+    def handler(listener:ParseTreeListener, name:str):
+        method = getattr(type(listener), name, None)
+        if method is None or method is getattr(PlayScriptListener, name, None) or method is getattr(ParseTreeListener, name, None):
+            return None
+        return getattr(listener, name)
+
+    def handlersOf(self, ctxType):
+        rtn = self.handlers.get(ctxType)
+        if rtn is None:
+            # 类名 XxxContext 对应 enterXxx 和 exitXxx
+            ruleName = ctxType.__name__[:-len('Context')]
+            enters = []
+            exits = []
+            for listener in self.listeners:
+                for name in ('enterEveryRule', 'enter' + ruleName):
+                    method = PassWalker.handler(listener, name)
+                    if method:
+                        enters.append(method)
+                for name in ('exit' + ruleName, 'exitEveryRule'):
+                    method = PassWalker.handler(listener, name)
+                    if method:
+                        exits.append(method)
+            rtn = (enters, exits)
+            self.handlers[ctxType] = rtn
         return rtn
 
+    def walk(self, tree:ParserRuleContext):
+        terminals = [PassWalker.handler(listener, 'visitTerminal') for listener in self.listeners]
+        terminals = [method for method in terminals if method]
+        errors = [PassWalker.handler(listener, 'visitErrorNode') for listener in self.listeners]
+        errors = [method for method in errors if method]
+        # 栈里是 (节点, exit方法)：exit方法为None表示要进入这个节点，否则表示要退出这个节点
+        stack = [(tree, None)]
+        while stack:
+            node, exits = stack.pop()
+            if exits is not None:
+                for method in exits:
+                    method(node)
+                continue
+            if isinstance(node, ErrorNode):
+                for method in errors:
+                    method(node)
+                continue
+            if isinstance(node, TerminalNode):
+                for method in terminals:
+                    method(node)
+                continue
+            enters, exits = self.handlersOf(type(node))
+            for method in enters:
+                method(node)
+            stack.append((node, exits))
+            children = node.children
+            if children:
+                for i in range(len(children) - 1, -1, -1):
+                    stack.append((children[i], None))
+
+
+'''
+ * 管理语义分析的各个步骤（pass）。
+ * 一个pass可以是一组互相独立的Listener，它们放在同一遍遍历里执行；也可以是一个不需要遍历树的步骤。
+ * 每个pass花的时间记在 timings 里，同时放到 AnnotatedTree.passTimings 里。
+'''
+class PassManager():
+    def __init__(self, at:AnnotatedTree):
+        self.at = at
+        self.passes = []   # List<(str, List<ParseTreeListener> 或者一个函数)>
+        self.timings = []  # List<(str, float)>，单位是秒
+
+    # 添加一个pass，其中的多个Listener在同一遍遍历里执行
+    def addListeners(self, name:str, *listeners:ParseTreeListener):
+        self.passes.append((name, list(listeners)))
+
+    # 添加一个不需要遍历树的pass
+    def addStep(self, name:str, step):
+        self.passes.append((name, step))
+
+    def run(self):
+        for name, work in self.passes:
+            start = time.perf_counter()
+            if isinstance(work, list):
+                PassWalker(work).walk(self.at.ast)
+            else:
+                work()
+            self.timings.append((name, time.perf_counter() - start))
+        self.at.passTimings.extend(self.timings)
+
+
+'''
+ * 为执行引擎分配变量的存储位置（槽位）
+ * 以“帧单元”为单位分配：整个程序（根作用域）、每个函数、每个类（字段初始化代码）各是一个单元。
+ * 函数里嵌套的 block、for 作用域不单独建帧，其中的变量摊平到所属单元的帧里，各占一个槽位。
+ * 这样变量的位置在编译期就确定了：(所在单元, 槽位)，运行时不需要再逐级查找。
+ * 类的方法和字段初始化代码，0号槽位固定存放this。类的成员变量存在对象里，不分配槽位。
+'''
+class SlotResolver():
+    def __init__(self, at:AnnotatedTree):
+        self.at = at
+
+    def resolve(self):
+        root:Scope = self.at.node2Scope[self.at.ast]
+        if root.unit is None:  # 只需要计算一次
+            self.resolveUnit(root, 0)
+
+    def resolveUnit(self, unit:Scope, level:int):
+        unit.unitLevel = level
+        unit.frameSize = 0
+        if isinstance(unit, Class):
+            unit.getFieldLayout()
+            unit.getVTable()
+            unit.frameSize = 1  # this
+            unit.thisRef.slot = 0
+            if unit.superRef:
+                unit.superRef.slot = 0
+        elif isinstance(unit, Function):
+            if unit.isMethod():
+                unit.frameSize = 1  # this
+            # 参数排在前面，调用时按顺序放入实参
+            for param in unit.parameters:
+                param.slot = unit.frameSize
+                unit.frameSize += 1
+        self.resolveScope(unit, unit)
+
+    def resolveScope(self, scope:Scope, unit:Scope):
+        scope.unit = unit
+        for symbol in scope.symbols:
+            if isinstance(symbol, Function) or isinstance(symbol, Class):
+                self.resolveUnit(symbol, unit.unitLevel + 1)
+            elif isinstance(symbol, Scope):
+                self.resolveScope(symbol, unit)
+            elif isinstance(symbol, Variable) and not isinstance(unit, Class) and symbol.slot < 0:
+                symbol.slot = unit.frameSize
+                unit.frameSize += 1
+
+    # 某个帧单元的上一级帧单元
+    def parentUnit(unit:Scope) -> Scope:
+        if unit.enclosingScope:
+            return unit.enclosingScope.unit
+        return None
+
+    # 离某个帧单元最近的、能访问this的帧单元（类的方法，或类本身）
+    def thisUnit(unit:Scope) -> Scope:
+        while unit:
+            if isinstance(unit, Class) or (isinstance(unit, Function) and unit.isMethod()):
+                return unit
+            unit = SlotResolver.parentUnit(unit)
+        return None
+
+
+'''
+ * 语法分析。
+ * 先用手写的 RecursiveDescentParser，它生成的树跟 PlayScriptParser 一样，但快得多。它只处理正确的程序，遇到错误就放弃，
+ * 这时再用 parseWithANTLR()。
+'''
+def parse(token_stream:CommonTokenStream):
+    try:
+        return RecursiveDescentParser(token_stream).prog()
+    except ParseError:
+        token_stream.seek(0)
+    return parseWithANTLR(token_stream)
+
+
+'''
+ * 用 ANTLR 生成的 PlayScriptParser 解析。
+ * 先用SLL模式解析，它比缺省的LL模式快很多，对绝大多数正确的程序结果也一样。
+ * SLL遇到语法错误就放弃（BailErrorStrategy），这时可能是程序真有错误，也可能是SLL能力不够，
+ * 于是回到开头，用完整的LL模式再解析一遍，由它来报告语法错误。
+ * 第一次用到 PlayScriptParser 时，先从 DFACache 的文件里载入以前保存的DFA，省掉DFA的预热。
+'''
+def parseWithANTLR(token_stream:CommonTokenStream, reportErrors:bool=True):
+    warmDFA(PlayScriptParser)
+    parser = PlayScriptParser(token_stream)
+    parser._interp.predictionMode = PredictionMode.SLL
+    parser._errHandler = BailErrorStrategy()
+    parser.removeErrorListeners()
+    try:
+        return parser.prog()
+    except ParseCancellationException:
+        token_stream.seek(0)
+        parser = PlayScriptParser(token_stream)
+        parser._interp.predictionMode = PredictionMode.LL
+        if not reportErrors:
+            parser.removeErrorListeners()
+        return parser.prog()
+
 
 '''
 将源码翻译成 Annotated tree
@@ -1606,36 +2166,43 @@ class ClosureAnalyzer():
 def translate(text):
     at = AnnotatedTree()
 
-    # 词法分析
-    input_stream = InputStream(text)
-    lexer = PlayScriptLexer(input_stream)
+    # 词法分析。先用 RegexLexer，遇到词法错误再用 PlayScriptLexer，由它来报告错误
+    start = time.perf_counter()
+    lexer = RegexLexer(text)
+    if lexer.tokenize() is None:
+        # PlayScriptLexer 要反序列化自己的ATN，只在用到时才导入，不拖慢启动
+        from PlayScriptLexer import PlayScriptLexer
+        warmDFA(PlayScriptLexer)
+        lexer = PlayScriptLexer(InputStream(text))
     token_stream = CommonTokenStream(lexer)
+    token_stream.fill()
+    at.passTimings.append(('Lexer', time.perf_counter() - start))
     # 语法分析
-    parser = PlayScriptParser(token_stream)
-    at.ast = parser.prog()
+    start = time.perf_counter()
+    at.ast = parse(token_stream)
+    at.passTimings.append(('Parser', time.perf_counter() - start))
 
     # 语义分析
-    walker = ParseTreeWalker()
     # 多步的语义解析。
     # 优点：1.代码更清晰；2.允许使用在声明之前，这在支持面向对象、递归函数等特征时是必须的
+    # 互相不依赖的Listener放在同一个pass里，只遍历一遍树
+    passManager = PassManager(at)
     # pass1：type & Scope
-    pass1:TypeAndScopeScanner = TypeAndScopeScanner(at)
-    walker.walk(pass1, at.ast)
+    passManager.addListeners('TypeAndScopeScanner', TypeAndScopeScanner(at))
     # pass2：把变量声明、函数声明、类继承 的类型都解析出来。也就是所有声明时用到类型的地方（I属性）
-    pass2:TypeResolver = TypeResolver(at)
-    walker.walk(pass2, at.ast)
+    passManager.addListeners('TypeResolver', TypeResolver(at))
     # pass3：消解所有符号的引用（变量+函数）。还做了类型的推断（S属性）
-    pass3:RefResolver = RefResolver(at)
-    walker.walk(pass3, at.ast)
-    # pass4：类型检查
-    pass4:TypeChecker = TypeChecker(at)
-    walker.walk(pass4, at.ast)
-    # pass5：其他语义检查
-    pass5:SematicValidator = SematicValidator(at)
-    walker.walk(pass5, at.ast)
-    # pass6：做闭包的分析
-    closureAnalyzer:ClosureAnalyzer = ClosureAnalyzer(at)
-    closureAnalyzer.analyzeClosures()
+    passManager.addListeners('RefResolver', RefResolver(at))
+    # pass4：类型检查、其他语义检查、常量折叠、尾调用分析、闭包分析、类层次分析，以及纯函数分析要收集的调用关系。它们只读取前面几个pass的结果，互相独立
+    purityAnalyzer = PurityAnalyzer(at)
+    passManager.addListeners('TypeChecker+SematicValidator+ConstantFolder+TailCallAnalyzer+ClosureAnalyzer+ClassHierarchyAnalyzer+PurityAnalyzer',
+                             TypeChecker(at), SematicValidator(at), ConstantFolder(at), TailCallAnalyzer(at), ClosureAnalyzer(at),
+                             ClassHierarchyAnalyzer(at), purityAnalyzer)
+    # 纯函数分析要用到闭包分析的结果
+    passManager.addStep('PurityAnalyzer', purityAnalyzer.analyzePurity)
+    # pass5：为变量分配槽位，供执行引擎使用
+    passManager.addStep('SlotResolver', SlotResolver(at).resolve)
+    passManager.run()
 
     return at
 
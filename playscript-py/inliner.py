@@ -0,0 +1,231 @@
+import sys
+import io
+import time
+import contextlib
+from typing import List
+
+from bytecode_compiler import *
+
+
+'''
+ * 字节码层面的函数内联：把很小的函数直接展开到调用的地方，省掉调用的开销（建帧、保存和恢复调用者的状态）。
+ * 被内联的函数的槽位接在调用者的帧后面（调用者的 frameSize 相应变大），展开的代码是被调用者的代码的一份拷贝：
+ * 1.开头把栈上的实参依次存入这些槽位；
+ * 2.LOAD_LOCAL/STORE_LOCAL 的槽位、跳转的目标地址都加上偏移量，常量搬到调用者的常量池里；
+ * 3.RETURN 变成跳到展开的代码的末尾，返回值正好留在栈顶。
+ *
+ * 可以内联的调用：
+ * 1.CALL_FUNCTION 调用的普通函数，以及 CALL_METHOD 调用的静态绑定的方法；
+ * 2.CALL_FINAL 调用的方法，也就是类层次分析（见 ClassHierarchyAnalyzer）证明所有子类都没有重载的方法，
+ *   展开的代码前面加一个对象是否为null的判断，跟 BytecodeVM 一样，对象为null时结果是null。
+ * 被调用的函数要满足：指令条数不超过 BUDGET；不是调用者自己；不用到闭包的环境，也不会把自己的帧交给闭包
+ * （没有 LOAD_OUTER/STORE_OUTER，没有要用环境的 CALL_FUNCTION 和 MAKE_CLOSURE），因为内联以后它就没有自己的帧了。
+ * 展开的代码里的尾调用要改成普通的调用，否则会直接返回到调用者的调用者。
+ * 类的字段初始化代码的帧大小是固定的，不做内联。
+'''
+class Inliner():
+    # 被内联的函数最多有多少条指令
+    BUDGET = 16
+
+    JUMPS = (JUMP, JUMP_IF_FALSE, JUMP_IF_TRUE)
+    # 操作数是常量池下标的指令
+    CONST_OPS = (LOAD_CONST, GET_FIELD_DYN, SET_FIELD_DYN, CALL_FUNCTION, CALL_METHOD, CALL_VIRTUAL, CALL_FINAL, MAKE_CLOSURE, NEW_OBJECT)
+
+    def __init__(self, program:Program, budget:int=BUDGET):
+        self.program = program
+        self.budget = budget
+        # 每个函数能不能被内联，Map<CodeObject, bool>
+        self.inlinable = {}
+        # 内联了多少个调用
+        self.count = 0
+
+    def inlineAll(self) -> Program:
+        for code in self.program.functions.values():
+            self.inlineCalls(code)
+        self.inlineCalls(self.program.main)
+        return self.program
+
+    # 被调用的函数本身是否满足内联的条件（不考虑调用的地方）
+    def isInlinable(self, callee:CodeObject) -> bool:
+        rtn = self.inlinable.get(callee)
+        if rtn is None:
+            code = callee.code
+            rtn = len(code) // 2 <= self.budget
+            for pc in range(0, len(code), 2):
+                op = code[pc]
+                if op in (LOAD_OUTER, STORE_OUTER, STORE_MEMO):
+                    rtn = False
+                elif op in (CALL_FUNCTION, MAKE_CLOSURE) and callee.consts[code[pc + 1]][2 if op == CALL_FUNCTION else 1] >= 0:
+                    rtn = False
+            self.inlinable[callee] = rtn
+        return rtn
+
+    # 找出一条调用指令可以内联的被调用者，返回 (CodeObject, 实参个数（含this）, 是否要判断null)，不能内联的返回None
+    def inlineTarget(self, caller:CodeObject, op:int, arg:int):
+        if op == CALL_FUNCTION:
+            callee, argc, depth, _ = caller.consts[arg]
+            if depth >= 0:
+                return None
+            target = (callee, argc, False)
+        elif op == CALL_METHOD:
+            callee, argc, _ = caller.consts[arg]
+            target = (callee, argc + 1, False)
+        elif op == CALL_FINAL:
+            callee, argc = caller.consts[arg]
+            target = (callee, argc + 1, True)
+        else:
+            return None
+        if target[0] is caller or not self.isInlinable(target[0]):
+            return None
+        return target
+
+    '''
+     * 把一个 CodeObject 里所有可以内联的调用展开。只扫描一遍原来的代码，展开出来的代码不再展开，所以递归的函数也不会无限展开
+    '''
+    def inlineCalls(self, caller:CodeObject):
+        old = caller.code
+        code:List[int] = []
+        # 原来的指令下标 -> 新的下标。跳转到代码末尾的也要映射
+        newPos = {}
+        # 从原来的代码复制过来的跳转指令，最后统一回填
+        jumps = []
+        for pc in range(0, len(old), 2):
+            op = old[pc]
+            arg = old[pc + 1]
+            newPos[pc] = len(code)
+            target = self.inlineTarget(caller, op, arg)
+            if target:
+                self.expand(caller, code, *target)
+                self.count += 1
+                continue
+            if op in Inliner.JUMPS:
+                jumps.append(len(code))
+            code.append(op)
+            code.append(arg)
+        newPos[len(old)] = len(code)
+        for pos in jumps:
+            code[pos + 1] = newPos[code[pos + 1]]
+        caller.code = code
+
+    # 在 code 的末尾生成展开的被调用者的代码
+    def expand(self, caller:CodeObject, code:List[int], callee:CodeObject, argc:int, nullCheck:bool):
+        base = caller.frameSize
+        caller.frameSize += callee.frameSize
+        # 实参在栈上，最后一个在栈顶
+        for i in range(argc - 1, -1, -1):
+            code.append(STORE_LOCAL)
+            code.append(base + i)
+        nullJump = None
+        if nullCheck:
+            code.append(LOAD_LOCAL)
+            code.append(base)
+            nullJump = len(code)
+            code.append(JUMP_IF_FALSE)
+            code.append(0)
+
+        body = callee.code
+        # 最后一条 RETURN 直接顺序执行下去就行了
+        if body[-2] == RETURN:
+            body = body[:-2]
+        start = len(code)
+        returns = []
+        for pc in range(0, len(body), 2):
+            op = body[pc]
+            arg = body[pc + 1]
+            if op in (LOAD_LOCAL, STORE_LOCAL):
+                arg += base
+            elif op in Inliner.JUMPS:
+                arg += start
+            elif op == RETURN:
+                returns.append(len(code))
+                op = JUMP
+            elif op == CALL_VALUE:
+                arg &= 0xffff
+            elif op in Inliner.CONST_OPS:
+                value = callee.consts[arg]
+                if op == CALL_FUNCTION:
+                    value = value[:3] + (False,)
+                elif op == CALL_METHOD:
+                    value = value[:2] + (False,)
+                arg = caller.addConst(value)
+            code.append(op)
+            code.append(arg)
+
+        if nullCheck:
+            endJump = len(code)
+            code.append(JUMP)
+            code.append(0)
+            code[nullJump + 1] = len(code)
+            code.append(LOAD_CONST)
+            code.append(caller.addConst(None))
+            returns.append(endJump)
+        for pos in returns:
+            code[pos + 1] = len(code)
+
+
+'''
+ * 编译一段脚本，用虚拟机执行它，返回输出（包括编译和执行时的异常）。inline 为 False 时不做内联
+'''
+def runVM(text:str, inline:bool) -> str:
+    from bytecode_vm import BytecodeVM
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        try:
+            at = translate(text)
+            if not at.hasCompilationError():
+                compiler = BytecodeCompiler(at)
+                compiler.inline = inline
+                BytecodeVM(compiler.compile()).execute()
+        except Exception as e:
+            print('error: ' + repr(e))
+    return out.getvalue()
+
+
+'''
+ * 差分检查：每个文件内联和不内联，虚拟机的输出要完全一样
+'''
+def check(paths:List[str]) -> bool:
+    from dfa_cache import readScripts
+    ok = True
+    scripts = readScripts(paths)
+    for path, text in scripts:
+        if runVM(text, True) != runVM(text, False):
+            print('FAIL %s: the output changes after inlining' % path)
+            ok = False
+    print('%d files, %s' % (len(scripts), 'all the same' if ok else 'FAILED'))
+    return ok
+
+
+'''
+ * 性能测试：每个文件分别在内联和不内联的情况下执行，比较执行的时间，并列出内联了多少个调用
+'''
+def benchmark(paths:List[str]):
+    from dfa_cache import readScripts
+    from bytecode_vm import BytecodeVM
+    for path, text in readScripts(paths):
+        at = translate(text)
+        if at.hasCompilationError():
+            continue
+        times = []
+        for inline in (False, True):
+            compiler = BytecodeCompiler(at)
+            compiler.inline = inline
+            program = compiler.compile()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                BytecodeVM(program).execute()
+            times.append(time.perf_counter() - start)
+        print('%-48s %8.3f s %8.3f s %7.2fx %5d calls inlined' % (path, times[0], times[1], times[0] / times[1], compiler.inlined))
+
+
+# 用法：
+# python inliner.py -check <文件或目录...>
+# python inliner.py -bench <文件或目录...>
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] == '-check':
+        sys.exit(0 if check(args[1:]) else 1)
+    elif args and args[0] == '-bench':
+        benchmark(args[1:])
+    else:
+        print('usage: inliner.py -check|-bench <files or directories>')
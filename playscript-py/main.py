@@ -1,9 +1,15 @@
-from frontend import *
-from ast_evaluator import *
+import sys
+import time
+
+startTime = time.perf_counter()
+
+# 启动时只导入编译缓存。前端（ANTLR运行时、PlayScriptParser等）和各个执行引擎都比较大，
+# 在 main() 里用到时才导入：命中 __playcache__ 时根本不需要前端，其他情况也只导入所选的那一个引擎
+from compile_cache import *
 
 
 def parseParams(args):
-    res = {'scriptPath':None, 'verbose':False, '-astdump':False, 'astdump_file':None, '-atdump':False, 'atdump_file':None}
+    res = {'scriptPath':None, 'verbose':False, '-astdump':False, 'astdump_file':None, '-atdump':False, 'atdump_file':None, 'engine':'ast', '-emit-py':False, 'emitpy_file':None, '-no-cache':False, '-timing':False, '-memoize':False, '-no-inline':False}
     i = 0
     while i < len(args):
         if '.play' in args[i]:
@@ -20,10 +26,42 @@ def parseParams(args):
             if (i+1 < len(args)) and (not args[i+1] in res):
                 res['atdump_file'] = args[i+1]
                 i += 1
+        elif args[i] == '-emit-py':
+            # 输出翻译成的 Python 代码
+            res['-emit-py'] = True
+            if (i+1 < len(args)) and (not args[i+1] in res) and not args[i+1].startswith('-'):
+                res['emitpy_file'] = args[i+1]
+                i += 1
+        elif args[i] == '-timing':
+            # 输出词法分析、语法分析和语义分析每个pass花的时间
+            res['-timing'] = True
+        elif args[i] == '-no-cache':
+            # 不使用 __playcache__ 里缓存的编译结果
+            res['-no-cache'] = True
+        elif args[i] == '-memoize':
+            # 缓存纯函数的调用结果，执行完以后输出每个函数的缓存命中率（ast 和 vm 引擎）
+            res['-memoize'] = True
+        elif args[i] == '-no-inline':
+            # vm 引擎不做函数内联（调试用）
+            res['-no-inline'] = True
+        elif args[i] == '-engine':
+            # 执行引擎：ast（AST解释器，缺省）、vm（字节码虚拟机）、closure（闭包编译）、python（翻译成Python代码）
+            if i+1 < len(args):
+                res['engine'] = args[i+1]
+                i += 1
         i += 1
     return res
 
 
+# 输出翻译成的 Python 代码，不指定文件时输出到控制台
+def emitPython(source:str, f:str):
+    if f:
+        with open(f, 'w', encoding='utf-8') as fout:
+            fout.write(source)
+    else:
+        print(source)
+
+
 def main(argv):
     args = argv[1:] if len(argv)>1 else []
     # print(args)
@@ -34,9 +72,36 @@ def main(argv):
         prog = ''
         with open(scriptPath, 'r', encoding='utf-8') as fin:
             prog = fin.read()
-        
+
+        if params['-memoize'] and params['engine'] not in ('ast', 'vm'):
+            print('warning: -memoize is only supported by -engine ast and vm, ignored', file=sys.stderr)
+
+        # 翻译成Python代码的结果可以缓存到磁盘上，命中缓存时不用再做词法、语法和语义分析
+        cache = None
+        if (params['-emit-py'] or params['engine'] == 'python') and not (params['-astdump'] or params['-atdump'] or params['-timing'] or params['-no-cache']):
+            cache = CompileCache.forScript(scriptPath)
+            cached = cache.load(prog)
+            if cached:
+                source, code = cached
+                if params['-emit-py']:
+                    emitPython(source, params['emitpy_file'])
+                else:
+                    runProgram(code)
+                return
+
+        from frontend import translate, AnnotatedTree, Dumper
+        importTime = time.perf_counter() - startTime
         at:AnnotatedTree = translate(prog)
 
+        if params['-timing']:
+            # 输出到stderr，不影响脚本本身的输出。启动时间是 main.py 开始执行到前端导入完毕，不含解释器自身的启动
+            print('%-64s %9.3f ms' % ('Startup (imports)', importTime * 1000), file=sys.stderr)
+            total = 0.0
+            for name, seconds in at.passTimings:
+                print('%-64s %9.3f ms' % (name, seconds * 1000), file=sys.stderr)
+                total += seconds
+            print('%-64s %9.3f ms' % ('total', total * 1000), file=sys.stderr)
+
         if params['-astdump'] or params['-atdump']:
             dumper = Dumper(at)
             if params['-astdump']:
@@ -51,9 +116,41 @@ def main(argv):
                 dumper.dump_at(f)
                 if f:
                     f.close()
+        elif params['-emit-py'] and not at.hasCompilationError():
+            from python_transpiler import PythonTranspiler
+            source = PythonTranspiler(at).transpile()
+            if cache:
+                cache.store(prog, source, PythonTranspiler.compileSource(source))
+            emitPython(source, params['emitpy_file'])
         elif not at.hasCompilationError():
-            eval = ASTEvaluator(at)
-            eval.visit(at.ast)
+            if params['engine'] == 'vm':
+                from bytecode_vm import BytecodeCompiler, BytecodeVM, MemoCache
+                compiler = BytecodeCompiler(at)
+                compiler.inline = not params['-no-inline']
+                program:Program = compiler.compile()
+                vm = BytecodeVM(program)
+                vm.memoize = params['-memoize']
+                vm.execute()
+                if vm.memoize:
+                    MemoCache.report([c for c in vm.memoCaches.values() if c])
+            elif params['engine'] == 'closure':
+                from closure_compiler import ClosureCompiler
+                run = ClosureCompiler(at).compile()
+                run()
+            elif params['engine'] == 'python':
+                from python_transpiler import PythonTranspiler
+                source = PythonTranspiler(at).transpile()
+                code = PythonTranspiler.compileSource(source)
+                if cache:
+                    cache.store(prog, source, code)
+                runProgram(code)
+            else:
+                from ast_evaluator import ASTEvaluator, MemoCache
+                eval = ASTEvaluator(at)
+                eval.memoize = params['-memoize']
+                eval.visit(at.ast)
+                if eval.memoize:
+                    MemoCache.report([c for c in eval.memoCaches.values() if c])
         else:
             at.show_log()
     else:
@@ -0,0 +1,102 @@
+import sys
+import io
+import contextlib
+from typing import List
+from collections import OrderedDict
+
+
+'''
+ * 纯函数调用结果的缓存（-memoize）。每个可以缓存的函数（见 PurityAnalyzer.isMemoizable()）一个，按参数值查找。
+ * 缓存的大小有上限，超过时按LRU淘汰：命中时把这一项挪到最后，淘汰时从最前面删。
+ * 同时记录命中和没命中的次数，执行完以后报告命中率。
+'''
+class MemoCache():
+    # 缺省每个函数最多缓存的结果个数
+    MAX_SIZE = 4096
+    # 没有找到时 get() 的返回值。不能用None，因为None也可能是函数的返回值
+    MISSING = object()
+
+    def __init__(self, name:str, maxSize:int=MAX_SIZE):
+        self.name = name
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # 参数值连同类型一起作为键：1、1.0、True 在 dict 里是同一个键，但对 PlayScript 来说是不同的值（比如字符串连接的结果不同）
+    def keyOf(args) -> tuple:
+        return tuple((type(arg), arg) for arg in args)
+
+    def get(self, key):
+        value = self.entries.get(key, MemoCache.MISSING)
+        if value is MemoCache.MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    # 输出每个函数的缓存命中率，输出到stderr，不影响脚本本身的输出
+    def report(caches:list, file=None):
+        file = file if file else sys.stderr
+        print('%-32s %10s %10s %9s %8s' % ('memoized function', 'hits', 'misses', 'hit rate', 'entries'), file=file)
+        for cache in caches:
+            calls = cache.hits + cache.misses
+            rate = cache.hits * 100.0 / calls if calls else 0.0
+            print('%-32s %10d %10d %8.1f%% %8d' % (cache.name, cache.hits, cache.misses, rate, len(cache.entries)), file=file)
+
+
+'''
+ * 用 ast 或 vm 引擎执行一段脚本，返回输出（包括编译和执行时的异常）。缓存的命中率报告不算在内
+'''
+def runScript(text:str, engine:str, memoize:bool) -> str:
+    from frontend import translate
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        try:
+            at = translate(text)
+            if not at.hasCompilationError():
+                if engine == 'vm':
+                    from bytecode_vm import BytecodeCompiler, BytecodeVM
+                    runner = BytecodeVM(BytecodeCompiler(at).compile())
+                    runner.memoize = memoize
+                    runner.execute()
+                else:
+                    from ast_evaluator import ASTEvaluator
+                    runner = ASTEvaluator(at)
+                    runner.memoize = memoize
+                    runner.visit(at.ast)
+        except Exception as e:
+            print('error: ' + repr(e))
+    return out.getvalue()
+
+
+'''
+ * 差分检查：每个文件在 ast 和 vm 引擎上，缓存和不缓存纯函数的结果，输出要完全一样
+'''
+def check(paths:List[str]) -> bool:
+    from dfa_cache import readScripts
+    ok = True
+    scripts = readScripts(paths)
+    for path, text in scripts:
+        for engine in ('ast', 'vm'):
+            if runScript(text, engine, True) != runScript(text, engine, False):
+                print('FAIL %s: the output of -engine %s changes with -memoize' % (path, engine))
+                ok = False
+    print('%d files, %s' % (len(scripts), 'all the same' if ok else 'FAILED'))
+    return ok
+
+
+# 用法：
+# python memo_cache.py -check <文件或目录...>
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] == '-check':
+        sys.exit(0 if check(args[1:]) else 1)
+    else:
+        print('usage: memo_cache.py -check <files or directories>')
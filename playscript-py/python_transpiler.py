@@ -0,0 +1,798 @@
+import keyword
+import math
+
+from frontend import *
+
+
+'''
+ * 生成的 Python 代码里用到的辅助函数，放在代码的最前面
+'''
+PRELUDE = '''\
+def _and(a, b):
+    return a and b
+
+def _or(a, b):
+    return a or b
+
+def _println(*values):
+    print(values[-1])
+
+def _setattr(obj, name, value):
+    setattr(obj, name, value)
+    return value
+
+def _update(obj, name, update, right, returnOld):
+    old = getattr(obj, name)
+    value = update(old, right)
+    setattr(obj, name, value)
+    return old if returnOld else value
+'''
+
+# 生成的代码里，不能被 PlayScript 的标识符占用的名字
+reservedNames = set(keyword.kwlist) | {'self', 'print', 'str', 'int', 'float', 'range', 'object', 'property',
+                                       'setattr', 'getattr', '_and', '_or', '_println', '_setattr', '_update', '_main', '_obj'}
+
+
+'''
+ * 为符号分配 Python 里的名字。同名的符号依次加上后缀，保证整个程序里没有重名，
+ * 这样就不用操心 Python 的作用域规则（遮蔽、nonlocal 的绑定）和 PlayScript 的不一致。
+'''
+class PythonNames():
+    def __init__(self):
+        self.names = {}  # Map<Object, str>
+        self.used = set(reservedNames)
+
+    def nameOf(self, key, baseName:str) -> str:
+        name = self.names.get(key)
+        if name is None:
+            name = baseName
+            i = 1
+            while name in self.used:
+                name = baseName + '_' + str(i)
+                i += 1
+            self.used.add(name)
+            self.names[key] = name
+        return name
+
+
+'''
+ * 正在生成的一个 Python 函数（主程序、函数、方法、类的 __init__）的上下文
+'''
+class PythonFunctionContext():
+    def __init__(self, unit:Scope, isConstructor:bool=False):
+        self.unit = unit
+        self.isConstructor = isConstructor
+        # 需要声明为 nonlocal 的名字
+        self.nonlocals = set()
+        # 循环的嵌套栈。for 循环记录 continue 之前需要执行的更新语句
+        self.loops = []
+
+
+'''
+ * 把 AnnotatedTree 翻译成等价的 Python 源代码，交给 CPython 去编译执行。
+ * 整个程序包在 _main() 函数里：全局变量是 _main 的本地变量，函数和类都按作用域嵌套定义，
+ * 闭包直接对应 Python 的闭包，对外层变量的赋值用 nonlocal 声明。
+ * PlayScript 的类翻译成带 __slots__ 的 Python 类，动态绑定交给 Python 的属性查找。
+'''
+class PythonTranspiler(PlayScriptVisitor):
+    def __init__(self, at:AnnotatedTree):
+        self.at = at
+        self.names = PythonNames()
+        self.context:PythonFunctionContext = None
+        self.lines:List[str] = []
+        self.indent = 0
+        # 被其他单元引用的变量（闭包变量）
+        self.captured = set()      # Set<Variable>
+        # 每个变量在哪些单元里被赋值（不含声明时的初始化）
+        self.assignedIn = {}       # Map<Variable, Set<Scope>>
+        # 子类里有同名字段覆盖的字段名，obj.x 需要按对象的真实类型查找
+        self.shadowedFields = set()  # Set<str>
+
+    def transpile(self) -> str:
+        self.analyze()
+
+        root:Scope = self.at.node2Scope[self.at.ast]
+        lines = self.functionLines(root, 'def _main():', [], self.at.ast.blockStatements())
+        return PRELUDE + '\n\n' + '\n'.join(lines) + '\n'
+
+    # 把生成的代码编译成 Python 的 code object
+    def compileSource(source:str):
+        return compile(source, '<playscript>', 'exec')
+
+    ############################################################
+    # 预先的分析
+
+    def unitOfNode(self, node) -> Scope:
+        return self.at.enclosingScopeOfNode(node).unit
+
+    def analyze(self):
+        for node, symbol in self.at.symbolOfNode.items():
+            if isinstance(symbol, Variable) and not self.isField(symbol) and not isinstance(symbol, (This, Super)):
+                if self.unitOfNode(node) is not symbol.enclosingScope.unit:
+                    self.captured.add(symbol)
+        self.scanAssignments(self.at.ast)
+
+        for type in self.at.types:
+            if isinstance(type, Class) and type.getParentClass():
+                for symbol in type.symbols:
+                    if isinstance(symbol, Variable) and type.getParentClass().getVariable(symbol.name):
+                        self.shadowedFields.add(symbol.name)
+
+    def scanAssignments(self, ctx):
+        if isinstance(ctx, PlayScriptParser.ExpressionContext) and self.isUpdate(ctx):
+            variable = self.lvalueVariable(ctx.expression(0))
+            if variable is not None:
+                self.assignedIn.setdefault(variable, set()).add(self.unitOfNode(ctx))
+        if isinstance(ctx, ParserRuleContext) and ctx.children:
+            for child in ctx.children:
+                self.scanAssignments(child)
+
+    # 是否是赋值、复合赋值或者 ++/--
+    def isUpdate(self, ctx:PlayScriptParser.ExpressionContext) -> bool:
+        if ctx.bop and ctx.bop.type in (PlayScriptParser.ASSIGN, PlayScriptParser.ADD_ASSIGN, PlayScriptParser.SUB_ASSIGN,
+                                        PlayScriptParser.MUL_ASSIGN, PlayScriptParser.DIV_ASSIGN, PlayScriptParser.MOD_ASSIGN):
+            return True
+        return ctx.postfix is not None or (ctx.prefix is not None and ctx.prefix.type in (PlayScriptParser.INC, PlayScriptParser.DEC))
+
+    # 赋值的左边如果是一个普通变量，返回这个变量
+    def lvalueVariable(self, ctx:PlayScriptParser.ExpressionContext) -> Variable:
+        primary = ctx.primary()
+        if primary:
+            if primary.expression():
+                return self.lvalueVariable(primary.expression())
+            symbol = self.at.symbolOfNode.get(primary)
+            if primary.IDENTIFIER() and isinstance(symbol, Variable) and not self.isField(symbol):
+                return symbol
+        return None
+
+    # 一个子树里被赋值的所有变量
+    def variablesAssignedUnder(self, ctx, rtn:set) -> set:
+        if isinstance(ctx, PlayScriptParser.ExpressionContext) and self.isUpdate(ctx):
+            variable = self.lvalueVariable(ctx.expression(0))
+            if variable is not None:
+                rtn.add(variable)
+        if isinstance(ctx, ParserRuleContext) and ctx.children:
+            for child in ctx.children:
+                self.variablesAssignedUnder(child, rtn)
+        return rtn
+
+    # 表达式是否没有副作用（不含函数调用和赋值），这样的表达式可以放心地短路求值
+    def isPure(self, ctx) -> bool:
+        if isinstance(ctx, PlayScriptParser.FunctionCallContext):
+            return False
+        if isinstance(ctx, PlayScriptParser.ExpressionContext) and self.isUpdate(ctx):
+            return False
+        if isinstance(ctx, ParserRuleContext) and ctx.children:
+            for child in ctx.children:
+                if not self.isPure(child):
+                    return False
+        return True
+
+    ############################################################
+    # 名字
+
+    def isField(self, variable:Variable) -> bool:
+        return isinstance(variable.enclosingScope, Class) and not isinstance(variable, (This, Super))
+
+    def variableName(self, variable:Variable) -> str:
+        return self.names.nameOf(variable, variable.name)
+
+    def className(self, theClass:Class) -> str:
+        return self.names.nameOf(theClass, theClass.name)
+
+    # 方法的名字：覆盖关系上的方法要用同一个名字，Python 的属性查找就完成了动态绑定
+    def functionName(self, function:Function) -> str:
+        if function.isMethod() and not function.isConstructor():
+            root = function
+            parent:Class = function.enclosingScope.getParentClass()
+            while parent:
+                overrided = parent.getFunction(function.name, function.getParamTypes())
+                if overrided is None:
+                    break
+                root = overrided
+                parent = overrided.enclosingScope.getParentClass()
+            return self.names.nameOf(('method', root), function.name)
+        return self.names.nameOf(function, function.name)
+
+    # obj.x：如果存在同名字段的覆盖，用一个 property 按对象的真实类型去找
+    def dynamicFieldName(self, name:str) -> str:
+        return self.names.nameOf(('field', name), name)
+
+    def line(self, text:str):
+        self.lines.append('    ' * self.indent + text)
+
+    ############################################################
+    # 函数和类
+
+    # 单元里直接声明的函数和类（包括嵌套在 block 里的）
+    def nestedUnits(self, scope:Scope, rtn:list) -> list:
+        for symbol in scope.symbols:
+            if isinstance(symbol, (Function, Class)):
+                rtn.append(symbol)
+            elif isinstance(symbol, Scope):
+                self.nestedUnits(symbol, rtn)
+        return rtn
+
+    # 单元里声明的变量（摊平的）
+    def unitVariables(self, scope:Scope, rtn:list) -> list:
+        for symbol in scope.symbols:
+            if isinstance(symbol, Variable):
+                rtn.append(symbol)
+            elif isinstance(symbol, Scope) and not isinstance(symbol, (Function, Class)):
+                self.unitVariables(symbol, rtn)
+        return rtn
+
+    '''
+     * 生成一个 Python 函数，返回它的代码行（缩进从0开始）。
+     * 嵌套的函数和类提升到函数的开头，这样在声明之前就可以调用它们。
+    '''
+    def functionLines(self, unit:Scope, header:str, params:List[Variable], body, isConstructor:bool=False) -> List[str]:
+        saved = (self.context, self.lines, self.indent)
+        self.context = PythonFunctionContext(unit, isConstructor)
+
+        nested = []
+        units = self.nestedUnits(unit, [])
+        # 父类要先定义
+        classes = sorted([u for u in units if isinstance(u, Class)], key=self.classDepth)
+        for u in classes + [u for u in units if isinstance(u, Function)]:
+            if isinstance(u, Class):
+                nested.extend(self.classLines(u))
+            else:
+                nested.extend(self.defLines(u))
+            nested.append('')
+
+        self.lines = []
+        self.indent = 1
+        if body is not None:
+            self.visitBlockStatements(body)
+        if isConstructor:
+            self.line('return self')
+
+        rtn = [header]
+        if self.context.nonlocals:
+            rtn.append('    nonlocal ' + ', '.join(sorted(self.context.nonlocals)))
+        # 被闭包引用的变量先置为 None，这样在声明之前调用闭包也不会出错
+        captured = [self.variableName(v) for v in self.unitVariables(unit, []) if v in self.captured and v not in params]
+        if captured:
+            rtn.append('    ' + ' = '.join(captured) + ' = None')
+        rtn.extend(['    ' + line if line else line for line in nested])
+        rtn.extend(self.lines)
+        if len(rtn) == 1:
+            rtn.append('    pass')
+
+        self.context, self.lines, self.indent = saved
+        return rtn
+
+    def classDepth(self, theClass:Class) -> int:
+        depth = 0
+        while theClass.getParentClass():
+            depth += 1
+            theClass = theClass.getParentClass()
+        return depth
+
+    def defLines(self, function:Function) -> List[str]:
+        params = list(function.parameters)
+        names = [self.variableName(p) for p in params]
+        if function.isMethod():
+            names.insert(0, 'self')
+        header = 'def ' + self.functionName(function) + '(' + ', '.join(names) + '):'
+        body = None
+        ctx:PlayScriptParser.FunctionDeclarationContext = function.ctx
+        if ctx.functionBody().block():
+            body = ctx.functionBody().block().blockStatements()
+        return self.functionLines(function, header, params, body, function.isConstructor())
+
+    def classLines(self, theClass:Class) -> List[str]:
+        parent = theClass.getParentClass()
+        rtn = ['class ' + self.className(theClass) + '(' + (self.className(parent) if parent else 'object') + '):']
+
+        fields = [s for s in theClass.symbols if isinstance(s, Variable)]
+        slots = [self.variableName(v) for v in fields]
+        rtn.append('    __slots__ = (' + ''.join(["'" + s + "', " for s in slots]) + ')')
+        rtn.append('')
+
+        # 缺省的初始化：父类的字段先初始化，然后是本类的字段，先置为None，再执行字段声明里的初始化
+        saved = (self.context, self.lines, self.indent)
+        self.context = PythonFunctionContext(theClass)
+        self.lines = []
+        self.indent = 1
+        if parent:
+            self.line(self.className(parent) + '.__init__(self)')
+        if slots:
+            self.line(' = '.join(['self.' + s for s in slots]) + ' = None')
+        for child in theClass.ctx.classBody().classBodyDeclaration():
+            member = child.memberDeclaration()
+            if member and member.fieldDeclaration():
+                for declarator in member.fieldDeclaration().variableDeclarators().variableDeclarator():
+                    if declarator.variableInitializer():
+                        variable = self.at.symbolOfNode[declarator.variableDeclaratorId()]
+                        self.line('self.' + self.variableName(variable) + ' = ' + self.visitVariableInitializer(declarator.variableInitializer()))
+        init = ['def __init__(self):']
+        if self.context.nonlocals:
+            init.append('    nonlocal ' + ', '.join(sorted(self.context.nonlocals)))
+        init.extend(self.lines if self.lines else ['    pass'])
+        self.context, self.lines, self.indent = saved
+        rtn.extend(['    ' + line for line in init])
+        rtn.append('')
+
+        # 被子类覆盖的字段，obj.x 通过 property 找到对象真实类型里的字段
+        for variable in fields:
+            if variable.name in self.shadowedFields:
+                attr = self.variableName(variable)
+                rtn.append('    ' + self.dynamicFieldName(variable.name) + ' = property(lambda self: self.' + attr +
+                           ', lambda self, value: setattr(self, \'' + attr + '\', value))')
+                rtn.append('')
+
+        for symbol in theClass.symbols:
+            if isinstance(symbol, Function):
+                rtn.extend(['    ' + line if line else line for line in self.defLines(symbol)])
+                rtn.append('')
+        return rtn
+
+    ############################################################
+    # 变量
+
+    def thisName(self) -> str:
+        if SlotResolver.thisUnit(self.context.unit) is None:
+            raise Exception("keyword \"this\" can only be used inside a class")
+        return 'self'
+
+    def loadVariable(self, variable:Variable) -> str:
+        if isinstance(variable, This) or isinstance(variable, Super):
+            return self.thisName()
+        elif self.isField(variable):
+            return self.thisName() + '.' + self.variableName(variable)
+        return self.variableName(variable)
+
+    # 对变量赋值之前调用：外层单元的变量要声明为 nonlocal
+    def storeVariable(self, variable:Variable) -> str:
+        name = self.variableName(variable)
+        if variable.enclosingScope.unit is not self.context.unit:
+            self.context.nonlocals.add(name)
+        return name
+
+    '''
+     * 编译赋值语句、++/--的左边，返回一个描述左值的元组：
+     * ('var', name)：普通变量
+     * ('field', obj, attr)：对象的字段
+    '''
+    def visitLValue(self, ctx:PlayScriptParser.ExpressionContext):
+        if ctx.primary():
+            primary:PlayScriptParser.PrimaryContext = ctx.primary()
+            if primary.expression():
+                return self.visitLValue(primary.expression())
+            symbol = self.at.symbolOfNode.get(primary)
+            if primary.IDENTIFIER() and isinstance(symbol, Variable):
+                if self.isField(symbol):
+                    return ('field', self.thisName(), self.variableName(symbol))
+                return ('var', self.storeVariable(symbol))
+        elif ctx.bop and ctx.bop.type == PlayScriptParser.DOT and ctx.IDENTIFIER():
+            obj = self.visitExpression(ctx.expression(0))
+            return ('field', obj, self.fieldName(ctx))
+        raise Exception("has to be LValue: " + ctx.getText())
+
+    # obj.x 里的字段在 Python 里的属性名
+    def fieldName(self, ctx:PlayScriptParser.ExpressionContext) -> str:
+        leftVar = self.at.symbolOfNode.get(ctx.expression(0))
+        name = ctx.IDENTIFIER().getText()
+        # 对于this和super引用的属性，不用考虑重载，因为它们的解析是准确的
+        if isinstance(leftVar, This) or isinstance(leftVar, Super) or name not in self.shadowedFields:
+            return self.variableName(self.at.symbolOfNode[ctx])
+        return self.dynamicFieldName(name)
+
+    '''
+     * 访问 obj 的成员（member 是 '.x' 或者 '.foo(...)'）。跟其他执行引擎一样，obj 为null时结果是null，不访问成员，也不计算参数。
+     * obj 只计算一次，存在 _obj 里。this 和 super 不会是null，不用判断
+    '''
+    def nullGuarded(self, receiver:PlayScriptParser.ExpressionContext, obj:str, member:str) -> str:
+        leftVar = self.at.symbolOfNode.get(receiver)
+        if isinstance(leftVar, This) or isinstance(leftVar, Super):
+            return obj + member
+        return '(None if (_obj := ' + obj + ') is None else _obj' + member + ')'
+
+    def lvalueText(self, lvalue) -> str:
+        if lvalue[0] == 'var':
+            return lvalue[1]
+        return lvalue[1] + '.' + lvalue[2]
+
+    ############################################################
+    # 表达式
+
+    # 把数值转换成比较运算需要的类型。整数字面量本身就是 int，不用转换
+    def numeric(self, ctx:PlayScriptParser.ExpressionContext, text:str, convert:str) -> str:
+        if convert == 'int' and type(self.at.constOfNode.get(ctx)) == int:
+            return text
+        return convert + '(' + text + ')'
+
+    # 转换成字符串。字符串常量和字符串的拼接本身就是 str，不用转换
+    def string(self, ctx:PlayScriptParser.ExpressionContext, text:str) -> str:
+        if isinstance(self.at.constOfNode.get(ctx), str):
+            return text
+        while ctx.primary() and ctx.primary().expression():
+            ctx = ctx.primary().expression()
+        if ctx.bop and ctx.bop.type == PlayScriptParser.ADD and self.at.typeOfNode.get(ctx) == String:
+            return text
+        return 'str(' + text + ')'
+
+    def binary(self, ctx:PlayScriptParser.ExpressionContext) -> str:
+        bop = ctx.bop.type
+        type = self.at.typeOfNode[ctx]
+        type1 = self.at.typeOfNode[ctx.expression(0)]
+        type2 = self.at.typeOfNode[ctx.expression(1)]
+        left = self.visitExpression(ctx.expression(0))
+        right = self.visitExpression(ctx.expression(1))
+        if bop == PlayScriptParser.ADD and type == String:
+            return self.string(ctx.expression(0), left) + ' + ' + self.string(ctx.expression(1), right)
+        elif bop in (PlayScriptParser.ADD, PlayScriptParser.SUB, PlayScriptParser.MUL, PlayScriptParser.DIV, PlayScriptParser.MOD):
+            return '(' + left + ' ' + ctx.bop.text + ' ' + right + ')'
+        elif bop in (PlayScriptParser.AND, PlayScriptParser.OR):
+            # 两边都要计算（&&、|| 不短路，和 ASTEvaluator 保持一致）。右边没有副作用时，可以直接用 and/or
+            if self.isPure(ctx.expression(1)):
+                return '(' + left + (' and ' if bop == PlayScriptParser.AND else ' or ') + right + ')'
+            return ('_and(' if bop == PlayScriptParser.AND else '_or(') + left + ', ' + right + ')'
+        upperType = None
+        if PrimitiveType.isNumeric(type1) and PrimitiveType.isNumeric(type2):
+            upperType = PrimitiveType.getUpperType(type1, type2)
+        convert = {Integer: 'int', Float: 'float'}.get(upperType)
+        if bop in (PlayScriptParser.EQUAL, PlayScriptParser.NOTEQUAL):
+            op = ' == ' if bop == PlayScriptParser.EQUAL else ' != '
+            if convert is None:
+                # a == null，左边是个class，右边是 Null，直接比较引用
+                return '(' + left + op + right + ')'
+        else:
+            op = ' ' + ctx.bop.text + ' '
+            if convert is None:
+                # 比较大小只支持数值。比如字符串比较大小，结果总是false
+                return '(' + left + ', ' + right + ', False)[-1]'
+        return '(' + self.numeric(ctx.expression(0), left, convert) + op + self.numeric(ctx.expression(1), right, convert) + ')'
+
+    # 计算新值的表达式：复合赋值、++/--。right 是已经生成好的右边的表达式，为None时在这里生成
+    def updatedValue(self, ctx:PlayScriptParser.ExpressionContext, old:str, right:str=None) -> str:
+        if ctx.bop:
+            if right is None:
+                right = self.visitExpression(ctx.expression(1))
+            if ctx.bop.type == PlayScriptParser.ADD_ASSIGN and self.at.typeOfNode[ctx] == String:
+                return 'str(' + old + ') + str(' + right + ')'
+            return '(' + old + ' ' + ctx.bop.text[0] + ' ' + right + ')'
+        op = ctx.postfix if ctx.postfix else ctx.prefix
+        return '(' + old + (' + 1)' if op.type == PlayScriptParser.INC else ' - 1)')
+
+    '''
+     * 修改对象的字段：对象的表达式只计算一次。右边的表达式作为参数传给 _update，不能生成在 lambda 里面，
+     * 否则里面的赋值（:=）绑定的是 lambda 的局部变量。
+    '''
+    def updateCall(self, ctx:PlayScriptParser.ExpressionContext, lvalue, returnOld:bool) -> str:
+        right = self.visitExpression(ctx.expression(1)) if ctx.bop else 'None'
+        return '_update(' + lvalue[1] + ", '" + lvalue[2] + "', lambda old, right: " + self.updatedValue(ctx, 'old', 'right') + ', ' + right + ', ' + str(returnOld) + ')'
+
+    def visitExpression(self, ctx:PlayScriptParser.ExpressionContext) -> str:
+        value = self.at.constOfNode.get(ctx)
+        # 常量折叠过的表达式，直接写成 Python 的字面量。inf、nan 没有字面量，照常翻译
+        if value is not None and (not isinstance(value, float) or math.isfinite(value)):
+            return repr(value)
+        bop = ctx.bop.type if ctx.bop else None
+        if self.isUpdate(ctx):
+            lvalue = self.visitLValue(ctx.expression(0))
+            if bop == PlayScriptParser.ASSIGN:
+                value = self.visitExpression(ctx.expression(1))
+                if lvalue[0] == 'var':
+                    return '(' + lvalue[1] + ' := ' + value + ')'
+                return '_setattr(' + lvalue[1] + ", '" + lvalue[2] + "', " + value + ')'
+            returnOld = ctx.postfix is not None
+            if lvalue[0] == 'var':
+                text = '(' + lvalue[1] + ' := ' + self.updatedValue(ctx, lvalue[1]) + ')'
+                if returnOld:
+                    text = '(' + text + (' - 1)' if ctx.postfix.type == PlayScriptParser.INC else ' + 1)')
+                return text
+            return self.updateCall(ctx, lvalue, returnOld)
+
+        if bop == PlayScriptParser.DOT:
+            obj = self.visitExpression(ctx.expression(0))
+            if ctx.IDENTIFIER():
+                return self.nullGuarded(ctx.expression(0), obj, '.' + self.fieldName(ctx))
+            elif ctx.functionCall():
+                return self.visitMethodCall(ctx.functionCall(), obj, isinstance(self.at.symbolOfNode.get(ctx.expression(0)), Super))
+        elif bop == PlayScriptParser.INSTANCEOF:
+            # instanceof 的结果是null，跟 ASTEvaluator 一样，不计算左边的表达式
+            return 'None'
+        elif bop == PlayScriptParser.QUESTION:
+            condition = self.visitExpression(ctx.expression(0))
+            then = self.visitExpression(ctx.expression(1))
+            other = self.visitExpression(ctx.expression(2))
+            return '(' + then + ' if ' + condition + ' else ' + other + ')'
+        elif bop and len(ctx.expression()) == 2:
+            return self.binary(ctx)
+        elif ctx.primary():
+            return self.visitPrimary(ctx.primary())
+        elif ctx.prefix:
+            # 前缀操作：+、-、!
+            exp = self.visitExpression(ctx.expression(0))
+            if ctx.prefix.type == PlayScriptParser.SUB:
+                return '(-' + exp + ')'
+            elif ctx.prefix.type == PlayScriptParser.BANG:
+                return '(not ' + exp + ')'
+            return exp
+        elif ctx.functionCall():
+            return self.visitFunctionCall(ctx.functionCall())
+        raise Exception("Unsupported expression: " + ctx.getText())
+
+    def visitPrimary(self, ctx:PlayScriptParser.PrimaryContext) -> str:
+        if ctx.literal():
+            return repr(self.visitLiteral(ctx.literal()))
+        elif ctx.IDENTIFIER():
+            symbol:Symbol = self.at.symbolOfNode[ctx]
+            if isinstance(symbol, Variable):
+                return self.loadVariable(symbol)
+            elif isinstance(symbol, Function):
+                # 函数作为值来使用，Python 的函数本身就带着闭包
+                if symbol.isMethod():
+                    return self.thisName() + '.' + self.functionName(symbol)
+                return self.functionName(symbol)
+        elif ctx.expression():
+            return self.visitExpression(ctx.expression())
+        elif ctx.THIS() or ctx.SUPER():
+            return self.thisName()
+        return 'None'
+
+    def visitLiteral(self, ctx:PlayScriptParser.LiteralContext):
+        return ConstantFolder.literalValue(ctx)
+
+    ############################################################
+    # 函数调用
+
+    def visitArguments(self, ctx:PlayScriptParser.FunctionCallContext) -> List[str]:
+        if ctx.expressionList():
+            return [self.visitExpression(exp) for exp in ctx.expressionList().expression()]
+        return []
+
+    def visitFunctionCall(self, ctx:PlayScriptParser.FunctionCallContext) -> str:
+        symbol:Symbol = self.at.symbolOfNode.get(ctx)
+
+        # this() 和 super()：在构造方法里调用另一个构造方法
+        if ctx.THIS() or ctx.SUPER():
+            if isinstance(symbol, DefaultConstructor) or symbol is None:
+                # 缺省构造函数一定在之前已经被调用了
+                return 'None'
+            args = [self.thisName()] + self.visitArguments(ctx)
+            return self.className(symbol.enclosingScope) + '.' + self.functionName(symbol) + '(' + ', '.join(args) + ')'
+
+        # 硬编码的println
+        if ctx.IDENTIFIER().getText() == "println":
+            args = self.visitArguments(ctx)
+            if len(args) <= 1:
+                return 'print(' + ''.join(args) + ')'
+            return '_println(' + ', '.join(args) + ')'
+
+        if isinstance(symbol, DefaultConstructor):
+            # 类的缺省构造函数，直接创建对象
+            return self.className(symbol.Class()) + '()'
+        elif isinstance(symbol, Function) and symbol.isConstructor():
+            # 先创建对象、做缺省的初始化，再计算参数、调用构造方法。构造方法返回对象本身
+            return self.className(symbol.enclosingScope) + '().' + self.functionName(symbol) + '(' + ', '.join(self.visitArguments(ctx)) + ')'
+        elif isinstance(symbol, Function):
+            if symbol.isMethod():
+                # 在类的内部直接调用方法，对象就是当前的this，静态绑定
+                args = [self.thisName()] + self.visitArguments(ctx)
+                return self.className(symbol.enclosingScope) + '.' + self.functionName(symbol) + '(' + ', '.join(args) + ')'
+            return self.functionName(symbol) + '(' + ', '.join(self.visitArguments(ctx)) + ')'
+        elif isinstance(symbol, Variable):
+            # 函数类型的变量
+            return self.loadVariable(symbol) + '(' + ', '.join(self.visitArguments(ctx)) + ')'
+        raise Exception("unable to find function or function variable " + ctx.IDENTIFIER().getText())
+
+    def visitMethodCall(self, ctx:PlayScriptParser.FunctionCallContext, obj:str, isSuper:bool) -> str:
+        symbol:Symbol = self.at.symbolOfNode.get(ctx)
+        args = self.visitArguments(ctx)
+        if isinstance(symbol, Function):
+            if isSuper or symbol.isConstructor():
+                args.insert(0, obj)
+                return self.className(symbol.enclosingScope) + '.' + self.functionName(symbol) + '(' + ', '.join(args) + ')'
+            # 对普通的类方法，由 Python 在运行时动态绑定
+            return self.nullGuarded(ctx.parentCtx.expression(0), obj, '.' + self.functionName(symbol) + '(' + ', '.join(args) + ')')
+        elif isinstance(symbol, Variable):
+            # 函数类型的属性
+            return self.nullGuarded(ctx.parentCtx.expression(0), obj, '.' + self.variableName(symbol) + '(' + ', '.join(args) + ')')
+        raise Exception("unable to find method " + ctx.getText())
+
+    ############################################################
+    # 语句
+
+    def visitBlock(self, ctx:PlayScriptParser.BlockContext):
+        self.visitBlockStatements(ctx.blockStatements())
+
+    def visitBlockStatements(self, ctx:PlayScriptParser.BlockStatementsContext):
+        for child in ctx.blockStatement():
+            self.visitBlockStatement(child)
+
+    def visitBlockStatement(self, ctx:PlayScriptParser.BlockStatementContext):
+        # 函数和类的声明已经提升到函数开头了
+        if ctx.variableDeclarators():
+            self.visitVariableDeclarators(ctx.variableDeclarators())
+        elif ctx.statement():
+            self.visitStatement(ctx.statement())
+
+    def visitVariableDeclarators(self, ctx:PlayScriptParser.VariableDeclaratorsContext):
+        for child in ctx.variableDeclarator():
+            variable:Variable = self.at.symbolOfNode[child.variableDeclaratorId()]
+            value = 'None'
+            if child.variableInitializer():
+                value = self.visitVariableInitializer(child.variableInitializer())
+            self.line(self.storeVariable(variable) + ' = ' + value)
+
+    def visitVariableInitializer(self, ctx:PlayScriptParser.VariableInitializerContext) -> str:
+        if ctx.expression():
+            return self.visitExpression(ctx.expression())
+        raise Exception("Unsupported feature: array initializer")
+
+    # 作为语句的表达式，尽量生成 Python 的赋值语句
+    def expressionStatement(self, ctx:PlayScriptParser.ExpressionContext):
+        if self.isUpdate(ctx):
+            lvalue = self.visitLValue(ctx.expression(0))
+            target = self.lvalueText(lvalue)
+            if ctx.bop and ctx.bop.type == PlayScriptParser.ASSIGN:
+                self.line(target + ' = ' + self.visitExpression(ctx.expression(1)))
+            elif not (ctx.bop and ctx.bop.type == PlayScriptParser.ADD_ASSIGN and self.at.typeOfNode[ctx] == String):
+                if ctx.bop:
+                    self.line(target + ' ' + ctx.bop.text + ' ' + self.visitExpression(ctx.expression(1)))
+                else:
+                    op = ctx.postfix if ctx.postfix else ctx.prefix
+                    self.line(target + (' += 1' if op.type == PlayScriptParser.INC else ' -= 1'))
+            elif lvalue[0] == 'var' or lvalue[1] == 'self':
+                self.line(target + ' = ' + self.updatedValue(ctx, target))
+            else:
+                # 对象的表达式只能计算一次
+                self.line(self.updateCall(ctx, lvalue, False))
+            return
+        if ctx.functionCall() and ctx.functionCall().IDENTIFIER() and ctx.functionCall().IDENTIFIER().getText() == 'println':
+            args = self.visitArguments(ctx.functionCall())
+            for arg in args[:-1]:
+                self.line(arg)
+            self.line('print(' + (args[-1] if args else '') + ')')
+            return
+        self.line(self.visitExpression(ctx))
+
+    # 语句作为 if、while 等的子语句，生成一个缩进的代码块
+    def statementBlock(self, ctx:PlayScriptParser.StatementContext):
+        self.indent += 1
+        count = len(self.lines)
+        self.visitStatement(ctx)
+        if len(self.lines) == count:
+            self.line('pass')
+        self.indent -= 1
+
+    def visitStatement(self, ctx:PlayScriptParser.StatementContext):
+        if ctx.statementExpression:
+            self.expressionStatement(ctx.statementExpression)
+        elif ctx.IF():
+            self.line('if ' + self.visitExpression(ctx.parExpression().expression()) + ':')
+            self.statementBlock(ctx.statement(0))
+            other = ctx.statement(1) if ctx.ELSE() else None
+            while other is not None and other.IF():
+                self.line('elif ' + self.visitExpression(other.parExpression().expression()) + ':')
+                self.statementBlock(other.statement(0))
+                other = other.statement(1) if other.ELSE() else None
+            if other is not None:
+                self.line('else:')
+                self.statementBlock(other)
+        elif ctx.WHILE():
+            self.line('while ' + self.visitExpression(ctx.parExpression().expression()) + ':')
+            self.context.loops.append(None)
+            self.statementBlock(ctx.statement(0))
+            self.context.loops.pop()
+        elif ctx.FOR():
+            forControl:PlayScriptParser.ForControlContext = ctx.forControl()
+            if forControl.enhancedForControl():
+                # 跟 ASTEvaluator 一样，还不支持 enhanced for，不生成代码（statementBlock 会补上 pass）
+                return
+            if self.rangeFor(ctx):
+                return
+            if forControl.forInit():
+                forInit:PlayScriptParser.ForInitContext = forControl.forInit()
+                if forInit.variableDeclarators():
+                    self.visitVariableDeclarators(forInit.variableDeclarators())
+                else:
+                    for exp in forInit.expressionList().expression():
+                        self.expressionStatement(exp)
+            # 如果没有条件判断部分，意味着一直循环
+            condition = 'True'
+            if forControl.expression():
+                condition = self.visitExpression(forControl.expression())
+            # continue 之前要先执行更新部分，把它生成一次备用
+            update = []
+            if forControl.forUpdate:
+                saved = (self.lines, self.indent)
+                self.lines, self.indent = update, 0
+                for exp in forControl.forUpdate.expression():
+                    self.expressionStatement(exp)
+                self.lines, self.indent = saved
+            self.line('while ' + condition + ':')
+            self.context.loops.append(update)
+            self.statementBlock(ctx.statement(0))
+            self.context.loops.pop()
+            for text in update:
+                self.line('    ' + text)
+        elif ctx.blockLabel:
+            self.visitBlock(ctx.blockLabel)
+        elif ctx.BREAK():
+            self.line('break')
+        elif ctx.CONTINUE():
+            update = self.context.loops[-1] if self.context.loops else None
+            if update:
+                for text in update:
+                    self.line(text)
+            self.line('continue')
+        elif ctx.RETURN():
+            if self.context.isConstructor:
+                self.line('return self')
+            elif ctx.expression():
+                self.line('return ' + self.visitExpression(ctx.expression()))
+            else:
+                self.line('return')
+
+    '''
+     * 把最常见的计数循环 for (int i = a; i < b; i++) 翻译成 Python 的 for i in range(a, b)。
+     * 条件：循环体里不修改 i 和 b，i 不被闭包引用，b 是字面量或者在循环期间不会被别处修改的变量。
+     * b 是变量时取整，因为 int 变量里可能存着浮点数。
+    '''
+    def rangeFor(self, ctx:PlayScriptParser.StatementContext) -> bool:
+        forControl:PlayScriptParser.ForControlContext = ctx.forControl()
+        forInit = forControl.forInit()
+        if forInit is None or forInit.variableDeclarators() is None or forControl.expression() is None or forControl.forUpdate is None:
+            return False
+        declarators = forInit.variableDeclarators().variableDeclarator()
+        if len(declarators) != 1 or declarators[0].variableInitializer() is None:
+            return False
+        variable:Variable = self.at.symbolOfNode[declarators[0].variableDeclaratorId()]
+        start:PlayScriptParser.ExpressionContext = declarators[0].variableInitializer().expression()
+        if variable.type != Integer or start is None or self.at.typeOfNode.get(start) != Integer or '/' in start.getText():
+            return False
+
+        # 条件：i < b 或 i <= b
+        condition:PlayScriptParser.ExpressionContext = forControl.expression()
+        if condition.bop is None or condition.bop.type not in (PlayScriptParser.LT, PlayScriptParser.LE):
+            return False
+        if self.lvalueVariable(condition.expression(0)) is not variable or condition.expression(0).primary() is None:
+            return False
+        bound:PlayScriptParser.ExpressionContext = condition.expression(1)
+        if self.at.typeOfNode.get(bound) != Integer:
+            return False
+
+        # 更新：i++、++i、i += 1、i = i + 1
+        updates = forControl.forUpdate.expression()
+        if len(updates) != 1:
+            return False
+        update:PlayScriptParser.ExpressionContext = updates[0]
+        text = update.getText()
+        name = variable.name
+        if text not in (name + '++', '++' + name, name + '+=1', name + '=' + name + '+1'):
+            return False
+        if not self.isUpdate(update) or self.lvalueVariable(update.expression(0)) is not variable:
+            return False
+
+        assigned = self.variablesAssignedUnder(ctx.statement(0), set())
+        if variable in assigned or variable in self.captured or not self.assignedIn.get(variable, set()) <= {self.context.unit}:
+            return False
+        boundPrimary = bound.primary()
+        if boundPrimary is None:
+            return False
+        if boundPrimary.literal():
+            if not boundPrimary.literal().integerLiteral():
+                return False
+        else:
+            boundVar = self.lvalueVariable(bound)
+            if boundVar is None or boundVar in assigned:
+                return False
+            if not self.assignedIn.get(boundVar, set()) <= {boundVar.enclosingScope.unit}:
+                return False
+
+        limit = self.visitExpression(bound)
+        # int 变量里可能存的是除法得到的浮点数（比如 int h = 7 / 2），其他引擎比较时相当于取整
+        if not boundPrimary.literal():
+            limit = 'int(' + limit + ')'
+        if condition.bop.type == PlayScriptParser.LE:
+            limit = limit + ' + 1'
+        self.line('for ' + self.storeVariable(variable) + ' in range(' + self.visitExpression(start) + ', ' + limit + '):')
+        self.context.loops.append(None)
+        self.statementBlock(ctx.statement(0))
+        self.context.loops.pop()
+        return True
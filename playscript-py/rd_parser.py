@@ -0,0 +1,747 @@
+import sys
+import time
+from typing import List
+
+from antlr4 import *
+
+from PlayScriptParser import *
+from regex_lexer import *
+from antlr4.tree.Tree import TerminalNodeImpl
+
+
+# 语法错误。遇到它时，由调用者改用 ANTLR 生成的 PlayScriptParser 重新解析，由它来报告错误
+class ParseError(Exception):
+    pass
+
+
+PRIMITIVE_TYPES = {PlayScriptParser.BOOLEAN, PlayScriptParser.INT, PlayScriptParser.FLOAT, PlayScriptParser.STRING}
+MODIFIERS = {PlayScriptParser.CONST, PlayScriptParser.STATIC}
+LITERALS = {PlayScriptParser.DECIMAL_LITERAL, PlayScriptParser.HEX_LITERAL, PlayScriptParser.FLOAT_LITERAL, PlayScriptParser.STRING_LITERAL, PlayScriptParser.BOOL_LITERAL, PlayScriptParser.NULL_LITERAL}
+PREFIX_OPERATORS = {PlayScriptParser.ADD, PlayScriptParser.SUB, PlayScriptParser.INC, PlayScriptParser.DEC}
+
+# expression 规则里，跟在一个表达式后面的运算符的优先级，跟 PlayScriptParser.expression() 里 precpred() 的参数一致。
+# 数字越大优先级越高，只有不低于当前优先级的运算符才能接到当前的表达式上。
+SUFFIX_PRECEDENCE = {
+    PlayScriptParser.DOT: 15,
+    PlayScriptParser.LBRACK: 14,
+    PlayScriptParser.INC: 12, PlayScriptParser.DEC: 12,
+    PlayScriptParser.MUL: 9, PlayScriptParser.DIV: 9, PlayScriptParser.MOD: 9,
+    PlayScriptParser.ADD: 8, PlayScriptParser.SUB: 8,
+    PlayScriptParser.LE: 7, PlayScriptParser.GE: 7, PlayScriptParser.GT: 7, PlayScriptParser.LT: 7,
+    PlayScriptParser.INSTANCEOF: 6,
+    PlayScriptParser.EQUAL: 5, PlayScriptParser.NOTEQUAL: 5,
+    PlayScriptParser.AND: 4,
+    PlayScriptParser.OR: 3,
+    PlayScriptParser.QUESTION: 2,
+    PlayScriptParser.ASSIGN: 1, PlayScriptParser.ADD_ASSIGN: 1, PlayScriptParser.SUB_ASSIGN: 1, PlayScriptParser.MUL_ASSIGN: 1, PlayScriptParser.DIV_ASSIGN: 1, PlayScriptParser.MOD_ASSIGN: 1,
+}
+
+
+'''
+ * 手写的递归下降语法分析器，代替 ANTLR 生成的 PlayScriptParser。
+ * 它对每个规则都用一两个 Token 的向前看来选择分支，不需要 ANTLR 运行时的自适应预测（adaptivePredict），快很多。
+ * expression 规则用优先级爬升（precedence climbing）来解析，优先级跟 ANTLR 对左递归规则的改写完全一样。
+ *
+ * 生成的树跟 PlayScriptParser 生成的完全一样：同样的 XxxContext 类、同样的子节点、start/stop 以及
+ * bop、prefix 等标签，所以语义分析和各个执行引擎都不用改。
+ * 只处理正确的程序。遇到语法错误就抛出 ParseError，由调用者改用 PlayScriptParser，错误信息跟原来一致。
+'''
+class RecursiveDescentParser():
+    def __init__(self, token_stream:CommonTokenStream):
+        token_stream.fill()
+        # 只看缺省 channel 上的 Token，跟 PlayScriptParser 一样
+        self.tokens = [token for token in token_stream.tokens if token.channel == Token.DEFAULT_CHANNEL]
+        self.pos = 0
+
+    ############################################################
+    # Token 操作
+
+    def la(self, i:int=0) -> int:
+        pos = self.pos + i
+        if pos < len(self.tokens):
+            return self.tokens[pos].type
+        return Token.EOF
+
+    # 上一个 Token，相当于 PlayScriptParser 里的 LT(-1)
+    def previous(self) -> Token:
+        return self.tokens[self.pos - 1] if self.pos > 0 else None
+
+    def match(self, ctx:ParserRuleContext, type:int) -> Token:
+        token = self.tokens[self.pos]
+        if token.type != type:
+            raise ParseError(token)
+        self.pos += 1
+        RecursiveDescentParser.addTokenNode(ctx, token)
+        return token
+
+    def consume(self, ctx:ParserRuleContext) -> Token:
+        token = self.tokens[self.pos]
+        if token.type == Token.EOF:
+            raise ParseError(token)
+        self.pos += 1
+        RecursiveDescentParser.addTokenNode(ctx, token)
+        return token
+
+    # 跟 ParserRuleContext.addTokenNode() 一样，少调用几层函数
+    def addTokenNode(ctx:ParserRuleContext, token:Token):
+        node = TerminalNodeImpl(token)
+        node.parentCtx = ctx
+        if ctx.children is None:
+            ctx.children = [node]
+        else:
+            ctx.children.append(node)
+
+    # 开始一个规则，相当于 Parser.enterRule()
+    def enter(self, contextClass, parent:ParserRuleContext) -> ParserRuleContext:
+        ctx = contextClass(None, parent)
+        ctx.start = self.tokens[self.pos]
+        return ctx
+
+    # 结束一个规则，加到上级节点里，相当于 Parser.exitRule()
+    def exit(self, ctx:ParserRuleContext) -> ParserRuleContext:
+        ctx.stop = self.tokens[self.pos - 1] if self.pos > 0 else None
+        parent = ctx.parentCtx
+        if parent is not None:
+            if parent.children is None:
+                parent.children = [ctx]
+            else:
+                parent.children.append(ctx)
+        return ctx
+
+    ############################################################
+    # 向前看，选择分支
+
+    # 从位置 i 开始跳过一个 typeType，返回它后面的位置。不是 typeType 就返回 -1
+    def skipType(self, i:int) -> int:
+        type = self.la(i)
+        if type == PlayScriptParser.IDENTIFIER:
+            i += 1
+            while self.la(i) == PlayScriptParser.DOT and self.la(i + 1) == PlayScriptParser.IDENTIFIER:
+                i += 2
+        elif type in PRIMITIVE_TYPES:
+            i += 1
+        elif type == PlayScriptParser.FUNCTION:
+            i += 1
+            if self.la(i) == PlayScriptParser.VOID:
+                i += 1
+            else:
+                i = self.skipType(i)
+                if i < 0:
+                    return -1
+            if self.la(i) != PlayScriptParser.LPAREN:
+                return -1
+            i += 1
+            if self.la(i) != PlayScriptParser.RPAREN:
+                i = self.skipType(i)
+                while i >= 0 and self.la(i) == PlayScriptParser.COMMA:
+                    i = self.skipType(i + 1)
+                if i < 0 or self.la(i) != PlayScriptParser.RPAREN:
+                    return -1
+            i += 1
+        else:
+            return -1
+        while self.la(i) == PlayScriptParser.LBRACK and self.la(i + 1) == PlayScriptParser.RBRACK:
+            i += 2
+        return i
+
+    # 从当前位置开始，是不是 variableModifier* typeType IDENTIFIER，即一个变量（或函数）声明的开头。
+    # 返回 IDENTIFIER 的位置，不是就返回 -1
+    def declarationName(self) -> int:
+        i = 0
+        while self.la(i) in MODIFIERS:
+            i += 1
+        i = self.skipType(i)
+        if i >= 0 and self.la(i) == PlayScriptParser.IDENTIFIER:
+            return i
+        return -1
+
+    ############################################################
+    # 类和函数
+
+    def prog(self) -> ParserRuleContext:
+        ctx = self.enter(PlayScriptParser.ProgContext, None)
+        self.blockStatements(ctx)
+        if self.la() != Token.EOF:
+            raise ParseError(self.tokens[self.pos])
+        return self.exit(ctx)
+
+    def classDeclaration(self, parent):
+        ctx = self.enter(PlayScriptParser.ClassDeclarationContext, parent)
+        self.match(ctx, PlayScriptParser.CLASS)
+        self.match(ctx, PlayScriptParser.IDENTIFIER)
+        if self.la() == PlayScriptParser.EXTENDS:
+            self.consume(ctx)
+            self.typeType(ctx)
+        self.classBody(ctx)
+        return self.exit(ctx)
+
+    def classBody(self, parent):
+        ctx = self.enter(PlayScriptParser.ClassBodyContext, parent)
+        self.match(ctx, PlayScriptParser.LBRACE)
+        while self.la() != PlayScriptParser.RBRACE:
+            self.classBodyDeclaration(ctx)
+        self.consume(ctx)
+        return self.exit(ctx)
+
+    def classBodyDeclaration(self, parent):
+        ctx = self.enter(PlayScriptParser.ClassBodyDeclarationContext, parent)
+        if self.la() == PlayScriptParser.SEMI:
+            self.consume(ctx)
+        else:
+            self.memberDeclaration(ctx)
+        return self.exit(ctx)
+
+    def memberDeclaration(self, parent):
+        ctx = self.enter(PlayScriptParser.MemberDeclarationContext, parent)
+        type = self.la()
+        if type == PlayScriptParser.CLASS:
+            self.classDeclaration(ctx)
+        elif self.isFunctionDeclaration():
+            self.functionDeclaration(ctx)
+        else:
+            self.fieldDeclaration(ctx)
+        return self.exit(ctx)
+
+    # 当前位置是不是 typeTypeOrVoid? IDENTIFIER '('
+    def isFunctionDeclaration(self) -> bool:
+        type = self.la()
+        if type == PlayScriptParser.VOID:
+            return True
+        if type == PlayScriptParser.IDENTIFIER and self.la(1) == PlayScriptParser.LPAREN:
+            return True
+        i = self.skipType(0)
+        return i >= 0 and self.la(i) == PlayScriptParser.IDENTIFIER and self.la(i + 1) == PlayScriptParser.LPAREN
+
+    def functionDeclaration(self, parent):
+        ctx = self.enter(PlayScriptParser.FunctionDeclarationContext, parent)
+        if not (self.la() == PlayScriptParser.IDENTIFIER and self.la(1) == PlayScriptParser.LPAREN):
+            self.typeTypeOrVoid(ctx)
+        self.match(ctx, PlayScriptParser.IDENTIFIER)
+        self.formalParameters(ctx)
+        self.functionBody(ctx)
+        return self.exit(ctx)
+
+    def functionBody(self, parent):
+        ctx = self.enter(PlayScriptParser.FunctionBodyContext, parent)
+        if self.la() == PlayScriptParser.SEMI:
+            self.consume(ctx)
+        else:
+            self.block(ctx)
+        return self.exit(ctx)
+
+    def typeTypeOrVoid(self, parent):
+        ctx = self.enter(PlayScriptParser.TypeTypeOrVoidContext, parent)
+        if self.la() == PlayScriptParser.VOID:
+            self.consume(ctx)
+        else:
+            self.typeType(ctx)
+        return self.exit(ctx)
+
+    def formalParameters(self, parent):
+        ctx = self.enter(PlayScriptParser.FormalParametersContext, parent)
+        self.match(ctx, PlayScriptParser.LPAREN)
+        if self.la() != PlayScriptParser.RPAREN:
+            self.formalParameterList(ctx)
+        self.match(ctx, PlayScriptParser.RPAREN)
+        return self.exit(ctx)
+
+    def formalParameterList(self, parent):
+        ctx = self.enter(PlayScriptParser.FormalParameterListContext, parent)
+        self.formalParameter(ctx)
+        while self.la() == PlayScriptParser.COMMA:
+            self.consume(ctx)
+            self.formalParameter(ctx)
+        return self.exit(ctx)
+
+    def formalParameter(self, parent):
+        ctx = self.enter(PlayScriptParser.FormalParameterContext, parent)
+        while self.la() in MODIFIERS:
+            self.variableModifier(ctx)
+        self.typeType(ctx)
+        self.variableDeclaratorId(ctx)
+        return self.exit(ctx)
+
+    def variableModifier(self, parent):
+        ctx = self.enter(PlayScriptParser.VariableModifierContext, parent)
+        self.consume(ctx)
+        return self.exit(ctx)
+
+    def fieldDeclaration(self, parent):
+        ctx = self.enter(PlayScriptParser.FieldDeclarationContext, parent)
+        self.variableDeclarators(ctx)
+        self.match(ctx, PlayScriptParser.SEMI)
+        return self.exit(ctx)
+
+    def variableDeclarators(self, parent):
+        ctx = self.enter(PlayScriptParser.VariableDeclaratorsContext, parent)
+        while self.la() in MODIFIERS:
+            self.variableModifier(ctx)
+        self.typeType(ctx)
+        self.variableDeclarator(ctx)
+        while self.la() == PlayScriptParser.COMMA:
+            self.consume(ctx)
+            self.variableDeclarator(ctx)
+        return self.exit(ctx)
+
+    def variableDeclarator(self, parent):
+        ctx = self.enter(PlayScriptParser.VariableDeclaratorContext, parent)
+        self.variableDeclaratorId(ctx)
+        if self.la() == PlayScriptParser.ASSIGN:
+            self.consume(ctx)
+            self.variableInitializer(ctx)
+        return self.exit(ctx)
+
+    def variableDeclaratorId(self, parent):
+        ctx = self.enter(PlayScriptParser.VariableDeclaratorIdContext, parent)
+        self.match(ctx, PlayScriptParser.IDENTIFIER)
+        return self.exit(ctx)
+
+    def variableInitializer(self, parent):
+        ctx = self.enter(PlayScriptParser.VariableInitializerContext, parent)
+        if self.la() == PlayScriptParser.LBRACE:
+            self.arrayInitializer(ctx)
+        else:
+            self.expression(ctx)
+        return self.exit(ctx)
+
+    def arrayInitializer(self, parent):
+        ctx = self.enter(PlayScriptParser.ArrayInitializerContext, parent)
+        self.match(ctx, PlayScriptParser.LBRACE)
+        if self.la() != PlayScriptParser.RBRACE:
+            self.variableInitializer(ctx)
+            while self.la() == PlayScriptParser.COMMA:
+                self.consume(ctx)
+                if self.la() == PlayScriptParser.RBRACE:
+                    break
+                self.variableInitializer(ctx)
+        self.match(ctx, PlayScriptParser.RBRACE)
+        return self.exit(ctx)
+
+    ############################################################
+    # 类型
+
+    # inExpression：是不是 instanceof 后面的类型
+    def typeType(self, parent, inExpression:bool=False):
+        ctx = self.enter(PlayScriptParser.TypeTypeContext, parent)
+        type = self.la()
+        if type == PlayScriptParser.IDENTIFIER:
+            self.classType(ctx, inExpression)
+        elif type == PlayScriptParser.FUNCTION:
+            self.functionType(ctx)
+        elif type in PRIMITIVE_TYPES:
+            self.primitiveType(ctx)
+        else:
+            raise ParseError(self.tokens[self.pos])
+        while self.la() == PlayScriptParser.LBRACK and self.la(1) == PlayScriptParser.RBRACK:
+            self.consume(ctx)
+            self.consume(ctx)
+        return self.exit(ctx)
+
+    # 在表达式里（x instanceof A.f()），'.' IDENTIFIER '(' 是对 instanceof 的结果调用方法，不属于类型
+    def classType(self, parent, inExpression:bool=False):
+        ctx = self.enter(PlayScriptParser.ClassTypeContext, parent)
+        self.match(ctx, PlayScriptParser.IDENTIFIER)
+        while self.la() == PlayScriptParser.DOT and self.la(1) == PlayScriptParser.IDENTIFIER and not (inExpression and self.la(2) == PlayScriptParser.LPAREN):
+            self.consume(ctx)
+            self.consume(ctx)
+        return self.exit(ctx)
+
+    def functionType(self, parent):
+        ctx = self.enter(PlayScriptParser.FunctionTypeContext, parent)
+        self.match(ctx, PlayScriptParser.FUNCTION)
+        self.typeTypeOrVoid(ctx)
+        self.match(ctx, PlayScriptParser.LPAREN)
+        if self.la() != PlayScriptParser.RPAREN:
+            self.typeList(ctx)
+        self.match(ctx, PlayScriptParser.RPAREN)
+        return self.exit(ctx)
+
+    def typeList(self, parent):
+        ctx = self.enter(PlayScriptParser.TypeListContext, parent)
+        self.typeType(ctx)
+        while self.la() == PlayScriptParser.COMMA:
+            self.consume(ctx)
+            self.typeType(ctx)
+        return self.exit(ctx)
+
+    def primitiveType(self, parent):
+        ctx = self.enter(PlayScriptParser.PrimitiveTypeContext, parent)
+        self.consume(ctx)
+        return self.exit(ctx)
+
+    ############################################################
+    # 语句
+
+    def block(self, parent):
+        ctx = self.enter(PlayScriptParser.BlockContext, parent)
+        self.match(ctx, PlayScriptParser.LBRACE)
+        self.blockStatements(ctx)
+        self.match(ctx, PlayScriptParser.RBRACE)
+        return self.exit(ctx)
+
+    def blockStatements(self, parent):
+        ctx = self.enter(PlayScriptParser.BlockStatementsContext, parent)
+        while True:
+            type = self.la()
+            if type == PlayScriptParser.RBRACE or type == Token.EOF:
+                break
+            self.blockStatement(ctx)
+        return self.exit(ctx)
+
+    '''
+     * blockStatement 的几个分支，按 PlayScriptParser 的方式选择：
+     * 1.以 typeType IDENTIFIER 开头的，后面是 '(' 就是函数声明，否则是变量声明；
+     * 2.以 IDENTIFIER '(' 开头的，既可能是函数调用语句，也可能是没有返回值类型的函数声明。
+     *   ANTLR 遇到二义性时选排在前面的分支，所以能解析成语句就是语句，否则才是函数声明。
+    '''
+    def blockStatement(self, parent):
+        ctx = self.enter(PlayScriptParser.BlockStatementContext, parent)
+        type = self.la()
+        if type == PlayScriptParser.CLASS:
+            self.classDeclaration(ctx)
+        elif type == PlayScriptParser.VOID:
+            self.functionDeclaration(ctx)
+        elif type == PlayScriptParser.IDENTIFIER and self.la(1) == PlayScriptParser.LPAREN:
+            pos = self.pos
+            try:
+                self.statement(ctx)
+            except ParseError:
+                self.pos = pos
+                ctx.children = None
+                self.functionDeclaration(ctx)
+        else:
+            i = self.declarationName()
+            if i < 0:
+                self.statement(ctx)
+            elif self.la(i + 1) == PlayScriptParser.LPAREN:
+                self.functionDeclaration(ctx)
+            else:
+                self.variableDeclarators(ctx)
+                self.match(ctx, PlayScriptParser.SEMI)
+        return self.exit(ctx)
+
+    def statement(self, parent):
+        ctx = self.enter(PlayScriptParser.StatementContext, parent)
+        type = self.la()
+        if type == PlayScriptParser.LBRACE:
+            ctx.blockLabel = self.block(ctx)
+        elif type == PlayScriptParser.IF:
+            self.consume(ctx)
+            self.parExpression(ctx)
+            self.statement(ctx)
+            # else 跟最近的 if 配对
+            if self.la() == PlayScriptParser.ELSE:
+                self.consume(ctx)
+                self.statement(ctx)
+        elif type == PlayScriptParser.FOR:
+            self.consume(ctx)
+            self.match(ctx, PlayScriptParser.LPAREN)
+            self.forControl(ctx)
+            self.match(ctx, PlayScriptParser.RPAREN)
+            self.statement(ctx)
+        elif type == PlayScriptParser.WHILE:
+            self.consume(ctx)
+            self.parExpression(ctx)
+            self.statement(ctx)
+        elif type == PlayScriptParser.RETURN:
+            self.consume(ctx)
+            if self.la() != PlayScriptParser.SEMI:
+                self.expression(ctx)
+            self.match(ctx, PlayScriptParser.SEMI)
+        elif type == PlayScriptParser.BREAK or type == PlayScriptParser.CONTINUE:
+            self.consume(ctx)
+            self.match(ctx, PlayScriptParser.SEMI)
+        elif type == PlayScriptParser.SEMI:
+            self.consume(ctx)
+        else:
+            ctx.statementExpression = self.expression(ctx)
+            self.match(ctx, PlayScriptParser.SEMI)
+        return self.exit(ctx)
+
+    def forControl(self, parent):
+        ctx = self.enter(PlayScriptParser.ForControlContext, parent)
+        i = self.declarationName()
+        if i >= 0 and self.la(i + 1) == PlayScriptParser.COLON:
+            self.enhancedForControl(ctx)
+        else:
+            if self.la() != PlayScriptParser.SEMI:
+                self.forInit(ctx, i >= 0)
+            self.match(ctx, PlayScriptParser.SEMI)
+            if self.la() != PlayScriptParser.SEMI:
+                self.expression(ctx)
+            self.match(ctx, PlayScriptParser.SEMI)
+            if self.la() != PlayScriptParser.RPAREN:
+                ctx.forUpdate = self.expressionList(ctx)
+        return self.exit(ctx)
+
+    def forInit(self, parent, isDeclaration:bool):
+        ctx = self.enter(PlayScriptParser.ForInitContext, parent)
+        if isDeclaration:
+            self.variableDeclarators(ctx)
+        else:
+            self.expressionList(ctx)
+        return self.exit(ctx)
+
+    def enhancedForControl(self, parent):
+        ctx = self.enter(PlayScriptParser.EnhancedForControlContext, parent)
+        while self.la() in MODIFIERS:
+            self.variableModifier(ctx)
+        self.typeType(ctx)
+        self.variableDeclaratorId(ctx)
+        self.match(ctx, PlayScriptParser.COLON)
+        self.expression(ctx)
+        return self.exit(ctx)
+
+    ############################################################
+    # 表达式
+
+    def parExpression(self, parent):
+        ctx = self.enter(PlayScriptParser.ParExpressionContext, parent)
+        self.match(ctx, PlayScriptParser.LPAREN)
+        self.expression(ctx)
+        self.match(ctx, PlayScriptParser.RPAREN)
+        return self.exit(ctx)
+
+    def expressionList(self, parent):
+        ctx = self.enter(PlayScriptParser.ExpressionListContext, parent)
+        self.expression(ctx)
+        while self.la() == PlayScriptParser.COMMA:
+            self.consume(ctx)
+            self.expression(ctx)
+        return self.exit(ctx)
+
+    def functionCall(self, parent):
+        ctx = self.enter(PlayScriptParser.FunctionCallContext, parent)
+        self.consume(ctx)  # IDENTIFIER、THIS 或 SUPER
+        self.match(ctx, PlayScriptParser.LPAREN)
+        if self.la() != PlayScriptParser.RPAREN:
+            self.expressionList(ctx)
+        self.match(ctx, PlayScriptParser.RPAREN)
+        return self.exit(ctx)
+
+    def isFunctionCall(self) -> bool:
+        type = self.la()
+        return (type == PlayScriptParser.IDENTIFIER or type == PlayScriptParser.THIS or type == PlayScriptParser.SUPER) and self.la(1) == PlayScriptParser.LPAREN
+
+    '''
+     * 优先级爬升。precedence 是当前允许的最低优先级，跟 PlayScriptParser.expression(_p) 的参数一样。
+     * 先解析一个不含二元运算的表达式，然后只要后面的运算符优先级不低于 precedence，就把已有的表达式作为左边的子节点，
+     * 生成一个新的 ExpressionContext。左结合的运算符，右边用更高一级的优先级解析；赋值是右结合的，用同一级。
+    '''
+    def expression(self, parent, precedence:int=0):
+        ctx = self.enter(PlayScriptParser.ExpressionContext, parent)
+        type = self.la()
+        if type in PREFIX_OPERATORS:
+            ctx.prefix = self.consume(ctx)
+            self.expression(ctx, 11)
+        elif type == PlayScriptParser.BANG:
+            ctx.prefix = self.consume(ctx)
+            self.expression(ctx, 10)
+        elif self.isFunctionCall():
+            self.functionCall(ctx)
+        else:
+            self.primary(ctx)
+
+        while True:
+            type = self.la()
+            level = SUFFIX_PRECEDENCE.get(type)
+            if level is None or level < precedence:
+                break
+            ctx.stop = self.previous()
+            left = ctx
+            ctx = PlayScriptParser.ExpressionContext(None, parent)
+            ctx.start = left.start
+            left.parentCtx = ctx
+            ctx.addChild(left)
+            if type == PlayScriptParser.DOT:
+                ctx.bop = self.consume(ctx)
+                if self.isFunctionCall():
+                    self.functionCall(ctx)
+                else:
+                    self.match(ctx, PlayScriptParser.IDENTIFIER)
+            elif type == PlayScriptParser.LBRACK:
+                self.consume(ctx)
+                self.expression(ctx)
+                self.match(ctx, PlayScriptParser.RBRACK)
+            elif type == PlayScriptParser.INC or type == PlayScriptParser.DEC:
+                ctx.postfix = self.consume(ctx)
+            elif type == PlayScriptParser.INSTANCEOF:
+                ctx.bop = self.consume(ctx)
+                self.typeType(ctx, True)
+            elif type == PlayScriptParser.QUESTION:
+                ctx.bop = self.consume(ctx)
+                self.expression(ctx)
+                self.match(ctx, PlayScriptParser.COLON)
+                self.expression(ctx, 3)
+            elif level == 1:
+                # 赋值，右结合
+                ctx.bop = self.consume(ctx)
+                self.expression(ctx, 1)
+            else:
+                ctx.bop = self.consume(ctx)
+                self.expression(ctx, level + 1)
+        return self.exit(ctx)
+
+    def primary(self, parent):
+        ctx = self.enter(PlayScriptParser.PrimaryContext, parent)
+        type = self.la()
+        if type == PlayScriptParser.LPAREN:
+            self.consume(ctx)
+            self.expression(ctx)
+            self.match(ctx, PlayScriptParser.RPAREN)
+        elif type == PlayScriptParser.THIS or type == PlayScriptParser.SUPER or type == PlayScriptParser.IDENTIFIER:
+            self.consume(ctx)
+        elif type in LITERALS:
+            self.literal(ctx)
+        else:
+            raise ParseError(self.tokens[self.pos])
+        return self.exit(ctx)
+
+    def literal(self, parent):
+        ctx = self.enter(PlayScriptParser.LiteralContext, parent)
+        type = self.la()
+        if type == PlayScriptParser.DECIMAL_LITERAL or type == PlayScriptParser.HEX_LITERAL:
+            self.integerLiteral(ctx)
+        elif type == PlayScriptParser.FLOAT_LITERAL:
+            self.floatLiteral(ctx)
+        else:
+            self.consume(ctx)
+        return self.exit(ctx)
+
+    def integerLiteral(self, parent):
+        ctx = self.enter(PlayScriptParser.IntegerLiteralContext, parent)
+        self.consume(ctx)
+        return self.exit(ctx)
+
+    def floatLiteral(self, parent):
+        ctx = self.enter(PlayScriptParser.FloatLiteralContext, parent)
+        self.consume(ctx)
+        return self.exit(ctx)
+
+
+'''
+ * 用 PlayScriptParser 解析，用来跟 RecursiveDescentParser 比较。
+ * 返回树，以及是否解析成功。prog 规则后面没有EOF，PlayScriptParser 遇到解析不了的 Token 会不报错就停下来，这也算失败
+'''
+def antlrParse(text:str):
+    from PlayScriptLexer import PlayScriptLexer
+    parser = PlayScriptParser(CommonTokenStream(PlayScriptLexer(InputStream(text))))
+    parser.removeErrorListeners()
+    tree = parser.prog()
+    return tree, parser.getNumberOfSyntaxErrors() == 0 and parser.getCurrentToken().type == Token.EOF
+
+
+def tokenIndex(token:Token):
+    return token.tokenIndex if token is not None else None
+
+
+# 比较两棵树，返回第一个不同之处的描述，完全一样就返回None
+def compareTrees(a, b):
+    stack = [(a, b)]
+    while stack:
+        x, y = stack.pop()
+        if type(x) is not type(y):
+            return '%s vs %s' % (type(x).__name__, type(y).__name__)
+        if isinstance(x, TerminalNode):
+            if x.symbol.tokenIndex != y.symbol.tokenIndex:
+                return 'token %s vs %s' % (x.symbol, y.symbol)
+            continue
+        where = '%s at line %d' % (type(x).__name__, y.start.line)
+        if tokenIndex(x.start) != tokenIndex(y.start) or tokenIndex(x.stop) != tokenIndex(y.stop):
+            return where + ': start/stop differ'
+        for label in ('bop', 'prefix', 'postfix'):
+            if tokenIndex(getattr(x, label, None)) != tokenIndex(getattr(y, label, None)):
+                return where + ': ' + label + ' differs'
+        for label in ('blockLabel', 'statementExpression', 'forUpdate'):
+            if (getattr(x, label, None) is None) != (getattr(y, label, None) is None):
+                return where + ': ' + label + ' differs'
+        xs = x.children or []
+        ys = y.children or []
+        if len(xs) != len(ys):
+            return where + ': %d vs %d children' % (len(xs), len(ys))
+        for cx, cy in zip(xs, ys):
+            if cx.parentCtx is not x:
+                return where + ': wrong parent'
+            stack.append((cx, cy))
+    return None
+
+
+'''
+ * 差分检查：对每个文件，RecursiveDescentParser 要么生成跟 PlayScriptParser 完全一样的树，要么两者都解析失败
+'''
+def check(paths:List[str]) -> bool:
+    from PlayScriptLexer import PlayScriptLexer
+    ok = True
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as fin:
+            text = fin.read()
+        expected, valid = antlrParse(text)
+        try:
+            tree = RecursiveDescentParser(CommonTokenStream(PlayScriptLexer(InputStream(text)))).prog()
+        except ParseError as e:
+            if valid:
+                print('FAIL %s: RecursiveDescentParser gave up at %s' % (path, e.args[0]))
+                ok = False
+            continue
+        if not valid:
+            print('FAIL %s: PlayScriptParser failed to parse it' % path)
+            ok = False
+            continue
+        diff = compareTrees(tree, expected)
+        if diff:
+            print('FAIL %s: %s' % (path, diff))
+            ok = False
+    print('%d files, %s' % (len(paths), 'all the same' if ok else 'FAILED'))
+    return ok
+
+
+'''
+ * 性能测试：比较两种语法分析器解析同样的 Token 花的时间
+'''
+def benchmark(paths:List[str], size:int):
+    text = ''
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as fin:
+            text += fin.read() + '\n'
+    text = text * (size // max(len(text), 1) + 1)
+    lexer = RegexLexer(text)
+    lexer.tokenize()
+    tokens = lexer.tokens
+    print('input: %d chars, %d tokens' % (len(text), len(tokens)))
+
+    def tokenStream():
+        lexer.index = 0
+        stream = CommonTokenStream(lexer)
+        stream.fill()
+        return stream
+
+    stream = tokenStream()
+    start = time.perf_counter()
+    RecursiveDescentParser(stream).prog()
+    print('%-24s %8.3f s' % ('RecursiveDescentParser', time.perf_counter() - start))
+    for mode in (PredictionMode.SLL, PredictionMode.LL):
+        stream = tokenStream()
+        parser = PlayScriptParser(stream)
+        parser._interp.predictionMode = mode
+        start = time.perf_counter()
+        parser.prog()
+        print('%-24s %8.3f s' % ('PlayScriptParser ' + mode.name, time.perf_counter() - start))
+
+
+# 用法：
+# python rd_parser.py -check <文件或目录...>
+# python rd_parser.py -bench <文件或目录...> [-size 字符数]
+if __name__ == '__main__':
+    sys.setrecursionlimit(100000)
+    args = sys.argv[1:]
+    size = 1024 * 1024
+    if '-size' in args:
+        i = args.index('-size')
+        size = int(args[i + 1])
+        del args[i:i + 2]
+    if args and args[0] == '-check':
+        sys.exit(0 if check(scriptsUnder(args[1:])) else 1)
+    elif args and args[0] == '-bench':
+        benchmark(scriptsUnder(args[1:]), size)
+    else:
+        print('usage: rd_parser.py -check|-bench <files or directories> [-size chars]')
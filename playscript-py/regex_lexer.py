@@ -0,0 +1,223 @@
+import re
+import sys
+import os
+import time
+from typing import List
+
+from antlr4 import *
+
+from PlayScriptParser import *
+from antlr4.Token import CommonToken
+from antlr4.CommonTokenFactory import CommonTokenFactory
+
+
+'''
+ * 用一个编译好的正则表达式做词法分析，代替 ANTLR 生成的 PlayScriptLexer。
+ * 产生的 Token 跟 PlayScriptLexer 完全一样（类型、channel、位置、行号、列号、文本），可以直接交给 CommonTokenStream 和 PlayScriptParser。
+ *
+ * 词法规则来自 PlayScript.g4。ANTLR 的规则是“最长匹配，一样长时取前面的规则”，正则表达式则是按顺序取第一个能匹配的分支，
+ * 所以下面各个分支的顺序是精心排过的：
+ * 1.注释在除号前面；
+ * 2.十六进制数、浮点数在十进制整数前面（0x1f、1.5 都比开头的 0、1 长），浮点数在点号前面（.5）；
+ * 3.多个字符的运算符在单个字符的前面；
+ * 4.关键字跟标识符一样长，先按标识符匹配，再查关键字表。
+ *
+ * 遇到 PlayScriptLexer 会报错的输入（非法字符、没有结束的字符串等），tokenize() 返回 None，
+ * 由调用者改用 PlayScriptLexer，这样错误信息跟原来完全一样。
+'''
+class RegexLexer():
+    # 每个分支对应一个命名的组，组名就是 Token 的类型名。OP 是所有的运算符和分隔符，再按文本查具体的类型
+    PATTERN = re.compile(r'''
+        (?P<WS>[ \t\r\n\f]+)
+      | (?P<COMMENT>/\*.*?\*/)
+      | (?P<LINE_COMMENT>//[^\r\n]*)
+      | (?P<IDENTIFIER>[a-zA-Z$_][a-zA-Z0-9$_]*)
+      | (?P<HEX_LITERAL>0[xX][0-9a-fA-F](?:[0-9a-fA-F_]*[0-9a-fA-F])?)
+      | (?P<FLOAT_LITERAL>(?:[0-9](?:[0-9_]*[0-9])?\.(?:[0-9](?:[0-9_]*[0-9])?)?|\.[0-9](?:[0-9_]*[0-9])?)(?:[eE][+-]?[0-9](?:[0-9_]*[0-9])?)?
+                        |[0-9](?:[0-9_]*[0-9])?[eE][+-]?[0-9](?:[0-9_]*[0-9])?)
+      | (?P<DECIMAL_LITERAL>0|[1-9](?:_+[0-9](?:[0-9_]*[0-9])?|(?:[0-9](?:[0-9_]*[0-9])?)?))
+      | (?P<STRING_LITERAL>"(?:[^"\\\r\n]|\\[btnfr"'\\]|\\u+[0-9a-fA-F]{4})*")
+      | (?P<OP>==|<=|>=|!=|&&|\|\||\+\+|--|\+=|-=|\*=|/=|%=|[(){}\[\];,.=><!?:+\-*/%])
+    ''', re.VERBOSE | re.DOTALL)
+
+    # 组的编号 -> Token 类型
+    GROUP_TYPES = {index: getattr(PlayScriptParser, name, None) for name, index in PATTERN.groupindex.items()}
+    OP_GROUP = PATTERN.groupindex['OP']
+    IDENTIFIER_GROUP = PATTERN.groupindex['IDENTIFIER']
+
+    # 关键字、true/false/null 以及运算符的文本 -> Token 类型。PlayScriptParser.literalNames 是按 Token 类型排列的
+    LITERAL_TYPES = {name[1:-1]: type for type, name in enumerate(PlayScriptParser.literalNames) if name.startswith("'")}
+    LITERAL_TYPES['true'] = PlayScriptParser.BOOL_LITERAL
+    LITERAL_TYPES['false'] = PlayScriptParser.BOOL_LITERAL
+
+    HIDDEN_TYPES = {PlayScriptParser.WS, PlayScriptParser.COMMENT, PlayScriptParser.LINE_COMMENT}
+
+    def __init__(self, text:str):
+        self.text = text
+        self.tokens = None
+        self.index = 0
+        # CommonToken 从 source[0] 上读取行号和列号，跟 ANTLR 的 Lexer 一样
+        self.line = 1
+        self.column = 0
+        self._factory = CommonTokenFactory.DEFAULT
+        self._tokenFactorySourcePair = (self, None)
+
+    def getSourceName(self):
+        return InputStream('').name
+
+    '''
+     * 把整个输入切成 Token 的列表，最后一个是EOF，同时存到 self.tokens 里。遇到词法错误返回None
+    '''
+    def tokenize(self):
+        text = self.text
+        groupTypes = RegexLexer.GROUP_TYPES
+        literalTypes = RegexLexer.LITERAL_TYPES
+        hiddenTypes = RegexLexer.HIDDEN_TYPES
+        opGroup = RegexLexer.OP_GROUP
+        identifierGroup = RegexLexer.IDENTIFIER_GROUP
+        source = self._tokenFactorySourcePair
+        tokens = []
+        append = tokens.append
+        line = 1
+        lineStart = 0  # 当前行第一个字符的位置
+        pos = 0
+        for m in RegexLexer.PATTERN.finditer(text):
+            start = m.start()
+            if start != pos:
+                return None  # 中间有匹配不上的字符
+            pos = m.end()
+            group = m.lastindex
+            value = m.group()
+            if group == opGroup:
+                type = literalTypes[value]
+            elif group == identifierGroup:
+                type = literalTypes.get(value, PlayScriptParser.IDENTIFIER)
+            else:
+                type = groupTypes[group]
+            self.line = line
+            self.column = start - lineStart
+            token = CommonToken(source, type, Token.HIDDEN_CHANNEL if type in hiddenTypes else Token.DEFAULT_CHANNEL, start, pos - 1)
+            token.text = value
+            append(token)
+            # 只有空白和块注释里可能有换行
+            if type == PlayScriptParser.WS or type == PlayScriptParser.COMMENT:
+                newlines = value.count('\n')
+                if newlines:
+                    line += newlines
+                    lineStart = start + value.rindex('\n') + 1
+        if pos != len(text):
+            return None
+        self.line = line
+        self.column = pos - lineStart
+        eof = CommonToken(source, Token.EOF, Token.DEFAULT_CHANNEL, pos, pos - 1)
+        eof.text = '<EOF>'
+        append(eof)
+        self.tokens = tokens
+        return tokens
+
+    # TokenSource 的接口，供 CommonTokenStream 调用
+    def nextToken(self):
+        if self.tokens is None:
+            self.tokenize()
+        token = self.tokens[self.index]
+        if self.index < len(self.tokens) - 1:
+            self.index += 1
+        return token
+
+
+'''
+ * 用 PlayScriptLexer 得到所有的 Token，用来跟 RegexLexer 比较
+'''
+def antlrTokens(text:str):
+    from PlayScriptLexer import PlayScriptLexer
+    lexer = PlayScriptLexer(InputStream(text))
+    lexer.removeErrorListeners()
+    tokens = []
+    while True:
+        token = lexer.nextToken()
+        tokens.append(token)
+        if token.type == Token.EOF:
+            return tokens
+
+
+def tokenSignature(token:Token):
+    return (token.type, token.channel, token.start, token.stop, token.line, token.column, token.text)
+
+
+'''
+ * 差分检查：对每个文件，RegexLexer 的结果要么跟 PlayScriptLexer 完全一样，要么返回None（PlayScriptLexer 报了词法错误）
+'''
+def check(paths:List[str]) -> bool:
+    from PlayScriptLexer import PlayScriptLexer
+    ok = True
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as fin:
+            text = fin.read()
+        tokens = RegexLexer(text).tokenize()
+        expected = antlrTokens(text)
+        if tokens is None:
+            # 只有在 PlayScriptLexer 也遇到词法错误时才允许放弃
+            lexer = PlayScriptLexer(InputStream(text))
+            lexer.removeErrorListeners()
+            errors = []
+            lexer.notifyListeners = lambda e: errors.append(e)
+            lexer.getAllTokens()
+            if not errors:
+                print('FAIL %s: RegexLexer gave up on a valid input' % path)
+                ok = False
+            continue
+        for i in range(max(len(tokens), len(expected))):
+            a = tokenSignature(tokens[i]) if i < len(tokens) else None
+            b = tokenSignature(expected[i]) if i < len(expected) else None
+            if a != b:
+                print('FAIL %s: token %d is %s, expected %s' % (path, i, a, b))
+                ok = False
+                break
+    print('%d files, %s' % (len(paths), 'all the same' if ok else 'FAILED'))
+    return ok
+
+
+'''
+ * 性能测试：把文件重复拼接到至少 size 个字符，比较两种词法分析器每秒处理的 Token 数
+'''
+def benchmark(paths:List[str], size:int):
+    text = ''
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as fin:
+            text += fin.read() + '\n'
+    text = text * (size // max(len(text), 1) + 1)
+    print('input: %d chars' % len(text))
+    for name, lex in (('RegexLexer', lambda: RegexLexer(text).tokenize()), ('PlayScriptLexer', lambda: antlrTokens(text))):
+        start = time.perf_counter()
+        tokens = lex()
+        seconds = time.perf_counter() - start
+        print('%-16s %9d tokens %8.3f s %12.0f tokens/s' % (name, len(tokens), seconds, len(tokens) / seconds))
+
+
+def scriptsUnder(paths:List[str]) -> List[str]:
+    rtn = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                rtn.extend(os.path.join(root, f) for f in sorted(files) if f.endswith('.play'))
+        else:
+            rtn.append(path)
+    return rtn
+
+
+# 用法：
+# python regex_lexer.py -check <文件或目录...>
+# python regex_lexer.py -bench <文件或目录...> [-size 字符数]
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    size = 4 * 1024 * 1024
+    if '-size' in args:
+        i = args.index('-size')
+        size = int(args[i + 1])
+        del args[i:i + 2]
+    if args and args[0] == '-check':
+        sys.exit(0 if check(scriptsUnder(args[1:])) else 1)
+    elif args and args[0] == '-bench':
+        benchmark(scriptsUnder(args[1:]), size)
+    else:
+        print('usage: regex_lexer.py -check|-bench <files or directories> [-size chars]')